@@ -0,0 +1 @@
+# Micro-benchmarks: run from the repo root as python -m bench.<name>
@@ -0,0 +1,112 @@
+"""
+Bencode benchmark: previous recursive codec vs core.bencode, on DHT-packet-sized messages and on
+multi-MB .torrent-like dicts.
+Usage: python -m bench.bencode
+"""
+import os
+import time
+
+from core.bencode import decode, encode
+
+
+def _old_decode(data):
+    def _decode(i):
+        if data[i:i+1] == b'i':
+            i += 1
+            end = data.index(b'e', i)
+            return int(data[i:end]), end + 1
+        if data[i:i+1] == b'l':
+            i += 1
+            lst = []
+            while data[i:i+1] != b'e':
+                val, i = _decode(i)
+                lst.append(val)
+            return lst, i + 1
+        if data[i:i+1] == b'd':
+            i += 1
+            d = {}
+            while data[i:i+1] != b'e':
+                key, i = _decode(i)
+                val, i = _decode(i)
+                d[key] = val
+            return d, i + 1
+        colon = data.index(b':', i)
+        length = int(data[i:colon])
+        start = colon + 1
+        end = start + length
+        return data[start:end], end
+    result, _ = _decode(0)
+    return result
+
+
+def _old_encode(obj):
+    if isinstance(obj, int):
+        return b'i' + str(obj).encode() + b'e'
+    if isinstance(obj, bytes):
+        return str(len(obj)).encode() + b':' + obj
+    if isinstance(obj, list):
+        return b'l' + b''.join(_old_encode(i) for i in obj) + b'e'
+    if isinstance(obj, dict):
+        out = b'd'
+        for k in sorted(obj.keys()):
+            out += _old_encode(k) + _old_encode(obj[k])
+        return out + b'e'
+    raise TypeError("Unsupported type")
+
+
+def _dht_response():
+    return {
+        b"t": b"aa",
+        b"y": b"r",
+        b"r": {
+            b"id": os.urandom(20),
+            b"token": os.urandom(8),
+            b"nodes": os.urandom(26 * 8),
+            b"values": [os.urandom(6) for _ in range(20)],
+        },
+    }
+
+
+def _torrent(num_files, num_pieces):
+    return {
+        b"announce": b"http://tracker.example/announce",
+        b"info": {
+            b"name": b"payload",
+            b"piece length": 262144,
+            b"pieces": os.urandom(20 * num_pieces),
+            b"files": [
+                {b"length": 1000 + i, b"path": [b"dir%d" % (i % 50), b"file%d.bin" % i]}
+                for i in range(num_files)
+            ],
+        },
+    }
+
+
+def _time(fn, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    cases = [
+        ("dht packet", _dht_response(), 20000),
+        ("torrent 2 MB", _torrent(2000, 100000), 5),
+        ("torrent 8 MB, 50k files", _torrent(50000, 300000), 2),
+    ]
+    print(f"{'case':26s} {'size':>10s} {'old dec':>10s} {'new dec':>10s} {'old enc':>10s} {'new enc':>10s}  (us/op)")
+    for name, obj, repeat in cases:
+        data = encode(obj)
+        assert data == _old_encode(obj) and decode(data) == _old_decode(data) == obj
+        times = [
+            _time(_old_decode, data, repeat),
+            _time(decode, data, repeat),
+            _time(_old_encode, obj, repeat),
+            _time(encode, obj, repeat),
+        ]
+        print(f"{name:26s} {len(data):10d} " + " ".join(f"{t * 1e6:10.0f}" for t in times))
+
+
+if __name__ == "__main__":
+    main()
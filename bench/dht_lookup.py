@@ -0,0 +1,139 @@
+"""
+DHT lookup benchmark on an in-process simulated DHT: the old one-shot get_peers (ask the
+bootstrap routers, take whatever values come back) vs iterative Kademlia lookups with alpha
+concurrency. Every simulated node has a RoutingTable; the k nodes closest to each info hash store
+its peers. Queries see random latency and loss, scaled down so a run takes seconds.
+Usage: python -m bench.dht_lookup
+"""
+import asyncio
+import os
+import random
+import socket
+import struct
+import time
+
+from dht.lookup import Lookup, encode_nodes
+from dht.routing import K, RoutingTable, to_int
+
+NUM_NODES = 5000
+CONTACTS = 60  # random contacts each simulated node learns besides its nearest neighbours
+LATENCY = (0.005, 0.040)  # seconds, uniform
+LOSS = 0.1
+TIMEOUT = 0.2  # what an unanswered query costs
+LOOKUPS = 40
+OLD_WAIT = 5.0  # the old get_peers collected answers for a fixed 5 s
+
+
+class SimDHT:
+    def __init__(self, num_nodes, rng):
+        self.rng = rng
+        self.ids = [os.urandom(20) for _ in range(num_nodes)]
+        self.addrs = [(socket.inet_ntoa(struct.pack("!I", 0x0A000000 + i)), 6881) for i in range(num_nodes)]
+        self.by_addr = dict(zip(self.addrs, range(num_nodes)))
+        self.tables = [RoutingTable(node_id) for node_id in self.ids]
+        self.store = {}  # node index -> {info_hash: [peers]}
+        order = sorted(range(num_nodes), key=lambda i: to_int(self.ids[i]))
+        for pos, i in enumerate(order):
+            # Numerically adjacent IDs share the longest prefixes: stand-ins for the nearest neighbours.
+            near = order[max(0, pos - K):pos] + order[pos + 1:pos + 1 + K]
+            for j in near + rng.sample(range(num_nodes), CONTACTS):
+                if j != i:
+                    self.tables[i].add(self.ids[j], self.addrs[j])
+        self.queries = 0
+
+    def closest_indices(self, target, count=K):
+        value = to_int(target)
+        return sorted(range(len(self.ids)), key=lambda i: to_int(self.ids[i]) ^ value)[:count]
+
+    def publish(self, info_hash, peers):
+        for i in self.closest_indices(info_hash):
+            self.store.setdefault(i, {})[info_hash] = peers
+
+    async def query(self, addr, method, args):
+        self.queries += 1
+        i = self.by_addr[addr]
+        if self.rng.random() < LOSS:
+            await asyncio.sleep(TIMEOUT)
+            raise asyncio.TimeoutError
+        await asyncio.sleep(self.rng.uniform(*LATENCY))
+        target = args.get(b"info_hash") or args[b"target"]
+        r = {b"id": self.ids[i]}
+        stored = self.store.get(i, {}).get(target) if method == b"get_peers" else None
+        if stored:
+            r[b"values"] = [socket.inet_aton(ip) + struct.pack("!H", port) for ip, port in stored]
+        else:
+            r[b"nodes"] = encode_nodes((n.id, n.addr) for n in self.tables[i].closest(target))
+        if method == b"get_peers":
+            r[b"token"] = b"tk"
+        return r
+
+
+async def _old_get_peers(sim, info_hash, bootstrap):
+    """Previous DHTNode.get_peers: one query to each bootstrap router, no follow-up."""
+    answers = await asyncio.gather(
+        *(sim.query(sim.addrs[b], b"get_peers", {b"info_hash": info_hash}) for b in bootstrap),
+        return_exceptions=True,
+    )
+    return [a for a in answers if isinstance(a, dict) and b"values" in a]
+
+
+async def _iterative(sim, client, info_hash, alpha):
+    seeds = [(n.id, n.addr) for n in client.closest(info_hash)]
+    lookup = Lookup(info_hash, sim.query, seeds, routing=client, alpha=alpha)
+    start = time.perf_counter()
+    first = None
+    async for _ in lookup.results():
+        if first is None:
+            first = time.perf_counter() - start
+    return lookup, first, time.perf_counter() - start
+
+
+async def _main():
+    rng = random.Random(1)
+    build = time.perf_counter()
+    sim = SimDHT(NUM_NODES, rng)
+    print(f"simulated DHT: {NUM_NODES} nodes, built in {time.perf_counter() - build:.1f}s; "
+          f"latency {LATENCY[0] * 1000:.0f}-{LATENCY[1] * 1000:.0f} ms, loss {LOSS:.0%}")
+    hashes = [os.urandom(20) for _ in range(LOOKUPS)]
+    for n, info_hash in enumerate(hashes):
+        sim.publish(info_hash, [("192.0.2.1", 10000 + n)])
+    bootstrap = rng.sample(range(NUM_NODES), 2)
+
+    found = 0
+    for info_hash in hashes:
+        found += bool(await _old_get_peers(sim, info_hash, bootstrap))
+    print(f"\none-shot (bootstrap only): found peers for {found}/{LOOKUPS}, "
+          f"each call waits {OLD_WAIT:.0f}s")
+
+    # Our node joins through the same two routers with a find_node lookup for its own ID.
+    client = RoutingTable(os.urandom(20))
+    join = Lookup(client.own_id, sim.query, [(sim.ids[b], sim.addrs[b]) for b in bootstrap],
+                  method=b"find_node", routing=client)
+    await join.run()
+    print(f"bootstrap find_node: {join.queries} queries, routing table {len(client)} nodes\n")
+
+    print(f"{'alpha':>5s} {'found':>7s} {'queries':>8s} {'first peer (ms)':>16s} {'converged (ms)':>15s}")
+    for alpha in (1, 3, 8):
+        found = queries = 0
+        firsts, totals = [], []
+        # Concurrent lookups: latency is simulated with sleeps, so they do not slow each other.
+        runs = await asyncio.gather(*(_iterative(sim, client, info_hash, alpha) for info_hash in hashes))
+        for lookup, first, total in runs:
+            queries += lookup.queries
+            totals.append(total)
+            if first is not None:
+                found += 1
+                firsts.append(first)
+        firsts.sort()
+        totals.sort()
+        median_first = firsts[len(firsts) // 2] * 1000 if firsts else float("nan")
+        print(f"{alpha:5d} {found:3d}/{LOOKUPS:<3d} {queries / LOOKUPS:8.1f} "
+              f"{median_first:16.0f} {totals[len(totals) // 2] * 1000:15.0f}")
+
+
+def main():
+    asyncio.run(_main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Receive-path benchmark: old bytes buffer + parse_messages vs FrameBuffer, in MB/s of PIECE data.
+Usage: python -m bench.framing [megabytes]
+"""
+import struct
+import sys
+import time
+
+from core.framing import FrameBuffer, READ_SIZE
+from core.messages import PIECE, build_message, parse_messages
+from core.piece import BLOCK_SIZE
+
+
+def _stream(megabytes):
+    block = bytes(BLOCK_SIZE)
+    count = megabytes * 1024 * 1024 // BLOCK_SIZE
+    msgs = [build_message(PIECE, struct.pack("!II", i // 16, (i % 16) * BLOCK_SIZE) + block) for i in range(count)]
+    return b"".join(msgs), count * BLOCK_SIZE
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def bench_parse_messages(data):
+    buffer = b""
+    received = 0
+    for chunk in _chunks(data, 4096):
+        buffer += chunk
+        messages, buffer = parse_messages(buffer)
+        for msg_id, payload in messages:
+            if msg_id == PIECE:
+                received += len(payload[8:])
+    return received
+
+
+def bench_frame_buffer(data):
+    frames = FrameBuffer()
+    received = 0
+    for chunk in _chunks(data, READ_SIZE):
+        frames.feed(chunk)
+        for msg_id, payload in frames.messages():
+            if msg_id == PIECE:
+                received += len(payload[8:])
+    return received
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    data, payload_bytes = _stream(megabytes)
+    for name, fn in (("parse_messages", bench_parse_messages), ("FrameBuffer", bench_frame_buffer)):
+        start = time.perf_counter()
+        received = fn(data)
+        elapsed = time.perf_counter() - start
+        assert received == payload_bytes
+        print(f"{name:16s} {payload_bytes / elapsed / 1e6:10.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Piece selection benchmark: per-call sort (old next_piece) vs availability-bucket index, and for a
+peer with a partial bitfield, a per-piece scan of each bucket vs the bucket bitmaps.
+Usage: python -m bench.piece_selection
+"""
+import os
+import time
+
+from core.piece_manager import Bitfield, PieceManager
+
+
+class _FakeTorrent:
+    def __init__(self, num_pieces, piece_length=262144):
+        self.num_pieces = num_pieces
+        self.piece_length = piece_length
+        self.length = num_pieces * piece_length
+        self.pieces = bytes(20 * num_pieces)
+
+
+def _sorted_next_piece(pm):
+    """The previous implementation: build and sort every candidate on each call."""
+    candidates = [
+        p for p in pm.pieces
+        if p.index not in pm.completed and p.index not in pm.in_progress
+    ]
+    if not candidates:
+        return None
+    candidates.sort(key=lambda p: pm.availability[p.index])
+    piece = candidates[0]
+    pm.in_progress.add(piece.index)
+    return piece
+
+
+def _scan_next_piece(pm, has):
+    """The previous next_piece(has): test every piece of each bucket against the peer's Bitfield."""
+    for availability, bucket in enumerate(pm._buckets):
+        index = next((i for i in bucket if i in has), None)
+        if index is not None:
+            pm._bucket_discard(availability, index)
+            pm.in_progress.add(index)
+            return pm.pieces[index]
+    return None
+
+
+def _run(num_pieces, select, calls, sparse=False):
+    pm = PieceManager(_FakeTorrent(num_pieces))
+    for _ in range(20):
+        pm.update_availability(os.urandom((num_pieces + 7) // 8))
+    args = ()
+    if sparse:
+        # A peer with about one piece in 16, as a partial seed early in its download.
+        has = Bitfield(num_pieces)
+        has.update(bytes(a & b & c & d for a, b, c, d in zip(*(os.urandom(len(has.bits)) for _ in range(4)))))
+        args = (has,)
+    start = time.perf_counter()
+    for _ in range(calls):
+        piece = select(pm, *args)
+        if piece is None:
+            break
+        pm.mark_completed(piece.index)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    print(
+        f"{'pieces':>8s} {'sort (us/call)':>16s} {'index (us/call)':>16s}"
+        f" {'has: scan':>12s} {'has: bitmap':>12s}"
+    )
+    for num_pieces in (1000, 10000, 50000, 200000):
+        calls = max(5, 200000 // num_pieces)
+        old = _run(num_pieces, _sorted_next_piece, calls)
+        new = _run(num_pieces, PieceManager.next_piece, 1000)
+        scan = _run(num_pieces, _scan_next_piece, calls, sparse=True)
+        bitmap = _run(num_pieces, PieceManager.next_piece, calls, sparse=True)
+        print(f"{num_pieces:8d} {old * 1e6:16.1f} {new * 1e6:16.2f} {scan * 1e6:12.1f} {bitmap * 1e6:12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Loopback receive benchmark: asyncio streams vs the BufferedProtocol transport (core.wire), both
+through PeerConnection.recv(), plus WireProtocol with callback dispatch. A sender process streams
+PIECE messages to every connection; reported are throughput and receiver CPU time per MB.
+Usage: python -m bench.wire [megabytes] [peers]
+"""
+import asyncio
+import multiprocessing
+import struct
+import sys
+import time
+
+from core import wire
+from core.messages import PIECE, build_message
+from core.peer_connection import PeerConnection
+from core.piece import BLOCK_SIZE
+
+HOST = "127.0.0.1"
+INFO_HASH = bytes(20)
+HANDSHAKE = bytes([19]) + b"BitTorrent protocol" + bytes(8) + INFO_HASH + b"-BENCH0-000000000000"
+
+
+def _payload(megabytes):
+    block = bytes(BLOCK_SIZE)
+    count = max(1, megabytes * 1024 * 1024 // BLOCK_SIZE)
+    msgs = [build_message(PIECE, struct.pack("!II", i // 16, (i % 16) * BLOCK_SIZE) + block) for i in range(count)]
+    return b"".join(msgs), count * BLOCK_SIZE
+
+
+def _sender(port_queue, megabytes_per_peer):
+    data, _ = _payload(megabytes_per_peer)
+
+    async def handle(reader, writer):
+        await reader.readexactly(68)
+        writer.write(HANDSHAKE)
+        view = memoryview(data)
+        for i in range(0, len(view), 1024 * 1024):
+            writer.write(view[i:i + 1024 * 1024])
+            await writer.drain()
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, HOST, 0)
+        port_queue.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+async def _recv_all(conn):
+    received = 0
+    try:
+        while True:
+            for msg_id, payload in await conn.recv():
+                if msg_id == PIECE:
+                    received += len(payload) - 8
+    except ConnectionError:
+        return received
+
+
+async def recv_streams(port):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(HANDSHAKE)
+    await reader.readexactly(68)
+    received = await _recv_all(PeerConnection(reader, writer))
+    writer.close()
+    return received
+
+
+async def recv_protocol(port):
+    protocol = await wire.open_connection(HOST, port)
+    protocol.write(HANDSHAKE)
+    await protocol.read_handshake()
+    received = await _recv_all(PeerConnection(protocol, protocol))
+    protocol.close()
+    return received
+
+
+async def recv_callbacks(port):
+    received = 0
+    closed = asyncio.get_running_loop().create_future()
+
+    def on_message(msg_id, payload):
+        nonlocal received
+        if msg_id == PIECE:
+            received += len(payload) - 8
+
+    protocol = await wire.open_connection(
+        HOST, port, on_message=on_message, on_close=lambda p, exc: closed.set_result(None),
+    )
+    protocol.write(HANDSHAKE)
+    await closed
+    return received
+
+
+async def _run(fn, port, peers):
+    return sum(await asyncio.gather(*(fn(port) for _ in range(peers))))
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    peers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    per_peer = max(1, megabytes // peers)
+    _, expected = _payload(per_peer)
+
+    port_queue = multiprocessing.Queue()
+    sender = multiprocessing.Process(target=_sender, args=(port_queue, per_peer), daemon=True)
+    sender.start()
+    port = port_queue.get()
+    try:
+        print(f"{peers} peer(s) x {per_peer} MB")
+        for name, fn in (("streams", recv_streams), ("protocol", recv_protocol), ("callbacks", recv_callbacks)):
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            received = asyncio.run(_run(fn, port, peers))
+            cpu = time.process_time() - cpu
+            wall = time.perf_counter() - wall
+            assert received == expected * peers, (received, expected * peers)
+            mb = received / 1e6
+            print(f"{name:10s} {mb / wall:10.1f} MB/s {cpu / mb * 1000:8.3f} ms CPU/MB")
+    finally:
+        sender.terminate()
+
+
+if __name__ == "__main__":
+    main()
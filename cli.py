@@ -9,14 +9,77 @@ import sys
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+LIMIT_COMMANDS = {
+    "up": "upload", "down": "download", "peer-up": "peer_upload", "peer-down": "peer_download",
+}
+
+
+def _watch_limit_commands(limits):
+    """
+    Change rate limits while running: lines like "up 500", "down 0" or "peer-up 50" on stdin
+    (KiB/s, 0 = unlimited). Only when stdin is a terminal and the loop can watch it.
+    """
+    if not sys.stdin.isatty():
+        return
+
+    def on_line():
+        words = sys.stdin.readline().split()
+        if len(words) != 2 or words[0] not in LIMIT_COMMANDS or not words[1].isdigit():
+            print(f"Usage: {' | '.join(LIMIT_COMMANDS)} <KiB/s>", file=sys.stderr)
+            return
+        rate = int(words[1]) * 1024
+        name = LIMIT_COMMANDS[words[0]]
+        if name.startswith("peer_"):
+            limits.set_peer_rates(**{name[5:]: rate})
+        else:
+            limits.set_rates(**{name: rate})
+        print(f"{words[0]} limit: {words[1] + ' KiB/s' if rate else 'unlimited'}", file=sys.stderr)
+
+    try:
+        asyncio.get_running_loop().add_reader(sys.stdin.fileno(), on_line)
+    except (NotImplementedError, OSError):
+        pass
+
 
 def main():
     parser = argparse.ArgumentParser(description="BitTorrent client (pybittorrent)")
     parser.add_argument("command", nargs="?", default="download", help="download | seed")
     parser.add_argument("target", nargs="?", help=".torrent file or magnet link")
-    parser.add_argument("-o", "--output", default="download.bin", help="Output file (download) or path to file (seed)")
+    parser.add_argument("-o", "--output", default="download.bin", help="Output file, or directory for multi-file torrents (download / seed)")
     parser.add_argument("-j", "--jobs", type=int, default=20, help="Max concurrent peers")
     parser.add_argument("--no-dht", action="store_true", help="Disable DHT peer discovery")
+    parser.add_argument(
+        "--dht-cache", metavar="FILE", default=None,
+        help="Keep the DHT node ID and good nodes in FILE, so later runs bootstrap from them",
+    )
+    parser.add_argument(
+        "--max-requests", type=int, default=250,
+        help="Max outstanding block requests per peer (pipeline depth cap)",
+    )
+    parser.add_argument(
+        "--fsync", choices=["never", "close", "interval", "always"], default="close",
+        help="When downloaded data is fsynced to disk",
+    )
+    parser.add_argument("--no-resume", action="store_true", help="Ignore existing data and resume file")
+    parser.add_argument("--hash-threads", type=int, default=None, help="Threads for SHA-1 piece verification")
+    parser.add_argument(
+        "--metadata-cache", metavar="DIR", default=None,
+        help="Cache parsed .torrent metadata in DIR (skips re-parsing on later runs)",
+    )
+    parser.add_argument(
+        "--wire-protocol", action="store_true",
+        help="Use the BufferedProtocol peer transport instead of asyncio streams",
+    )
+    parser.add_argument("--cache-mb", type=int, default=64, help="Seed: piece read cache size in MiB")
+    parser.add_argument("--sendfile", action="store_true", help="Seed: send uncached blocks with sendfile (zero-copy)")
+    parser.add_argument("--upload-slots", type=int, default=4, help="Peers unchoked for upload at a time")
+    parser.add_argument(
+        "--rechoke-interval", type=float, default=10.0, help="Seconds between upload slot reassignments",
+    )
+    parser.add_argument("--max-upload", type=int, default=0, help="Upload limit in KiB/s (0 = unlimited)")
+    parser.add_argument("--max-download", type=int, default=0, help="Download limit in KiB/s (0 = unlimited)")
+    parser.add_argument("--peer-max-upload", type=int, default=0, help="Per-peer upload limit in KiB/s")
+    parser.add_argument("--peer-max-download", type=int, default=0, help="Per-peer download limit in KiB/s")
     parser.add_argument("-p", "--port", type=int, default=6881, help="Port for listen (seed) or announce")
     args = parser.parse_args()
 
@@ -27,13 +90,25 @@ def main():
     target = args.target.strip()
     use_dht = not args.no_dht
 
+    from engine.ratelimit import RateLimits
+    rate_limits = RateLimits(
+        upload=args.max_upload * 1024, download=args.max_download * 1024,
+        peer_upload=args.peer_max_upload * 1024, peer_download=args.peer_max_download * 1024,
+    )
+
     if args.command == "seed":
         if not os.path.isfile(target):
             print(f"Not a file: {target}", file=sys.stderr)
             return 1
         async def run_seed():
             from engine.seeder import run_seeder
-            await run_seeder(target, args.output, port=args.port)
+            _watch_limit_commands(rate_limits)
+            await run_seeder(
+                target, args.output, port=args.port,
+                cache_bytes=args.cache_mb * 1024 * 1024, zero_copy=args.sendfile,
+                upload_slots=args.upload_slots, rechoke_interval=args.rechoke_interval,
+                rate_limits=rate_limits,
+            )
         try:
             asyncio.run(run_seed())
         except KeyboardInterrupt:
@@ -44,25 +119,54 @@ def main():
         parser.print_help()
         return 1
 
-    async def run_download():
+    def on_recheck_progress(done, total):
+        print(f"\rRechecking: {done * 100 // total}%", end="" if done < total else "\n", file=sys.stderr)
+
+    async def fetch(dht):
         from engine.downloader import download, download_magnet
+        _watch_limit_commands(rate_limits)
         if target.startswith("magnet:"):
             path, err = await download_magnet(
                 target,
                 download_path=args.output,
                 max_workers=args.jobs,
                 port=args.port,
+                max_pipeline_depth=args.max_requests,
+                fsync=args.fsync,
+                hash_threads=args.hash_threads,
+                resume=not args.no_resume,
+                on_recheck_progress=on_recheck_progress,
+                wire_protocol=args.wire_protocol,
+                upload_slots=args.upload_slots,
+                rechoke_interval=args.rechoke_interval,
+                rate_limits=rate_limits,
+                dht=dht,
             )
         else:
             if not os.path.isfile(target):
                 print(f"Not a file: {target}", file=sys.stderr)
                 return 1
+            metadata_cache = None
+            if args.metadata_cache:
+                from core.metacache import MetadataCache
+                metadata_cache = MetadataCache(args.metadata_cache)
             path, err = await download(
                 target,
                 download_path=args.output,
                 max_workers=args.jobs,
                 use_dht=use_dht,
                 port=args.port,
+                max_pipeline_depth=args.max_requests,
+                fsync=args.fsync,
+                hash_threads=args.hash_threads,
+                resume=not args.no_resume,
+                on_recheck_progress=on_recheck_progress,
+                metadata_cache=metadata_cache,
+                wire_protocol=args.wire_protocol,
+                upload_slots=args.upload_slots,
+                rechoke_interval=args.rechoke_interval,
+                rate_limits=rate_limits,
+                dht=dht,
             )
         if err:
             print(f"Error: {err}", file=sys.stderr)
@@ -73,6 +177,25 @@ def main():
         print("Download incomplete (no peers or interrupted).", file=sys.stderr)
         return 1
 
+    async def run_download():
+        dht = None
+        if args.dht_cache and (use_dht or target.startswith("magnet:")):
+            from dht.node import DHTNode
+            try:
+                dht = DHTNode(port=args.port + 1, cache_path=args.dht_cache)
+                # Join in the background: until the table fills, lookups start from the routers too.
+                await dht.start(bootstrap=True)
+            except OSError as e:
+                if dht is not None:
+                    dht.close()
+                    dht = None
+                print(f"DHT node cache not used: {e}", file=sys.stderr)
+        try:
+            return await fetch(dht)
+        finally:
+            if dht is not None:
+                dht.close()  # saves the node cache
+
     return asyncio.run(run_download())
 
 
@@ -1,81 +1,149 @@
-def decode(data):
-    def _decode(i):
-        if data[i:i+1] == b'i':
-            i += 1
-            end = data.index(b'e', i)
-            return int(data[i:end]), end + 1
-
-        if data[i:i+1] == b'l':
-            i += 1
-            lst = []
-            while data[i:i+1] != b'e':
-                val, i = _decode(i)
-                lst.append(val)
-            return lst, i + 1
-
-        if data[i:i+1] == b'd':
-            i += 1
-            d = {}
-            while data[i:i+1] != b'e':
-                key, i = _decode(i)
-                val, i = _decode(i)
-                d[key] = val
-            return d, i + 1
-
-        colon = data.index(b':', i)
-        length = int(data[i:colon])
-        start = colon + 1
-        end = start + length
-        return data[start:end], end
-
-    result, _ = _decode(0)
-    return result
-
-
-def decode_one(data, start=0):
-    """Decode one value; return (value, end_index). Use to parse dict + trailing bytes."""
-    def _decode(i):
-        if data[i:i+1] == b'i':
-            i += 1
-            end = data.index(b'e', i)
-            return int(data[i:end]), end + 1
-        if data[i:i+1] == b'l':
-            i += 1
-            lst = []
-            while data[i:i+1] != b'e':
-                val, i = _decode(i)
-                lst.append(val)
-            return lst, i + 1
-        if data[i:i+1] == b'd':
-            i += 1
-            d = {}
-            while data[i:i+1] != b'e':
-                key, i = _decode(i)
-                val, i = _decode(i)
-                d[key] = val
-            return d, i + 1
-        colon = data.index(b':', i)
-        length = int(data[i:colon])
-        s = colon + 1
-        e = s + length
-        return data[s:e], e
-    return _decode(start)
+"""
+Bencode codec. decode() is iterative (no recursion limit, explicit depth limit) and dispatches on
+the byte value at each position instead of comparing one-byte slices; strings, integers and
+containers are located with C-level bytes.index. encode() writes into a single bytearray.
 
+Input from the network is untrusted: nesting depth, input size and integer width are bounded, and
+strict=True additionally rejects non-canonical encodings (leading zeros, -0, unsorted or duplicate
+dict keys, trailing data).
+"""
+MAX_DEPTH = 64
+MAX_INT_DIGITS = 32
+
+_INT, _LIST, _DICT, _END = b"ilde"
+
+
+class BencodeError(ValueError):
+    pass
+
+
+def _valid_int(digits, strict):
+    if len(digits) > MAX_INT_DIGITS:
+        return False
+    body = digits[1:] if digits[:1] == b"-" else digits
+    if not body.isdigit():
+        return False
+    return not strict or ((len(body) == 1 or body[0] != 0x30) and digits != b"-0")
 
-def encode(obj):
-    if isinstance(obj, int):
-        return b'i' + str(obj).encode() + b'e'
 
-    if isinstance(obj, bytes):
-        return str(len(obj)).encode() + b':' + obj
+def decode_one(data, start=0, max_depth=MAX_DEPTH, max_size=None, strict=False, spans=None):
+    """
+    Decode one value starting at start; return (value, end_index). Use to parse dict + trailing bytes.
+    data may be bytes, bytearray or memoryview (non-bytes input is copied once).
+    If spans is a dict and the value is a dict, spans[key] = (start, end) is recorded for each of its
+    values, so callers can hash the raw bytes of e.g. b"info" without re-encoding.
+    """
+    if max_size is not None and len(data) > max_size:
+        raise BencodeError(f"Input of {len(data)} bytes exceeds limit of {max_size}")
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    size = len(data)
+    index = data.index
+    stack = []  # open containers
+    keys = []  # per open container: pending dict key (None for lists / no key yet)
+    last_keys = []  # per open container: previous dict key, for strict ordering
+    pos = start
+    value_start = start
 
-    if isinstance(obj, list):
-        return b'l' + b''.join(encode(i) for i in obj) + b'e'
+    try:
+        while True:
+            if spans is not None and len(stack) == 1 and keys[0] is not None:
+                value_start = pos
+            c = data[pos]
+            if c == _DICT or c == _LIST:
+                if len(stack) >= max_depth:
+                    raise BencodeError(f"Nesting deeper than {max_depth}")
+                stack.append({} if c == _DICT else [])
+                keys.append(None)
+                last_keys.append(None)
+                pos += 1
+                continue
+            if c == _END:
+                if not stack:
+                    raise BencodeError(f"Unexpected end marker at offset {pos}")
+                if keys[-1] is not None:
+                    raise BencodeError(f"Dict key without value before offset {pos}")
+                value = stack.pop()
+                keys.pop()
+                last_keys.pop()
+                pos += 1
+            elif c == _INT:
+                end = index(b"e", pos + 1)
+                digits = data[pos + 1:end]
+                if not _valid_int(digits, strict):
+                    raise BencodeError(f"Invalid integer at offset {pos}")
+                value = int(digits)
+                pos = end + 1
+            else:
+                colon = index(b":", pos)
+                digits = data[pos:colon]
+                if not digits.isdigit() or len(digits) > MAX_INT_DIGITS or (
+                    strict and len(digits) > 1 and digits[0] == 0x30
+                ):
+                    raise BencodeError(f"Invalid string length at offset {pos}")
+                pos = colon + 1
+                end = pos + int(digits)
+                if end > size:
+                    raise BencodeError(f"String at offset {colon} runs past end of input")
+                value = data[pos:end]
+                pos = end
 
-    if isinstance(obj, dict):
-        out = b'd'
-        for k in sorted(obj.keys()):
-            out += encode(k) + encode(obj[k])
-        return out + b'e'
+            if not stack:
+                return value, pos
+            top = stack[-1]
+            if type(top) is list:
+                top.append(value)
+            elif keys[-1] is None:
+                if type(value) is not bytes:
+                    raise BencodeError(f"Dict key is not a string before offset {pos}")
+                if strict and last_keys[-1] is not None and value <= last_keys[-1]:
+                    raise BencodeError(f"Unsorted or duplicate dict key before offset {pos}")
+                keys[-1] = value
+            else:
+                top[keys[-1]] = value
+                if spans is not None and len(stack) == 1:
+                    spans[keys[0]] = (value_start, pos)
+                last_keys[-1] = keys[-1]
+                keys[-1] = None
+    except IndexError:
+        raise BencodeError("Truncated input") from None
+    except BencodeError:
+        raise
+    except ValueError:
+        # bytes.index found no terminator
+        raise BencodeError(f"Truncated input near offset {pos}") from None
 
-    raise TypeError("Unsupported type")
+
+def decode(data, max_depth=MAX_DEPTH, max_size=None, strict=False, spans=None):
+    """Decode a bencoded value (bytes, bytearray or memoryview). spans: see decode_one."""
+    value, end = decode_one(data, 0, max_depth=max_depth, max_size=max_size, strict=strict, spans=spans)
+    if strict and end != len(data):
+        raise BencodeError(f"Trailing data after offset {end}")
+    return value
+
+
+def _encode(obj, out):
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        out += b"%d:" % len(obj)
+        out += obj
+    elif isinstance(obj, int):
+        out += b"i%de" % obj
+    elif isinstance(obj, list):
+        out += b"l"
+        for item in obj:
+            _encode(item, out)
+        out += b"e"
+    elif isinstance(obj, dict):
+        out += b"d"
+        for k in sorted(obj):
+            _encode(k, out)
+            _encode(obj[k], out)
+        out += b"e"
+    else:
+        raise TypeError("Unsupported type")
+
+
+def encode(obj):
+    out = bytearray()
+    _encode(obj, out)
+    return bytes(out)
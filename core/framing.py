@@ -0,0 +1,109 @@
+"""
+Receive buffer and incremental length-prefixed frame parser for the peer wire protocol.
+
+Bytes land in one reusable bytearray; complete frames are handed out as memoryview slices
+of it, so a PIECE payload reaches the piece buffer without intermediate bytes copies.
+Views handed out by messages() stay valid until the next write that is allowed to compact (the
+default); writes with compact=False go after the data already parsed and never over it.
+"""
+import struct
+
+from .messages import PIECE
+
+READ_SIZE = 65536
+INITIAL_CAPACITY = 256 * 1024
+MAX_FRAME = 2 * 1024 * 1024  # larger than any sane BITFIELD / PIECE / extension message
+
+_LENGTH = struct.Struct("!I")
+
+
+class FrameBuffer:
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._start = 0  # first unparsed byte
+        self._end = 0  # end of received data
+
+    def __len__(self):
+        return self._end - self._start
+
+    def _reserve(self, n, compact=True):
+        """
+        Make room for n more bytes after the received data (compact first, grow if needed).
+        compact=False never moves or overwrites data inside the current buffer, for when views
+        are still in use.
+        """
+        if compact and self._start == self._end:
+            self._start = self._end = 0  # everything parsed: rewind, the views are released
+        if len(self._buf) - self._end >= n:
+            return
+        pending = self._end - self._start
+        if compact and pending + n <= len(self._buf):
+            self._view[:pending] = self._view[self._start:self._end]
+        else:
+            # Fresh buffer instead of resizing: views still held by callers keep the old one alive
+            # until they are released. Without compaction, keep the size unless the pending data
+            # does not fit, so the capacity follows the pending frames, not the bytes received.
+            size = len(self._buf)
+            if compact or pending + n > size:
+                size = max(2 * size, pending + n)
+            buf = bytearray(size)
+            buf[:pending] = self._view[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        self._start = 0
+        self._end = pending
+
+    def writable(self, sizehint=READ_SIZE, compact=True):
+        """Free space of at least sizehint bytes to receive into; call commit(n) afterwards."""
+        self._reserve(sizehint, compact)
+        return self._view[self._end:]
+
+    def commit(self, n):
+        self._end += n
+
+    def take(self, n):
+        """Remove and return the first n unparsed bytes (e.g. the handshake), or None if fewer."""
+        if self._end - self._start < n:
+            return None
+        data = bytes(self._view[self._start:self._start + n])
+        self._start += n
+        return data
+
+    def feed(self, data):
+        """Append received bytes."""
+        n = len(data)
+        self._reserve(n)
+        self._view[self._end:self._end + n] = data
+        self._end += n
+
+    def messages(self, zero_copy=(PIECE,)):
+        """
+        Parse every complete frame. Returns list of (msg_id, payload); keep-alives are (None, None).
+        Payloads of ids in zero_copy are memoryviews into the buffer; others are copied to bytes
+        because callers keep them (bitfields, extension payloads).
+        """
+        messages = []
+        view = self._view
+        pos = self._start
+        end = self._end
+        while end - pos >= 4:
+            length = _LENGTH.unpack_from(view, pos)[0]
+            if length == 0:
+                messages.append((None, None))
+                pos += 4
+                continue
+            if length > MAX_FRAME:
+                raise ConnectionError(f"Frame too large: {length} bytes")
+            if end - pos < 4 + length:
+                break
+            msg_id = view[pos + 4]
+            payload = view[pos + 5:pos + 4 + length]
+            if msg_id not in zero_copy:
+                payload = bytes(payload)
+            messages.append((msg_id, payload))
+            pos += 4 + length
+        # No rewind here even when everything was parsed: the payload views point into the
+        # buffer, and the next compacting _reserve() rewinds once they are released.
+        self._start = pos
+        return messages
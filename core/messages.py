@@ -22,15 +22,36 @@ def build_message(msg_id=None, payload=b""):
     return struct.pack("!I B", length, msg_id) + payload
 
 
+def choke():
+    return build_message(CHOKE)
+
+
+def unchoke():
+    return build_message(UNCHOKE)
+
+
 def interested():
     return build_message(INTERESTED)
 
 
+def not_interested():
+    return build_message(NOT_INTERESTED)
+
+
+def have(index):
+    return build_message(HAVE, struct.pack("!I", index))
+
+
 def request(index, begin, length):
     payload = struct.pack("!III", index, begin, length)
     return build_message(REQUEST, payload)
 
 
+def cancel(index, begin, length):
+    payload = struct.pack("!III", index, begin, length)
+    return build_message(CANCEL, payload)
+
+
 def parse_messages(buffer):
     messages = []
     offset = 0
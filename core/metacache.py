@@ -0,0 +1,152 @@
+"""
+Persistent cache of parsed torrent metadata, so a session loading thousands of .torrent files does
+not re-parse and re-hash each one on every start.
+
+Entries are keyed by info hash (<hex>.meta) in a compact struct-packed format holding only what
+Torrent needs: name, piece length, piece hashes, files, private flag and announce URLs. A small
+link file per .torrent path, keyed by (absolute path, size, mtime), points at the info hash, so a
+changed file is simply parsed again.
+"""
+import hashlib
+import os
+import struct
+
+from .torrent import Torrent
+
+MAGIC = b"PBTM"
+VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pybittorrent", "metadata")
+
+_HEADER = struct.Struct("!4sB20sQBI")  # magic, version, info hash, piece length, flags, file count
+_FLAG_MULTI_FILE = 1
+_FLAG_PRIVATE = 2
+
+
+def _pack_bytes(out, value):
+    out += struct.pack("!I", len(value))
+    out += value
+
+
+def _unpack_bytes(data, pos):
+    (n,) = struct.unpack_from("!I", data, pos)
+    pos += 4
+    return data[pos:pos + n], pos + n
+
+
+def _pack(torrent):
+    info = torrent.info
+    flags = (_FLAG_MULTI_FILE if torrent.multi_file else 0) | (_FLAG_PRIVATE if info.get(b"private") == 1 else 0)
+    files = info[b"files"] if torrent.multi_file else []
+    out = bytearray(_HEADER.pack(MAGIC, VERSION, torrent.info_hash, torrent.piece_length, flags, len(files)))
+    _pack_bytes(out, info.get(b"name", b""))
+    if torrent.multi_file:
+        for f in files:
+            out += struct.pack("!QH", f[b"length"], len(f[b"path"]))
+            for component in f[b"path"]:
+                _pack_bytes(out, component)
+    else:
+        out += struct.pack("!Q", info[b"length"])
+    _pack_bytes(out, torrent.meta.get(b"announce", b""))
+    tiers = torrent.meta.get(b"announce-list") or []
+    out += struct.pack("!H", len(tiers))
+    for tier in tiers:
+        out += struct.pack("!H", len(tier))
+        for url in tier:
+            _pack_bytes(out, url)
+    _pack_bytes(out, torrent.pieces)
+    return bytes(out)
+
+
+def _unpack(data):
+    magic, version, info_hash, piece_length, flags, num_files = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a metadata cache entry")
+    pos = _HEADER.size
+    info = {b"piece length": piece_length}
+    info[b"name"], pos = _unpack_bytes(data, pos)
+    if flags & _FLAG_MULTI_FILE:
+        files = []
+        for _ in range(num_files):
+            length, count = struct.unpack_from("!QH", data, pos)
+            pos += 10
+            path = []
+            for _ in range(count):
+                component, pos = _unpack_bytes(data, pos)
+                path.append(component)
+            files.append({b"length": length, b"path": path})
+        info[b"files"] = files
+    else:
+        (info[b"length"],) = struct.unpack_from("!Q", data, pos)
+        pos += 8
+    if flags & _FLAG_PRIVATE:
+        info[b"private"] = 1
+    meta = {}
+    meta[b"announce"], pos = _unpack_bytes(data, pos)
+    (num_tiers,) = struct.unpack_from("!H", data, pos)
+    pos += 2
+    tiers = []
+    for _ in range(num_tiers):
+        (count,) = struct.unpack_from("!H", data, pos)
+        pos += 2
+        tier = []
+        for _ in range(count):
+            url, pos = _unpack_bytes(data, pos)
+            tier.append(url)
+        tiers.append(tier)
+    if tiers:
+        meta[b"announce-list"] = tiers
+    info[b"pieces"], pos = _unpack_bytes(data, pos)
+    meta[b"info"] = info
+    return Torrent(meta=meta, info=info, info_hash=info_hash)
+
+
+def _write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class MetadataCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "paths"), exist_ok=True)
+
+    def _entry_path(self, info_hash):
+        return os.path.join(self.directory, info_hash.hex() + ".meta")
+
+    def _link_path(self, torrent_path):
+        st = os.stat(torrent_path)
+        key = f"{os.path.abspath(torrent_path)}\0{st.st_size}\0{st.st_mtime_ns}".encode()
+        return os.path.join(self.directory, "paths", hashlib.sha1(key).hexdigest())
+
+    def get_by_info_hash(self, info_hash):
+        try:
+            with open(self._entry_path(info_hash), "rb") as f:
+                torrent = _unpack(f.read())
+        except (OSError, ValueError, struct.error):
+            return None
+        return torrent if torrent.info_hash == info_hash else None
+
+    def get(self, torrent_path):
+        """Cached Torrent for an unchanged .torrent file, or None."""
+        try:
+            with open(self._link_path(torrent_path), "rb") as f:
+                info_hash = f.read()
+        except OSError:
+            return None
+        if len(info_hash) != 20:
+            return None
+        return self.get_by_info_hash(info_hash)
+
+    def put(self, torrent_path, torrent):
+        """Cache torrent for torrent_path. Best effort: if it fails, the file is just parsed again next time."""
+        try:
+            data = _pack(torrent)
+        except (TypeError, ValueError, struct.error):
+            return  # fields of unusual types or sizes the format cannot hold: parse it every time
+        try:
+            _write_atomic(self._entry_path(torrent.info_hash), data)
+            _write_atomic(self._link_path(torrent_path), torrent.info_hash)
+        except OSError:
+            pass
@@ -1,76 +1,195 @@
 """
 Peer wire protocol: handshake, message loop, download blocks, respond to REQUEST (seeding).
+Block requests are pipelined: each peer keeps a queue of outstanding REQUESTs whose depth
+follows the measured bandwidth-delay product of the connection. Blocks come from the shared
+PieceManager schedule, so one peer's pipeline may span several pieces and one piece several peers.
+The upload side (INTERESTED / NOT_INTERESTED / REQUEST) is handled while downloading too; an
+attached engine.choker.Choker decides whether REQUESTs are served.
+Incoming bytes go through a FrameBuffer; PIECE payloads are memoryviews valid until the next recv().
+reader / writer are asyncio streams, or both the same core.wire.WireProtocol.
 """
 import asyncio
 import struct
+import time
+from .framing import FrameBuffer, READ_SIZE
 from .messages import (
-    parse_messages,
+    cancel,
     interested,
+    not_interested,
     request,
+    CHOKE,
     UNCHOKE,
+    INTERESTED,
+    NOT_INTERESTED,
+    HAVE,
+    BITFIELD,
     PIECE,
     REQUEST,
     EXTENDED,
-    build_message,
 )
+from .piece import BLOCK_SIZE
+from .piece_manager import bitfield_indices
+from .wire import WireProtocol
+from storage.layout import FileLayout
+from storage.reader import UploadReader
+
+DEFAULT_PIPELINE_DEPTH = 5
+MIN_PIPELINE_DEPTH = 2
+MAX_PIPELINE_DEPTH = 250
+RATE_WINDOW = 0.5  # seconds between bandwidth samples
+LIMITED_HIGH_WATER = 2 * READ_SIZE  # WireProtocol read-ahead while a download limit applies
+UNCHOKE_TIMEOUT = 30  # seconds an interesting peer may keep us choked
+IDLE_POLL = 0.1  # seconds to wait for messages while there is nothing to request
 
 
 class PeerConnection:
-    def __init__(self, reader, writer, peer_id=None, torrent=None, download_path=None):
+    def __init__(
+        self,
+        reader,
+        writer,
+        peer_id=None,
+        torrent=None,
+        download_path=None,
+        pipeline_depth=DEFAULT_PIPELINE_DEPTH,
+        max_pipeline_depth=MAX_PIPELINE_DEPTH,
+        upload=None,
+    ):
         self.reader = reader
         self.writer = writer
         self.peer_id = peer_id
+        self.remote_peer_id = None  # peer ID from the peer's handshake, when the caller knows it
         self.torrent = torrent
         self.download_path = download_path or "download.bin"
-        self.buffer = b""
-        self.choked = True
-        self._pending_requests = set()  # (index, begin) for endgame duplicate requests
+        self.upload = upload  # UploadReader shared with other connections; created lazily if None
+        # A WireProtocol receives straight into its own FrameBuffer and parses on recv().
+        self.wire = reader if isinstance(reader, WireProtocol) else None
+        self.frames = self.wire.frames if self.wire is not None else FrameBuffer()
+        self.choked = True  # peer chokes us
+        self.interested = False  # we are interested in the peer
+        self.pieces = None  # core.piece_manager.Bitfield of the peer's pieces; None: unknown
+        self._choked_since = None  # when we became interested while choked
+        self.am_choking = True  # we choke the peer; a Choker unchokes it
+        self.peer_interested = False
+        self.choker = None  # engine.choker.Choker this connection is registered with
+        self.have = None  # piece indices we can serve (e.g. PieceManager.completed); None: all
+        self.downloaded = 0  # block bytes received from the peer
+        self.uploaded = 0  # block bytes sent to the peer
+        self.limits = None  # engine.ratelimit.RateLimits for this peer (upload / download buckets)
+        self._deferred = None  # messages of a stream recv() cancelled while throttled, returned next
+
+        # Request pipeline: (index, begin) -> (length, sent_at) for every REQUEST not answered yet.
+        self.inflight = {}
+        self.max_pipeline_depth = max(MIN_PIPELINE_DEPTH, max_pipeline_depth)
+        self.pipeline_depth = min(max(MIN_PIPELINE_DEPTH, pipeline_depth), self.max_pipeline_depth)
+        self.rate = 0.0  # smoothed download rate from this peer, bytes/s
+        self.rtt = None  # lowest observed request round trip, seconds
+        self.late_blocks = 0
+        self.unsolicited_blocks = 0
+        self.wasted = 0  # bytes of duplicate blocks (already received, or piece already done)
+        self.cancels = 0  # CANCELs sent to this peer
+        self._rate_bytes = 0
+        self._rate_start = time.monotonic()
 
     async def send(self, data):
         self.writer.write(data)
         await self.writer.drain()
 
     async def recv(self):
-        data = await self.reader.read(4096)
+        """Next batch of messages. Safe to cancel (e.g. by a timeout): nothing read is lost."""
+        if self._deferred is not None:
+            messages, self._deferred = self._deferred, None
+            return messages
+        if self.wire is not None:
+            if self.limits is None:
+                return await self.wire.recv()
+            # Received bytes are charged before they are parsed: no payload view is handed out
+            # while the limit is being waited for.
+            self.wire.high_water = LIMITED_HIGH_WATER
+            return await self.wire.recv(charge=self._charge_download)
+        data = await self.reader.read(READ_SIZE)
         if not data:
             raise ConnectionError
-        self.buffer += data
-        messages, self.buffer = parse_messages(self.buffer)
+        self.frames.feed(data)
+        messages = self.frames.messages()
+        if self.limits is not None:
+            # Delaying the next read (not dropping data) lets the receive window close.
+            await self._throttle_download(len(data), messages)
         return messages
 
+    async def _charge_download(self, nbytes):
+        waiter = self.limits.download.consume(nbytes)
+        if waiter is not None:
+            await waiter
+
+    async def _throttle_download(self, nbytes, messages):
+        waiter = self.limits.download.consume(nbytes)
+        if waiter is not None:
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self._deferred = messages
+                raise
+
     async def wait_for_unchoke(self, timeout=30):
         try:
             while self.choked:
-                for msg_id, _ in await asyncio.wait_for(self.recv(), timeout=timeout):
+                for msg_id, payload in await asyncio.wait_for(self.recv(), timeout=timeout):
                     if msg_id == UNCHOKE:
                         self.choked = False
-                        return
+                    elif msg_id == CHOKE:
+                        self.choked = True
+                    else:
+                        await self.handle_upload_message(msg_id, payload)
         except asyncio.TimeoutError:
             raise TimeoutError("Peer did not unchoke")
 
-    async def _handle_request(self, payload, piece_length):
+    async def _handle_request(self, payload, piece_length=None):
         """Serve a REQUEST (upload / seeding)."""
         if len(payload) < 12:
             return
         index, begin, length = struct.unpack("!III", payload[:12])
+        if self.have is not None and index not in self.have:
+            return
+        if self.upload is None:
+            self.upload = UploadReader(FileLayout(self.torrent, self.download_path))
+        if self.limits is not None:
+            waiter = self.limits.upload.consume(length)
+            if waiter is not None:
+                await waiter
         try:
-            with open(self.download_path, "rb") as f:
-                f.seek(index * piece_length + begin)
-                block = f.read(length)
-        except (OSError, IOError):
+            if await self.upload.send_block(self.writer, index, begin, length):
+                self.uploaded += length
+        except OSError:
             return
-        msg = struct.pack("!II", index, begin) + block
-        await self.send(build_message(PIECE, msg))
+
+    async def handle_upload_message(self, msg_id, payload):
+        """
+        INTERESTED / NOT_INTERESTED / REQUEST from the peer. REQUESTs are served only while we
+        do not choke the peer. Returns True if msg_id was one of these.
+        """
+        if msg_id == INTERESTED or msg_id == NOT_INTERESTED:
+            self.peer_interested = msg_id == INTERESTED
+            if self.choker is not None:
+                await self.choker.interest_changed(self)
+            return True
+        if msg_id == REQUEST:
+            if not self.am_choking:
+                await self._handle_request(payload)
+            return True
+        return False
 
     async def recv_messages(self, on_piece=None, on_request=None, piece_length=None):
         """
         Process incoming messages. If torrent is set and we have download_path, handle REQUEST (seeding).
-        on_piece: optional callback (index, begin, block_data) for PIECE messages.
+        on_piece: optional callback (index, begin, block_data) for PIECE messages; block_data is a
+        memoryview that must be consumed (or copied) before the next recv().
         on_request: optional async callback(payload) for REQUEST; if None and we have torrent, we serve from file.
         """
         for msg_id, payload in await self.recv():
             if msg_id == UNCHOKE:
                 self.choked = False
+            elif msg_id == CHOKE:
+                self.choked = True
             elif msg_id == REQUEST:
                 if on_request:
                     await on_request(payload)
@@ -81,30 +200,150 @@ class PeerConnection:
                 block = payload[8:]
                 on_piece(index, begin, block)
 
-    async def download_piece(self, piece, endgame_mode=False, on_extended=None):
-        await self.send(interested())
-        await self.wait_for_unchoke()
-
-        while not piece.complete():
-            req = piece.next_request()
-            if not req:
-                break
-            offset, length = req
-            await self.send(request(piece.index, offset, length))
-
-            while True:
-                got = False
-                for msg_id, payload in await self.recv():
-                    if msg_id == EXTENDED and len(payload) >= 1 and on_extended:
-                        on_extended(payload[0], payload[1:])
-                    if msg_id == PIECE and len(payload) >= 8:
-                        idx, begin = struct.unpack("!II", payload[:8])
-                        block = payload[8:]
-                        if idx == piece.index:
-                            piece.add_block(begin, block)
-                            got = True
-                            break
-                if got or not endgame_mode:
-                    break
-                if piece.complete():
-                    break
+    def stats(self):
+        """Pipeline state for reporting: in-flight depth, target depth, rate and RTT."""
+        return {
+            "inflight": len(self.inflight),
+            "pipeline_depth": self.pipeline_depth,
+            "rate": self.rate,
+            "rtt": self.rtt,
+            "late_blocks": self.late_blocks,
+            "unsolicited_blocks": self.unsolicited_blocks,
+            "wasted": self.wasted,
+            "cancels": self.cancels,
+            "am_choking": self.am_choking,
+            "peer_interested": self.peer_interested,
+            "downloaded": self.downloaded,
+            "uploaded": self.uploaded,
+        }
+
+    def _on_block_received(self, length, sent_at):
+        """Update RTT / rate samples and resize the pipeline to the bandwidth-delay product."""
+        now = time.monotonic()
+        if sent_at is not None:
+            sample = now - sent_at
+            if self.rtt is None or sample < self.rtt:
+                self.rtt = sample
+        self._rate_bytes += length
+        elapsed = now - self._rate_start
+        if elapsed < RATE_WINDOW:
+            return
+        sample_rate = self._rate_bytes / elapsed
+        self.rate = sample_rate if not self.rate else 0.7 * self.rate + 0.3 * sample_rate
+        self._rate_bytes = 0
+        self._rate_start = now
+        if self.rtt is not None:
+            # Keep ~1.5x the BDP queued so the pipeline grows until the link, not us, is the limit.
+            bdp_blocks = self.rate * self.rtt / BLOCK_SIZE
+            depth = int(bdp_blocks * 1.5) + MIN_PIPELINE_DEPTH
+            self.pipeline_depth = min(max(MIN_PIPELINE_DEPTH, depth), self.max_pipeline_depth)
+
+    async def _fill_pipeline(self, piece_manager):
+        """Request blocks picked by piece_manager until the pipeline is full."""
+        room = self.pipeline_depth - len(self.inflight)
+        if room <= 0:
+            return
+        blocks = piece_manager.pick_blocks(self, room)
+        if not blocks:
+            return
+        now = time.monotonic()
+        for piece, offset, length in blocks:
+            self.inflight[(piece.index, offset)] = (length, now)
+        await self.send(b"".join(request(piece.index, offset, length) for piece, offset, length in blocks))
+
+    def release_requests(self, piece_manager):
+        """Give every outstanding request back to piece_manager (choked, disconnected, timed out)."""
+        for index, offset in self.inflight:
+            piece_manager.release_block(index, offset, self)
+        self.inflight.clear()
+
+    def cancel(self, index, begin, length):
+        """Withdraw a request another peer answered first (endgame): send CANCEL, no drain."""
+        if self.inflight.pop((index, begin), None) is None:
+            return
+        self.cancels += 1
+        try:
+            self.writer.write(cancel(index, begin, length))
+        except (ConnectionError, OSError, RuntimeError):
+            pass
+
+    def _handle_block(self, piece_manager, payload):
+        """Store a PIECE block in its active piece; returns the piece if it is now complete."""
+        idx, begin = struct.unpack("!II", payload[:8])
+        block = payload[8:]
+        self.downloaded += len(block)
+        pending = self.inflight.pop((idx, begin), None)
+        if pending is not None:
+            self._on_block_received(len(block), pending[1])
+        piece = piece_manager.active.get(idx)
+        if piece is None or piece.has_block(begin):
+            # Duplicate: another peer delivered it first (endgame) or a CANCEL came too late.
+            self.unsolicited_blocks += 1
+            self.wasted += len(block)
+            piece_manager.add_waste(len(block))
+            return None
+        if pending is None:
+            # Answer to a request we had already given up on (choke, timeout): data is still good.
+            self.late_blocks += 1
+        return piece_manager.add_block(piece, begin, block, self)
+
+    async def update_interest(self, piece_manager):
+        """Send INTERESTED / NOT_INTERESTED when whether the peer has pieces we lack changes."""
+        wanted = piece_manager.wants(self.pieces)
+        if wanted != self.interested:
+            self.interested = wanted
+            await self.send(interested() if wanted else not_interested())
+        return wanted
+
+    async def download_blocks(self, piece_manager, on_extended=None, on_have=None, completed=None):
+        """
+        Keep the pipeline full with blocks from piece_manager.pick_blocks() and process one batch
+        of incoming messages. Returns the pieces completed by this batch (to verify and write).
+        With nothing to request (peer not interesting, choking us, or all its blocks taken) it
+        waits at most IDLE_POLL for messages. Pieces announced by HAVE and BITFIELD go to on_have(index).
+        completed: list the completed pieces are appended to as they complete (and returned), so
+        a caller that cancels the call (e.g. a timeout) still gets them back.
+        """
+        if completed is None:
+            completed = []
+        wanted = await self.update_interest(piece_manager)
+        if self.choked and self.inflight:
+            # Peer drops queued requests when it chokes us (BEP 3); others may take them meanwhile.
+            self.release_requests(piece_manager)
+        if wanted and self.choked:
+            now = time.monotonic()
+            if self._choked_since is None:
+                self._choked_since = now
+            elif now - self._choked_since > UNCHOKE_TIMEOUT:
+                raise TimeoutError("Peer did not unchoke")
+        else:
+            self._choked_since = None
+            if wanted:
+                await self._fill_pipeline(piece_manager)
+
+        if self.inflight:
+            messages = await self.recv()
+        else:
+            try:
+                messages = await asyncio.wait_for(self.recv(), timeout=IDLE_POLL)
+            except asyncio.TimeoutError:
+                return completed
+        for msg_id, payload in messages:
+            if msg_id == EXTENDED and len(payload) >= 1 and on_extended:
+                on_extended(payload[0], payload[1:])
+            elif msg_id == CHOKE:
+                self.choked = True
+            elif msg_id == UNCHOKE:
+                self.choked = False
+            elif msg_id == HAVE and on_have and len(payload) >= 4:
+                on_have(struct.unpack("!I", payload[:4])[0])
+            elif msg_id == BITFIELD and on_have:
+                for index in bitfield_indices(payload, piece_manager.num_pieces):
+                    on_have(index)
+            elif msg_id == PIECE and len(payload) >= 8:
+                piece = self._handle_block(piece_manager, payload)
+                if piece is not None:
+                    completed.append(piece)
+            else:
+                await self.handle_upload_message(msg_id, payload)
+        return completed
@@ -1,3 +1,8 @@
+"""
+Piece buffer: blocks are written at their offset into one preallocated bytearray and SHA-1 is fed
+incrementally as the contiguous prefix grows, so verify() only hashes what arrived out of order.
+Block requests are tracked per piece (requested, owner) so several peers can share one piece.
+"""
 import hashlib
 
 BLOCK_SIZE = 16384
@@ -8,27 +13,106 @@ class Piece:
         self.index = index
         self.size = size
         self.hash = hash_bytes
-        self.blocks = {}
+        self.have = set()  # offsets of received blocks
         self.received = 0
+        self.num_blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+        self.requested = {}  # offset -> set of peers with a request out for a block not received yet
+        self.owner = None  # peer the piece is assigned to (piece affinity); others may help
+        self.buffer = None  # bytearray(size), allocated on the first block
+        self._view = None
+        self._sha1 = None
+        self._hashed = 0  # end of the prefix already fed to _sha1
 
     def next_request(self):
         for offset in range(0, self.size, BLOCK_SIZE):
-            if offset not in self.blocks:
+            if offset not in self.have:
                 length = min(BLOCK_SIZE, self.size - offset)
                 return offset, length
         return None
 
+    def missing_blocks(self):
+        """Yield (offset, length) for every block not received yet, in order."""
+        for offset in range(0, self.size, BLOCK_SIZE):
+            if offset not in self.have:
+                yield offset, min(BLOCK_SIZE, self.size - offset)
+
+    def open_blocks(self):
+        """Number of blocks neither received nor requested."""
+        return self.num_blocks - len(self.have) - len(self.requested)
+
+    def unrequested_blocks(self):
+        """Yield (offset, length) for every block neither received nor requested, in order."""
+        if self.open_blocks() <= 0:
+            return
+        for offset in range(0, self.size, BLOCK_SIZE):
+            if offset not in self.have and offset not in self.requested:
+                yield offset, min(BLOCK_SIZE, self.size - offset)
+
+    def mark_requested(self, offset, peer):
+        self.requested.setdefault(offset, set()).add(peer)
+
+    def release(self, offset, peer):
+        """peer's request for the block was cancelled or lost."""
+        peers = self.requested.get(offset)
+        if peers is None:
+            return
+        peers.discard(peer)
+        if not peers:
+            del self.requested[offset]
+
+    def has_block(self, offset):
+        return offset in self.have
+
     def add_block(self, offset, data):
-        if offset not in self.blocks:
-            self.blocks[offset] = data
-            self.received += len(data)
+        """Copy a block (bytes or memoryview) into the piece buffer; misaligned or wrong-size blocks are ignored."""
+        length = len(data)
+        if offset in self.have or offset % BLOCK_SIZE or length != min(BLOCK_SIZE, self.size - offset):
+            return False
+        if self.buffer is None:
+            self.buffer = bytearray(self.size)
+            self._view = memoryview(self.buffer)
+            self._sha1 = hashlib.sha1()
+        self._view[offset:offset + length] = data
+        self.have.add(offset)
+        self.requested.pop(offset, None)
+        self.received += length
+        if offset == self._hashed:
+            self._advance_hash()
+        return True
+
+    def _advance_hash(self):
+        end = self._hashed
+        while end < self.size and end in self.have:
+            end = min(end + BLOCK_SIZE, self.size)
+        if end > self._hashed:
+            self._sha1.update(self._view[self._hashed:end])
+            self._hashed = end
+
+    def unhashed_bytes(self):
+        """Bytes verify() still has to feed to SHA-1."""
+        return self.size - self._hashed
 
     def complete(self):
         return self.received == self.size
 
     def verify(self):
-        data = b''.join(self.blocks[o] for o in sorted(self.blocks))
-        return hashlib.sha1(data).digest() == self.hash
+        if not self.complete():
+            return False
+        self._advance_hash()
+        return self._sha1.digest() == self.hash
 
     def data(self):
-        return b''.join(self.blocks[o] for o in sorted(self.blocks))
+        """The assembled piece as a memoryview of the buffer (no copy)."""
+        return self._view
+
+    def reset(self):
+        """Drop all received data, e.g. after a hash failure or once the piece is queued for disk.
+        Views returned by data() keep the old buffer alive until they are released."""
+        self.have = set()
+        self.received = 0
+        self.requested = {}
+        self.owner = None
+        self.buffer = None
+        self._view = None
+        self._sha1 = None
+        self._hashed = 0
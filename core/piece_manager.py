@@ -1,9 +1,98 @@
 """
-Piece selection: rarest-first with endgame mode when few pieces remain.
+Piece selection: rarest-first, with endgame mode once every remaining block is requested.
+Selectable pieces (not completed, not in progress) are indexed in buckets by availability, so
+BITFIELD / HAVE / disconnect updates are O(1) per piece and next_piece() never scans the torrent.
+Each bucket also keeps a bitmap in Bitfield order: the rarest pieces a peer has are found by
+ANDing whole integers, not by testing piece by piece.
+
+Scheduling is per block: pick_blocks() hands each peer blocks from a shared set of active
+(started) pieces. A piece is owned by the peer that started it (piece affinity), but faster peers
+take unrequested blocks of pieces others hold and then take over ownership, and blocks received
+from a peer that disconnects stay in the piece for whoever finishes it.
+
+Peers only get pieces their Bitfield (BITFIELD + HAVE) contains: rarest-first among what the
+peer has. In endgame, blocks still outstanding are requested from every peer that asks for work as well;
+the first copy to arrive wins and the other requesters get CANCEL (peer.cancel()). Duplicate
+block bytes that arrive anyway are counted as waste.
 """
 from .piece import Piece, BLOCK_SIZE
 
 
+def bitfield_indices(bitfield, num_pieces):
+    """Yield piece indices set in a BITFIELD payload (bytes) or a list of bools."""
+    if isinstance(bitfield, (bytes, bytearray, memoryview)):
+        for byte_index, byte in enumerate(bitfield):
+            if not byte:
+                continue
+            base = byte_index * 8
+            for bit in range(8):
+                if byte & (0x80 >> bit) and base + bit < num_pieces:
+                    yield base + bit
+    else:
+        for i, has_piece in enumerate(bitfield):
+            if i >= num_pieces:
+                break
+            if has_piece:
+                yield i
+
+
+def make_bitfield(indices, num_pieces):
+    """BITFIELD payload with the given piece indices set."""
+    bitfield = bytearray((num_pieces + 7) // 8)
+    for i in indices:
+        bitfield[i // 8] |= 0x80 >> (i % 8)
+    return bytes(bitfield)
+
+
+class Bitfield:
+    """
+    Compact set of a peer's pieces: one bit per piece in BITFIELD wire order (high bit of byte 0
+    is piece 0), so a BITFIELD payload is stored as is and set operations work on whole integers.
+    """
+
+    __slots__ = ("num_pieces", "bits", "count", "_int")
+
+    def __init__(self, num_pieces):
+        self.num_pieces = num_pieces
+        self.bits = bytearray((num_pieces + 7) // 8)
+        self.count = 0
+        self._int = 0  # to_int(), None once bits changed
+
+    def __contains__(self, index):
+        return 0 <= index < self.num_pieces and bool(self.bits[index >> 3] & (0x80 >> (index & 7)))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, index):
+        """Set a piece (HAVE); False if out of range or already set."""
+        if not 0 <= index < self.num_pieces:
+            return False
+        mask = 0x80 >> (index & 7)
+        if self.bits[index >> 3] & mask:
+            return False
+        self.bits[index >> 3] |= mask
+        self.count += 1
+        self._int = None
+        return True
+
+    def update(self, payload):
+        """Merge a BITFIELD payload; returns the newly set piece indices."""
+        return [i for i in bitfield_indices(payload, self.num_pieces) if self.add(i)]
+
+    def indices(self):
+        return bitfield_indices(self.bits, self.num_pieces)
+
+    def to_int(self):
+        if self._int is None:
+            self._int = int.from_bytes(self.bits, "big")
+        return self._int
+
+
+def _owner_rate(piece):
+    return piece.owner.rate if piece.owner is not None else 0.0
+
+
 class PieceManager:
     def __init__(self, torrent, download_path="download.bin"):
         self.torrent = torrent
@@ -21,46 +110,224 @@ class PieceManager:
             self.pieces.append(Piece(i, size, hash_bytes))
 
         self.completed = set()
-        self.in_progress = set()
-        self.availability = {i: 0 for i in range(self.num_pieces)}
+        # Pieces not completed, as an integer in Bitfield bit order (see wants()).
+        self._nbits = (self.num_pieces + 7) // 8 * 8
+        self._missing = ((1 << self.num_pieces) - 1) << (self._nbits - self.num_pieces)
+        self.in_progress = set()  # active pieces plus verified pieces waiting for the disk write
+        self.active = {}  # index -> Piece with blocks requested or received, not complete yet
+        self.endgame_requests = 0  # duplicate requests sent in endgame
+        self.cancels = 0  # CANCELs sent after another peer delivered the block
+        self.wasted_bytes = 0  # duplicate block bytes received (see add_waste)
+        self.availability = [0] * self.num_pieces
+        # _buckets[a] = selectable pieces seen by exactly a peers; _bucket_bits[a] the same as a bitmap
+        self._buckets = [set(range(self.num_pieces))]
+        self._bucket_bits = [bytearray(make_bitfield(range(self.num_pieces), self.num_pieces))]
+
+    def _selectable(self, index):
+        return index not in self.completed and index not in self.in_progress
+
+    def _bucket_add(self, availability, index):
+        self._buckets[availability].add(index)
+        self._bucket_bits[availability][index >> 3] |= 0x80 >> (index & 7)
+
+    def _bucket_discard(self, availability, index):
+        self._buckets[availability].discard(index)
+        self._bucket_bits[availability][index >> 3] &= ~(0x80 >> (index & 7))
+
+    def _change_availability(self, index, delta):
+        old = self.availability[index]
+        new = max(0, old + delta)
+        self.availability[index] = new
+        while len(self._buckets) <= new:
+            self._buckets.append(set())
+            self._bucket_bits.append(bytearray(self._nbits // 8))
+        if new != old and self._selectable(index):
+            self._bucket_discard(old, index)
+            self._bucket_add(new, index)
 
     def update_availability(self, bitfield):
         """Update per-piece availability from peer BITFIELD. bitfield is bytes or list of bools."""
-        if isinstance(bitfield, bytes):
-            for i in range(min(len(bitfield) * 8, self.num_pieces)):
-                if bitfield[i // 8] & (0x80 >> (i % 8)):
-                    self.availability[i] = self.availability.get(i, 0) + 1
-        else:
-            for i, has_piece in enumerate(bitfield):
-                if i >= self.num_pieces:
+        for i in bitfield_indices(bitfield, self.num_pieces):
+            self._change_availability(i, 1)
+
+    def add_have(self, index):
+        """Peer announced a piece with HAVE."""
+        if 0 <= index < self.num_pieces:
+            self._change_availability(index, 1)
+
+    def remove_availability(self, bitfield):
+        """Peer disconnected: undo the availability its BITFIELD (and HAVEs) contributed."""
+        for i in bitfield_indices(bitfield, self.num_pieces):
+            self._change_availability(i, -1)
+
+    def next_piece(self, has=None):
+        """
+        Rarest-first: pick a piece not completed and not in progress, with lowest availability,
+        among the pieces in has (a Bitfield; None: any piece).
+        """
+        wanted = None if has is None else has.to_int()
+        for availability, bucket in enumerate(self._buckets):
+            if not bucket:
+                continue
+            if wanted is None:
+                index = bucket.pop()  # set.pop() resumes where it left off: no rescan of freed slots
+                self._bucket_bits[availability][index >> 3] &= ~(0x80 >> (index & 7))
+            else:
+                common = int.from_bytes(self._bucket_bits[availability], "big") & wanted
+                if not common:
+                    continue
+                index = self._nbits - common.bit_length()  # lowest index: highest set bit
+                self._bucket_discard(availability, index)
+            self.in_progress.add(index)
+            return self.pieces[index]
+        return None
+
+    def wants(self, has):
+        """True if has (a Bitfield; None: everything) contains a piece we do not have yet."""
+        if has is None:
+            return bool(self._missing)
+        return bool(has.to_int() & self._missing)
+
+    def pick_blocks(self, peer, count):
+        """
+        Up to count (piece, offset, length) blocks for peer to request; they are marked requested.
+        Order: pieces peer owns, partial pieces nobody owns (adopted), new rarest-first pieces,
+        then unrequested blocks of pieces other peers own (adopted when peer is faster); only
+        pieces in peer.pieces. peer is normally a PeerConnection: rate (bytes/s), pieces (a
+        Bitfield, None if unknown) and cancel().
+        """
+        picked = []
+        has = peer.pieces
+
+        def take(piece):
+            for offset, length in piece.unrequested_blocks():
+                if len(picked) >= count:
                     break
-                if has_piece:
-                    self.availability[i] = self.availability.get(i, 0) + 1
-
-    def next_piece(self):
-        """Rarest-first: pick a piece not completed and not in progress, with lowest availability."""
-        candidates = [
-            p for p in self.pieces
-            if p.index not in self.completed and p.index not in self.in_progress
+                piece.mark_requested(offset, peer)
+                picked.append((piece, offset, length))
+
+        for piece in self.active.values():
+            if len(picked) >= count:
+                return picked
+            if piece.owner is peer or (
+                piece.owner is None and piece.open_blocks() and (has is None or piece.index in has)
+            ):
+                piece.owner = peer
+                take(piece)
+        while len(picked) < count:
+            piece = self.next_piece(has)
+            if piece is None:
+                break
+            piece.owner = peer
+            self.active[piece.index] = piece
+            take(piece)
+        if len(picked) < count:
+            shared = [
+                p for p in self.active.values()
+                if p.owner is not peer and p.open_blocks() and (has is None or p.index in has)
+            ]
+            shared.sort(key=_owner_rate)
+            for piece in shared:
+                if len(picked) >= count:
+                    break
+                if peer.rate > _owner_rate(piece):
+                    piece.owner = peer
+                take(piece)
+        if len(picked) < count and self.endgame():
+            self._pick_endgame(peer, count, picked)
+        return picked
+
+    def _pick_endgame(self, peer, count, picked):
+        """Add blocks other peers have outstanding, least-requested first, to picked."""
+        has = peer.pieces
+        outstanding = [
+            (len(peers), piece, offset)
+            for piece in self.active.values()
+            if has is None or piece.index in has
+            for offset, peers in piece.requested.items()
+            if peer not in peers
         ]
-        if not candidates:
+        outstanding.sort(key=lambda item: item[0])
+        for _, piece, offset in outstanding[:count - len(picked)]:
+            piece.mark_requested(offset, peer)
+            picked.append((piece, offset, min(BLOCK_SIZE, piece.size - offset)))
+            self.endgame_requests += 1
+
+    def release_block(self, index, offset, peer):
+        """peer's request for a block was lost (choke, disconnect, timeout): others may take it."""
+        piece = self.active.get(index)
+        if piece is not None:
+            piece.release(offset, peer)
+
+    def release_peer(self, peer, blocks=()):
+        """peer disconnected: release its outstanding (index, offset) blocks and its pieces."""
+        for index, offset in blocks:
+            self.release_block(index, offset, peer)
+        for piece in self.active.values():
+            if piece.owner is peer:
+                piece.owner = None
+
+    def add_block(self, piece, offset, data, peer=None):
+        """
+        Store a block of an active piece received from peer; other peers with a request out for
+        it (endgame) get peer.cancel(). Returns the piece once it is complete.
+        """
+        requesters = piece.requested.get(offset, ())
+        if not piece.add_block(offset, data):
             return None
-        candidates.sort(key=lambda p: self.availability.get(p.index, 0))
-        piece = candidates[0]
-        self.in_progress.add(piece.index)
+        for other in requesters:
+            if other is not peer:
+                other.cancel(piece.index, offset, len(data))
+                self.cancels += 1
+        if not piece.complete():
+            return None
+        # Complete: off the schedule, still in_progress until verified and written.
+        self.active.pop(piece.index, None)
         return piece
 
+    def add_waste(self, nbytes):
+        """A duplicate block arrived (endgame race, or an answer to a cancelled request)."""
+        self.wasted_bytes += nbytes
+
     def endgame(self):
-        """True when remaining pieces < threshold (e.g. 5) — allow duplicate block requests."""
-        remaining = self.num_pieces - len(self.completed)
-        return remaining < 5
+        """True when no piece is left to start and every missing block of the started ones is requested."""
+        # Pieces no connected peer has (bucket 0) cannot hold up endgame.
+        if any(self._buckets[1:]) or not self.active:
+            return False
+        return all(piece.open_blocks() == 0 for piece in self.active.values())
+
+    def stats(self):
+        return {
+            "completed": len(self.completed),
+            "num_pieces": self.num_pieces,
+            "active": len(self.active),
+            "endgame": self.endgame(),
+            "endgame_requests": self.endgame_requests,
+            "cancels": self.cancels,
+            "wasted_bytes": self.wasted_bytes,
+        }
 
     def mark_completed(self, piece_index):
+        self._bucket_discard(self.availability[piece_index], piece_index)
         self.completed.add(piece_index)
+        self._missing &= ~(1 << (self._nbits - 1 - piece_index))
         self.in_progress.discard(piece_index)
+        self.active.pop(piece_index, None)
 
     def mark_in_progress_free(self, piece_index):
+        """Return a piece to selection (failed hash or write); its received blocks are dropped."""
+        if piece_index not in self.in_progress:
+            return
         self.in_progress.discard(piece_index)
+        piece = self.active.pop(piece_index, None)
+        if piece is not None:
+            piece.reset()
+        if piece_index not in self.completed:
+            self._bucket_add(self.availability[piece_index], piece_index)
+
+    def left(self):
+        """Bytes still to download (the tracker's left)."""
+        return self.total_length - sum(self.pieces[i].size for i in self.completed)
 
     def is_done(self):
         return len(self.completed) == self.num_pieces
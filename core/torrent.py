@@ -1,5 +1,5 @@
 import hashlib
-from .bencode import decode, encode
+from .bencode import decode
 
 
 class Torrent:
@@ -7,21 +7,59 @@ class Torrent:
         if path is not None:
             with open(path, "rb") as f:
                 self.raw = f.read()
-            self.meta = decode(self.raw)
+            spans = {}
+            self.meta = decode(self.raw, spans=spans)
             self.info = self.meta[b"info"]
-            self.info_hash = hashlib.sha1(encode(self.info)).digest()
-            self.announce = self.meta.get(b"announce", b"").decode() or ""
+            # Hash the info dict exactly as it appears in the file: re-encoding would cost a copy
+            # of every piece hash and give a wrong hash for non-canonical encodings.
+            start, end = spans[b"info"]
+            self.info_hash = hashlib.sha1(memoryview(self.raw)[start:end]).digest()
         else:
             self.raw = None
-            self.meta = {}
+            self.meta = meta or {}
             self.info = info
             self.info_hash = info_hash
-            self.announce = ""
+        self.announce = self.meta.get(b"announce", b"").decode() or ""
+        self.announce_list = self._announce_tiers()
 
-        self.length = self.info[b"length"]
+        self.name = self.info.get(b"name", b"").decode("utf-8", "replace")
+        self.multi_file = b"files" in self.info
+        if self.multi_file:
+            # [(path components, length)] in torrent order; pieces run across file boundaries.
+            self.files = [
+                ([c.decode("utf-8", "replace") for c in f[b"path"]], f[b"length"])
+                for f in self.info[b"files"]
+            ]
+            self.length = sum(length for _, length in self.files)
+        else:
+            self.length = self.info[b"length"]
+            self.files = [([self.name], self.length)]
         self.piece_length = self.info[b"piece length"]
         self.pieces = self.info[b"pieces"]
 
+    def _announce_tiers(self):
+        """BEP 12 tiers of tracker URLs from announce-list; without one, announce is the only tier."""
+        tiers = []
+        for tier in self.meta.get(b"announce-list") or []:
+            urls = [url.decode() for url in tier if isinstance(url, bytes) and url]
+            if urls:
+                tiers.append(urls)
+        if not tiers and self.announce:
+            tiers.append([self.announce])
+        return tiers
+
+    @classmethod
+    def load(cls, path, cache=None):
+        """Load a .torrent file, through cache (core.metacache.MetadataCache) when given."""
+        if cache is not None:
+            torrent = cache.get(path)
+            if torrent is not None:
+                return torrent
+        torrent = cls(path)
+        if cache is not None:
+            cache.put(path, torrent)
+        return torrent
+
     @classmethod
     def from_metadata(cls, info_dict: dict, info_hash: bytes):
         """Build Torrent from metadata (info dict) for magnet downloads."""
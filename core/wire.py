@@ -0,0 +1,200 @@
+"""
+Peer wire transport on asyncio.BufferedProtocol, as an alternative to StreamReader/StreamWriter.
+The event loop receives straight into the connection's FrameBuffer (get_buffer / buffer_updated),
+so there is no StreamReader buffer or per-read coroutine switch in between, and writes only wait
+in drain() while the transport is actually above its high-water mark.
+
+Each connection is a small state machine: HANDSHAKE (waiting for the 68-byte handshake), OPEN
+(length-prefixed frames) and CLOSED. Messages are either dispatched to an on_message callback as
+they arrive (payload views are valid during the call only) or collected by an awaiting recv(),
+which returns the same (msg_id, payload) list as FrameBuffer.messages(). A WireProtocol can be
+passed to PeerConnection as both reader and writer.
+"""
+import asyncio
+import socket
+
+from .framing import FrameBuffer, READ_SIZE
+
+HANDSHAKE_LENGTH = 68
+HIGH_WATER = 4 * 1024 * 1024  # unparsed bytes at which reading pauses until recv() catches up
+
+STATE_HANDSHAKE = "handshake"
+STATE_OPEN = "open"
+STATE_CLOSED = "closed"
+
+
+class WireProtocol(asyncio.BufferedProtocol):
+    def __init__(self, on_message=None, on_handshake=None, on_close=None, expect_handshake=True):
+        self.on_message = on_message  # callback(msg_id, payload); None: collect for recv()
+        self.on_handshake = on_handshake  # callback(protocol, handshake bytes)
+        self.on_close = on_close  # callback(protocol, exc)
+        self.frames = FrameBuffer()
+        self.state = STATE_HANDSHAKE if expect_handshake else STATE_OPEN
+        self.transport = None
+        self.high_water = HIGH_WATER
+        self.error = None
+        self.bytes_received = 0
+        self._charged = 0  # bytes_received already passed to a recv() charge callback
+        self._handshake = None  # future, created by read_handshake()
+        self._waiter = None  # future of a recv() waiting for data
+        self._drain_waiter = None
+        self._write_paused = False
+        self._read_paused = False
+        self._views_live = False  # payload views from the last recv() may still be in use
+        self._closed = None  # future resolved by connection_lost, for wait_closed()
+
+    # asyncio callbacks
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._closed = asyncio.get_running_loop().create_future()
+        sock = transport.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def get_buffer(self, sizehint):
+        # While recv() callers may hold payload views, move to a fresh buffer rather than compact
+        # under them (same size unless the pending frames need more).
+        return self.frames.writable(max(sizehint, READ_SIZE), compact=not self._views_live)
+
+    def buffer_updated(self, nbytes):
+        self.frames.commit(nbytes)
+        self.bytes_received += nbytes
+        if self.state == STATE_HANDSHAKE:
+            handshake = self.frames.take(HANDSHAKE_LENGTH)
+            if handshake is None:
+                return
+            self.state = STATE_OPEN
+            if self._handshake is not None and not self._handshake.done():
+                self._handshake.set_result(handshake)
+            else:
+                self._handshake = handshake
+            if self.on_handshake is not None:
+                self.on_handshake(self, handshake)
+        if self.on_message is not None:
+            self._dispatch()
+        else:
+            self._wake(None)
+            if len(self.frames) > self.high_water and not self._read_paused:
+                self._read_paused = True
+                self.transport.pause_reading()
+
+    def eof_received(self):
+        return False  # close the transport
+
+    def connection_lost(self, exc):
+        self.state = STATE_CLOSED
+        self.error = exc
+        self._wake(exc or ConnectionError("Connection closed"))
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_exception(exc or ConnectionError("Connection closed"))
+        if isinstance(self._handshake, asyncio.Future) and not self._handshake.done():
+            self._handshake.set_exception(exc or ConnectionError("Connection closed"))
+        if not self._closed.done():
+            self._closed.set_result(None)
+        if self.on_close is not None:
+            self.on_close(self, exc)
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+        self._drain_waiter = None
+
+    # Receiving
+
+    def _dispatch(self):
+        try:
+            for msg_id, payload in self.frames.messages():
+                self.on_message(msg_id, payload)
+        except Exception as e:
+            self.error = e
+            self.transport.abort()
+
+    def _wake(self, exc):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
+
+    async def read_handshake(self):
+        """The peer's 68-byte handshake."""
+        if isinstance(self._handshake, bytes):
+            return self._handshake
+        if self.state == STATE_CLOSED:
+            raise ConnectionError("Connection closed")
+        if self._handshake is None:
+            self._handshake = asyncio.get_running_loop().create_future()
+        return await self._handshake
+
+    async def recv(self, charge=None):
+        """
+        Wait for and return the next complete messages, like FrameBuffer.messages(). PIECE
+        payloads are memoryviews valid until the next recv().
+        charge(nbytes): optional coroutine (e.g. a download rate limit) awaited with the bytes
+        received since the last charge, before they are parsed; reading is paused meanwhile, so
+        the socket cannot run ahead of the limit and no payload view is out while it waits.
+        """
+        self._views_live = False
+        while True:
+            if charge is not None and self.bytes_received > self._charged:
+                nbytes = self.bytes_received - self._charged
+                self._charged = self.bytes_received
+                if not self._read_paused and self.transport is not None:
+                    self._read_paused = True
+                    self.transport.pause_reading()
+                await charge(nbytes)
+                if self._read_paused and len(self.frames) <= self.high_water and self.state != STATE_CLOSED:
+                    self._read_paused = False
+                    self.transport.resume_reading()
+            messages = self.frames.messages()
+            if messages:
+                self._views_live = True
+                return messages
+            if self.state == STATE_CLOSED:
+                raise ConnectionError("Connection closed")
+            if self._read_paused:
+                self._read_paused = False
+                self.transport.resume_reading()
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+
+    # StreamWriter-compatible sending, so PeerConnection and UploadReader can write to it
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        if self.state == STATE_CLOSED:
+            raise ConnectionError("Connection closed")
+        if not self._write_paused:
+            return
+        if self._drain_waiter is None:
+            self._drain_waiter = asyncio.get_running_loop().create_future()
+        await self._drain_waiter
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def is_closing(self):
+        return self.transport is None or self.transport.is_closing()
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def wait_closed(self):
+        if self._closed is not None:
+            await self._closed
+
+
+async def open_connection(host, port, **kwargs):
+    """Connect and return the WireProtocol (kwargs go to WireProtocol)."""
+    loop = asyncio.get_running_loop()
+    _, protocol = await loop.create_connection(lambda: WireProtocol(**kwargs), host, port)
+    return protocol
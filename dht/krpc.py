@@ -1,14 +1,35 @@
 """
-KRPC: bencoded UDP messages for DHT (BEP 5).
+KRPC: bencoded UDP messages for DHT (BEP 5), and the transaction layer that lets every lookup
+of a node share one socket.
+
+KRPC reads the socket in a single receive path (a datagram protocol). Each outgoing query gets
+a transaction ID, and its reply is handed to the future keyed by (transaction ID, address);
+unanswered queries time out and are retried, and a semaphore bounds how many are outstanding.
+Incoming queries are dispatched to the handler registered for their method.
 """
+import asyncio
 import os
+import struct
+
 from core.bencode import encode, decode
 
+KRPC_MAX_DEPTH = 8  # KRPC messages are shallow; anything deeper is junk or hostile
+KRPC_MAX_SIZE = 65536
+
+QUERY_TIMEOUT = 2.0
+RETRIES = 1  # resends after a timeout
+MAX_OUTSTANDING = 64
+
+ERROR_GENERIC = 201
+ERROR_SERVER = 202
+ERROR_PROTOCOL = 203
+ERROR_METHOD = 204
 
-def make_query(q: bytes, a: dict, node_id: bytes) -> bytes:
+
+def make_query(q: bytes, a: dict, node_id: bytes, tid: bytes = None) -> bytes:
     """Build a query message: y=q, q=method, a=args (id added automatically)."""
     return encode({
-        b"t": os.urandom(2),
+        b"t": tid if tid is not None else os.urandom(2),
         b"y": b"q",
         b"q": q,
         b"a": {**a, b"id": node_id}
@@ -24,6 +45,205 @@ def make_response(tid: bytes, r: dict) -> bytes:
     })
 
 
+def make_error(tid: bytes, code: int, message: str) -> bytes:
+    """Build an error message: y=e, e=[code, message]."""
+    return encode({
+        b"t": tid,
+        b"y": b"e",
+        b"e": [code, message.encode()]
+    })
+
+
 def decode_krpc(data: bytes) -> dict:
     """Decode one KRPC message. Returns dict with y, t, and q/r/a as applicable."""
-    return decode(data)
+    return decode(data, max_depth=KRPC_MAX_DEPTH, max_size=KRPC_MAX_SIZE)
+
+
+class KRPCError(Exception):
+    """The remote node answered with an error message."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.message = message
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, krpc):
+        self.krpc = krpc
+
+    def datagram_received(self, data, addr):
+        self.krpc._received(data, addr[:2])
+
+    def error_received(self, exc):
+        pass
+
+
+class KRPC:
+    def __init__(self, sock, node_id, timeout=QUERY_TIMEOUT, retries=RETRIES, max_outstanding=MAX_OUTSTANDING):
+        """sock: bound non-blocking UDP socket; it is wrapped in a datagram endpoint on first use."""
+        self.sock = sock
+        self.node_id = node_id
+        self.timeout = timeout
+        self.retries = retries
+        self.max_outstanding = max_outstanding
+        self.handlers = {}  # method -> handler(args, addr) returning the "r" dict (id added here)
+        self.on_query = None  # optional callback(msg, addr) for queries without a handler
+        self.limiter = None  # optional object with allow(ip): queries it refuses go unanswered
+        self._transport = None
+        self._opening = None
+        self._slots = None  # asyncio.Semaphore(max_outstanding), created inside the loop
+        self._pending = {}  # (transaction id, addr) -> future
+        self._next_tid = int.from_bytes(os.urandom(2), "big")
+
+        self.sent = 0
+        self.answered = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.errors = 0
+        self.stray = 0  # replies matching no outstanding query
+        self.queries_received = 0
+        self.queries_dropped = 0
+
+    async def start(self):
+        if self._transport is None:
+            if self._opening is None:
+                self._opening = asyncio.Lock()
+                self._slots = asyncio.Semaphore(self.max_outstanding)
+            async with self._opening:
+                if self._transport is None:
+                    loop = asyncio.get_running_loop()
+                    self._transport, _ = await loop.create_datagram_endpoint(
+                        lambda: _Protocol(self), sock=self.sock,
+                    )
+
+    def register(self, method, handler):
+        self.handlers[method] = handler
+
+    def _tid(self, addr):
+        for _ in range(0x10000):
+            self._next_tid = (self._next_tid + 1) & 0xFFFF
+            tid = struct.pack("!H", self._next_tid)
+            if (tid, addr) not in self._pending:
+                return tid
+        raise RuntimeError("No free transaction ID")
+
+    def send(self, data, addr):
+        if self._transport is not None:
+            self._transport.sendto(data, addr)
+
+    def _received(self, data, addr):
+        try:
+            msg = decode_krpc(data)
+        except ValueError:
+            return
+        if not isinstance(msg, dict):
+            return
+        kind = msg.get(b"y")
+        if kind in (b"r", b"e"):
+            tid = msg.get(b"t")
+            # Untrusted datagram: t must be bytes before it is used as a key.
+            future = self._pending.get((tid, addr)) if isinstance(tid, bytes) else None
+            if future is None or future.done():
+                self.stray += 1
+                return
+            future.set_result(msg)
+        elif kind == b"q":
+            self._dispatch(msg, addr)
+
+    def _dispatch(self, msg, addr):
+        self.queries_received += 1
+        tid, method, args = msg.get(b"t"), msg.get(b"q"), msg.get(b"a")
+        if not isinstance(tid, bytes):
+            self.queries_dropped += 1
+            return
+        if self.limiter is not None and not self.limiter.allow(addr[0]):
+            self.queries_dropped += 1
+            return
+        if not isinstance(method, bytes) or not isinstance(args, dict):
+            self.queries_dropped += 1
+            self.send(make_error(tid, ERROR_PROTOCOL, "Malformed query"), addr)
+            return
+        handler = self.handlers.get(method)
+        if handler is None:
+            if self.on_query is not None:
+                self.on_query(msg, addr)
+            else:
+                self.send(make_error(tid, ERROR_METHOD, "Method Unknown"), addr)
+            return
+        try:
+            r = handler(args, addr)
+        except KRPCError as e:
+            self.send(make_error(tid, e.code, e.message), addr)
+            return
+        except Exception:
+            self.send(make_error(tid, ERROR_SERVER, "Server Error"), addr)
+            return
+        if r is None:  # handler chose not to answer (e.g. rate limited)
+            self.queries_dropped += 1
+            return
+        self.send(make_response(tid, {**r, b"id": self.node_id}), addr)
+
+    async def _attempt(self, addr, method, args, timeout):
+        tid = self._tid(addr)
+        key = (tid, addr)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            self.sent += 1
+            self.send(make_query(method, args, self.node_id, tid), addr)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(key, None)
+
+    async def query(self, addr, method, args, timeout=None, retries=None):
+        """
+        Send a query to addr and return the "r" dict of its reply. Retries after timeouts;
+        raises asyncio.TimeoutError when every attempt went unanswered, KRPCError on an error reply.
+        """
+        await self.start()
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        async with self._slots:
+            for attempt in range(retries + 1):
+                try:
+                    msg = await self._attempt(addr, method, args, timeout)
+                    break
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    if attempt == retries:
+                        raise
+                    self.retried += 1
+        if msg.get(b"y") == b"e":
+            self.errors += 1
+            error = msg.get(b"e")
+            if isinstance(error, list) and len(error) >= 2:
+                raise KRPCError(error[0], error[1].decode("utf-8", "replace") if isinstance(error[1], bytes) else "")
+            raise KRPCError(ERROR_GENERIC, "Malformed error")
+        r = msg.get(b"r")
+        if not isinstance(r, dict):
+            raise KRPCError(ERROR_PROTOCOL, "Malformed reply")
+        self.answered += 1
+        return r
+
+    def close(self):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("KRPC closed"))
+        self._pending.clear()
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "answered": self.answered,
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+            "errors": self.errors,
+            "stray": self.stray,
+            "outstanding": len(self._pending),
+            "queries_received": self.queries_received,
+            "queries_dropped": self.queries_dropped,
+        }
@@ -0,0 +1,177 @@
+"""
+Iterative Kademlia lookup (BEP 5 get_peers / find_node).
+
+The shortlist holds every node heard of, ordered by XOR distance to the target. Up to alpha
+queries run at once, always to the closest nodes not asked yet, and the closer nodes each
+answer returns join the shortlist. The lookup ends when the k closest live nodes have all
+answered (or after max_queries). Peers from get_peers answers are streamed out as they arrive.
+"""
+import asyncio
+import socket
+import struct
+
+from .routing import ID_BITS, K, to_int
+
+ALPHA = 3
+MAX_QUERIES = 256
+
+STATE_NEW = "new"
+STATE_QUERYING = "querying"
+STATE_RESPONDED = "responded"
+STATE_FAILED = "failed"
+
+
+def parse_nodes(data):
+    """[(node_id, (ip, port))] from compact node info: 20-byte ID + 4-byte IPv4 + 2-byte port."""
+    if not isinstance(data, bytes):
+        return []
+    return [
+        (data[i:i + 20], (socket.inet_ntoa(data[i + 20:i + 24]), struct.unpack("!H", data[i + 24:i + 26])[0]))
+        for i in range(0, len(data) - 25, 26)
+    ]
+
+
+def encode_nodes(nodes):
+    """Compact node info for [(node_id, (ip, port))]."""
+    return b"".join(node_id + socket.inet_aton(ip) + struct.pack("!H", port) for node_id, (ip, port) in nodes)
+
+
+def parse_values(values):
+    """[(ip, port)] from a get_peers "values" list of compact 6-byte peers."""
+    if not isinstance(values, list):
+        return []
+    return [
+        (socket.inet_ntoa(v[:4]), struct.unpack("!H", v[4:6])[0])
+        for v in values if isinstance(v, bytes) and len(v) == 6
+    ]
+
+
+class _Candidate:
+    __slots__ = ("id", "addr", "distance", "state", "token")
+
+    def __init__(self, node_id, addr, target):
+        self.id = node_id
+        self.addr = addr
+        # Bootstrap routers have no known ID yet: ask them, but rank them behind every real node.
+        self.distance = to_int(node_id) ^ target if node_id else 1 << ID_BITS
+        self.state = STATE_NEW
+        self.token = None
+
+
+class Lookup:
+    def __init__(self, target, query, seeds, method=b"get_peers", routing=None, k=K, alpha=ALPHA,
+                 max_queries=MAX_QUERIES):
+        """
+        query(addr, method, args): coroutine returning the "r" dict of the answer, raising when
+        the node does not answer. seeds: [(node_id or None, (ip, port))] to start from.
+        routing: optional RoutingTable told about nodes that answer or fail.
+        """
+        self.target = target
+        self.target_value = to_int(target)
+        self.query = query
+        self.method = method
+        self.routing = routing
+        self.k = k
+        self.alpha = alpha
+        self.max_queries = max_queries
+        self.own_id = routing.own_id if routing is not None else None
+        self.candidates = {}  # addr -> _Candidate
+        self.peers = set()
+        self.queries = 0
+        self.responses = 0
+        self.failures = 0
+        for node_id, addr in seeds:
+            self._add(node_id, addr)
+
+    def _args(self):
+        if self.method == b"get_peers":
+            return {b"info_hash": self.target}
+        return {b"target": self.target}
+
+    def _add(self, node_id, addr):
+        if addr in self.candidates or (node_id is not None and node_id == self.own_id):
+            return
+        if addr[1] == 0:
+            return
+        self.candidates[addr] = _Candidate(node_id, addr, self.target_value)
+
+    def _window(self):
+        """The k closest candidates that have not failed."""
+        live = [c for c in self.candidates.values() if c.state != STATE_FAILED]
+        live.sort(key=lambda c: c.distance)
+        return live[:self.k]
+
+    def _next(self, count):
+        if self.queries >= self.max_queries:
+            return []
+        fresh = [c for c in self._window() if c.state == STATE_NEW]
+        return fresh[:min(count, self.max_queries - self.queries)]
+
+    async def _ask(self, cand):
+        cand.state = STATE_QUERYING
+        self.queries += 1
+        try:
+            r = await self.query(cand.addr, self.method, self._args())
+            node_id = r[b"id"]
+            if not isinstance(node_id, bytes) or len(node_id) != 20:
+                raise ValueError("Bad node id")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            cand.state = STATE_FAILED
+            self.failures += 1
+            if self.routing is not None and cand.id is not None:
+                self.routing.failed(cand.id)
+            return []
+        self.responses += 1
+        cand.state = STATE_RESPONDED
+        if cand.id is None:
+            cand.id = node_id
+            cand.distance = to_int(node_id) ^ self.target_value
+        cand.token = r.get(b"token")
+        if self.routing is not None:
+            self.routing.add(node_id, cand.addr)
+        for found_id, addr in parse_nodes(r.get(b"nodes")):
+            self._add(found_id, addr)
+        new = [p for p in parse_values(r.get(b"values")) if p not in self.peers]
+        self.peers.update(new)
+        return new
+
+    async def results(self):
+        """Async generator: lists of newly found peers as answers arrive, until the lookup converges."""
+        pending = set()
+        try:
+            while True:
+                for cand in self._next(self.alpha - len(pending)):
+                    pending.add(asyncio.ensure_future(self._ask(cand)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    found = task.result()
+                    if found:
+                        yield found
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def run(self):
+        """Run to completion; returns every peer found."""
+        async for _ in self.results():
+            pass
+        return list(self.peers)
+
+    def closest(self):
+        """[(node_id, addr, token)] of the k closest nodes that answered, nearest first."""
+        answered = [c for c in self.candidates.values() if c.state == STATE_RESPONDED]
+        answered.sort(key=lambda c: c.distance)
+        return [(c.id, c.addr, c.token) for c in answered[:self.k]]
+
+    def stats(self):
+        return {
+            "queries": self.queries,
+            "responses": self.responses,
+            "failures": self.failures,
+            "candidates": len(self.candidates),
+            "peers": len(self.peers),
+        }
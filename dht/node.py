@@ -1,92 +1,279 @@
 """
-Minimal DHT node: bootstrap and listen for get_peers/find_node responses.
-Enough to resolve peers from magnet links when combined with tracker flow.
+DHT node (BEP 5): a Kademlia routing table plus iterative get_peers / find_node lookups.
+Bootstrapping runs a find_node lookup for our own ID from the bootstrap routers; get_peers walks
+towards the info hash from the closest known nodes and streams peers out as answers arrive.
+All queries go through one KRPC transaction layer, so any number of lookups (one per torrent of
+a session) can run at once on the node's single socket.
+
+The node also answers ping, find_node, get_peers and announce_peer (rate limited per IP, with
+rotating tokens and an expiring peer store; see dht.server), announces our own torrents to the
+closest nodes of their lookups, and with a cache_path keeps its ID and good nodes across runs so
+a restart bootstraps from them instead of the routers.
 """
 import asyncio
 import os
 import socket
 
-from core.bencode import decode
-from .krpc import make_query, decode_krpc
+from core.bencode import BencodeError, decode, encode
+from .krpc import ERROR_PROTOCOL, KRPC, KRPCError
+from .lookup import Lookup, encode_nodes, parse_nodes
+from .routing import K, RoutingTable
+from .server import IPRateLimiter, PeerStore, TokenManager
 
 BOOTSTRAP_NODES = [
     ("router.bittorrent.com", 6881),
     ("dht.transmissionbt.com", 6881),
 ]
+LOOKUP_RETRIES = 0
+MAX_CACHED_NODES = 200
+
+
+def _node_id(args):
+    node_id = args.get(b"id")
+    if not isinstance(node_id, bytes) or len(node_id) != 20:
+        raise KRPCError(ERROR_PROTOCOL, "Bad id")
+    return node_id
+
+
+def _info_hash(args, key=b"info_hash"):
+    value = args.get(key)
+    if not isinstance(value, bytes) or len(value) != 20:
+        raise KRPCError(ERROR_PROTOCOL, f"Bad {key.decode()}")
+    return value
 
 
 class DHTNode:
-    def __init__(self, node_id=None, port=6881):
-        self.node_id = node_id or os.urandom(20)
+    def __init__(self, node_id=None, port=6881, bootstrap_nodes=None, cache_path=None):
+        """cache_path: file keeping the node ID and good nodes between runs (see save())."""
+        self.cache_path = cache_path
+        cached_id, self._cached = self._load_cache(cache_path) if cache_path else (None, [])
+        self.node_id = node_id or cached_id or os.urandom(20)
         self.port = port
+        self.bootstrap_nodes = BOOTSTRAP_NODES if bootstrap_nodes is None else bootstrap_nodes
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setblocking(False)
         self.sock.bind(("", port))
-        self._peers = []
-        self._running = False
+        self.routing = RoutingTable(self.node_id)
+        self.tokens = TokenManager()
+        self.peer_store = PeerStore()
+        self.krpc = KRPC(self.sock, self.node_id)
+        self.krpc.limiter = IPRateLimiter()
+        self.krpc.register(b"ping", self._on_ping)
+        self.krpc.register(b"find_node", self._on_find_node)
+        self.krpc.register(b"get_peers", self._on_get_peers)
+        self.krpc.register(b"announce_peer", self._on_announce_peer)
+        self._bootstrap_addrs = None
+        self._background = set()
+        self._closed = None
+        self.announced = 0  # announce_peer queries our torrents got accepted by
+
+    # Answering queries
+
+    def _querier(self, args, addr):
+        """Validate the querying node's ID; nodes that query us are how our buckets fill up."""
+        node_id = _node_id(args)
+        if args.get(b"ro") != 1:  # BEP 43 read-only nodes do not answer queries
+            self.routing.add(node_id, addr)
+        return node_id
+
+    def _on_ping(self, args, addr):
+        self._querier(args, addr)
+        return {}
+
+    def _closest_nodes(self, target):
+        return encode_nodes((node.id, node.addr) for node in self.routing.closest(target, K))
+
+    def _on_find_node(self, args, addr):
+        self._querier(args, addr)
+        return {b"nodes": self._closest_nodes(_info_hash(args, b"target"))}
+
+    def _on_get_peers(self, args, addr):
+        self._querier(args, addr)
+        info_hash = _info_hash(args)
+        r = {b"token": self.tokens.token(addr[0])}
+        peers = self.peer_store.get(info_hash)
+        if peers:
+            r[b"values"] = [socket.inet_aton(ip) + port.to_bytes(2, "big") for ip, port in peers]
+        else:
+            r[b"nodes"] = self._closest_nodes(info_hash)
+        return r
+
+    def _on_announce_peer(self, args, addr):
+        self._querier(args, addr)
+        info_hash = _info_hash(args)
+        if not self.tokens.valid(args.get(b"token"), addr[0]):
+            raise KRPCError(ERROR_PROTOCOL, "Bad token")
+        port = addr[1] if args.get(b"implied_port") == 1 else args.get(b"port")
+        if not isinstance(port, int) or not 0 < port < 65536:
+            raise KRPCError(ERROR_PROTOCOL, "Bad port")
+        self.peer_store.add(info_hash, (addr[0], port))
+        return {}
+
+    async def start(self, bootstrap=False):
+        """Start receiving (and answering queries) before the first lookup; optionally join in the background."""
+        await self.krpc.start()
+        if bootstrap:
+            self._spawn(self.bootstrap())
+
+    async def query(self, addr, method, args, timeout=None, retries=None):
+        """Send one query to addr and return the "r" dict of its reply (see dht.krpc.KRPC.query)."""
+        return await self.krpc.query(addr, method, args, timeout=timeout, retries=retries)
+
+    async def _lookup_query(self, addr, method, args):
+        # A lookup moves on to other nodes instead of waiting out a retry on a silent one.
+        return await self.krpc.query(addr, method, args, retries=LOOKUP_RETRIES)
+
+    async def _bootstrap_seeds(self):
+        if self._bootstrap_addrs is None:
+            loop = asyncio.get_running_loop()
+            addrs = []
+            for host, port in self.bootstrap_nodes:
+                try:
+                    infos = await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+                except OSError:
+                    continue
+                addrs.extend(info[4][:2] for info in infos[:1])
+            self._bootstrap_addrs = addrs
+        return [(None, addr) for addr in self._bootstrap_addrs]
+
+    async def _seeds(self, target):
+        """Closest known nodes; the bootstrap routers too while the table has fewer than k."""
+        seeds = [(node.id, node.addr) for node in self.routing.closest(target, K)]
+        if len(seeds) < K:
+            seeds += await self._bootstrap_seeds()
+        return seeds
+
+    async def lookup(self, target, method=b"get_peers"):
+        """A dht.lookup.Lookup towards target seeded from the routing table."""
+        return Lookup(target, self._lookup_query, await self._seeds(target), method=method, routing=self.routing)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def _refresh(self, node_id, addr):
+        try:
+            r = await self._lookup_query(addr, b"find_node", {b"target": self.node_id})
+            self.routing.add(_node_id(r), addr)
+        except Exception:
+            if node_id is not None:
+                self.routing.failed(node_id)
+
+    async def _bootstrap_from_cache(self):
+        """Ask every cached node at once; return as soon as k have answered (the rest keep going)."""
+        tasks = [self._spawn(self._refresh(node_id, addr)) for node_id, addr in self._cached]
+        for task in asyncio.as_completed(tasks):
+            await task
+            if len(self.routing) >= K:
+                return
 
     async def bootstrap(self):
-        """Send find_node to bootstrap nodes to join the DHT."""
-        loop = asyncio.get_running_loop()
-        for host, port in BOOTSTRAP_NODES:
-            try:
-                msg = make_query(b"find_node", {b"target": self.node_id}, self.node_id)
-                await loop.sock_sendto(self.sock, msg, (host, port))
-            except Exception:
-                pass
+        """
+        Join the DHT. Cached nodes from the last run are asked first, and we return once k of
+        them answered; the find_node lookup for our own ID that fills the buckets near us then
+        continues in the background. Without a live cached node it starts from the bootstrap
+        routers and is awaited. Returns the routing table size.
+        """
+        if self._cached:
+            await self._bootstrap_from_cache()
+        join = await self.lookup(self.node_id, method=b"find_node")
+        if len(self.routing):
+            self._spawn(join.run())
+        else:
+            await join.run()
+        return len(self.routing)
+
+    async def announce_peer(self, info_hash, port, nodes):
+        """announce_peer to nodes [(node_id, addr, token)] from a lookup; returns how many accepted."""
+        args = {b"info_hash": info_hash, b"port": port, b"implied_port": 0}
+        answers = await asyncio.gather(
+            *(self.query(addr, b"announce_peer", {**args, b"token": token})
+              for _, addr, token in nodes if isinstance(token, bytes)),
+            return_exceptions=True,
+        )
+        accepted = sum(1 for answer in answers if isinstance(answer, dict))
+        self.announced += accepted
+        return accepted
 
-    async def get_peers(self, info_hash: bytes, timeout=5.0):
+    async def iter_peers(self, info_hash: bytes, announce_port=None):
         """
-        Ask bootstrap nodes for peers for info_hash. Returns list of (ip, port).
-        Minimal implementation: no full routing table; just fire get_peers at bootstrap nodes.
+        Async generator: lists of new (ip, port) peers for info_hash as lookup answers arrive.
+        With announce_port, we announce ourselves to the closest nodes once the lookup converged.
         """
-        loop = asyncio.get_running_loop()
-        msg = make_query(b"get_peers", {b"info_hash": info_hash}, self.node_id)
-        self._peers = []
-        for host, port in BOOTSTRAP_NODES:
-            try:
-                await loop.sock_sendto(self.sock, msg, (host, port))
-            except Exception:
-                pass
+        lookup = await self.lookup(info_hash)
+        async for peers in lookup.results():
+            yield peers
+        if announce_port is not None:
+            await self.announce_peer(info_hash, announce_port, lookup.closest())
 
-        deadline = loop.time() + timeout
-        while loop.time() < deadline and len(self._peers) < 50:
-            try:
-                data, addr = await asyncio.wait_for(
-                    loop.sock_recvfrom(self.sock, 4096),
-                    timeout=min(1.0, deadline - loop.time())
-                )
-            except asyncio.TimeoutError:
-                continue
-            try:
-                m = decode_krpc(data)
-                if m.get(b"y") == b"r" and b"r" in m:
-                    r = m[b"r"]
-                    if b"values" in r:
-                        for v in r[b"values"]:
-                            if isinstance(v, bytes) and len(v) >= 6:
-                                ip = ".".join(map(str, v[:4]))
-                                port = int.from_bytes(v[4:6], "big")
-                                self._peers.append((ip, port))
-            except Exception:
-                pass
-        return list(dict.fromkeys(self._peers))
+    async def get_peers(self, info_hash: bytes, timeout=5.0, announce_port=None):
+        """
+        Peers for info_hash found by one iterative lookup, stopped after timeout seconds.
+        With announce_port, we announce ourselves to the closest nodes the lookup reached.
+        """
+        lookup = await self.lookup(info_hash)
+        try:
+            await asyncio.wait_for(lookup.run(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if announce_port is not None:
+            await self.announce_peer(info_hash, announce_port, lookup.closest())
+        return list(lookup.peers)
+
+    # Node cache
+
+    @staticmethod
+    def _load_cache(path):
+        try:
+            with open(path, "rb") as f:
+                data = decode(f.read())
+            node_id = data[b"id"] if isinstance(data.get(b"id"), bytes) and len(data[b"id"]) == 20 else None
+            return node_id, parse_nodes(data.get(b"nodes", b""))
+        except (OSError, BencodeError, AttributeError):
+            return None, []
+
+    def save(self, path=None):
+        """Write our node ID and up to MAX_CACHED_NODES good routing table nodes, most recently heard first."""
+        path = path or self.cache_path
+        if not path:
+            return
+        nodes = sorted(self.routing.good_nodes(), key=lambda n: n.last_seen, reverse=True)[:MAX_CACHED_NODES]
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(encode({b"id": self.node_id, b"nodes": encode_nodes((n.id, n.addr) for n in nodes)}))
+        os.replace(tmp, path)
 
     async def listen(self, callback=None):
-        """Run receive loop; callback(msg, addr) if provided."""
-        loop = asyncio.get_running_loop()
-        self._running = True
-        while self._running:
-            try:
-                data, addr = await loop.sock_recvfrom(self.sock, 4096)
-                msg = decode_krpc(data)
-                if callback:
-                    callback(msg, addr)
-            except Exception:
-                pass
+        """Answer incoming queries until close(); callback(msg, addr) gets those without a handler."""
+        if self._closed is None:
+            self._closed = asyncio.Event()
+        self.krpc.on_query = callback
+        await self.krpc.start()
+        await self._closed.wait()
+
+    def stats(self):
+        return {
+            "routing": self.routing.stats(),
+            "krpc": self.krpc.stats(),
+            "peer_store": self.peer_store.stats(),
+            "rate_limited": self.krpc.limiter.dropped,
+            "announced": self.announced,
+        }
 
     def close(self):
-        self._running = False
+        """Stop the node; with a cache_path, its good nodes are saved for the next start."""
+        for task in list(self._background):
+            task.cancel()
+        if self.cache_path and len(self.routing):
+            try:
+                self.save()
+            except OSError:
+                pass
+        self.krpc.close()
+        if self._closed is not None:
+            self._closed.set()
         try:
             self.sock.close()
         except Exception:
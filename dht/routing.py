@@ -1,15 +1,155 @@
 """
-Minimal DHT routing: store nodes and find closest to a target.
-Full Kademlia would use k-buckets; here we keep a simple list for bootstrap/peer discovery.
+Kademlia routing table (BEP 5): node IDs as 160-bit integers, XOR distance, and k-buckets that
+split while they cover our own ID. A full bucket that cannot split keeps newcomers in a small
+replacement cache and swaps them in for nodes that stop answering.
 """
+import bisect
 import hashlib
+import heapq
+import time
 
+K = 8  # nodes per bucket
+ID_BITS = 160
+MAX_FAILURES = 2  # unanswered queries before a node may be replaced
+GOOD_FOR = 15 * 60  # BEP 5: a node heard from within 15 minutes is good
 
-def distance(a: bytes, b: bytes) -> bytes:
-    """XOR distance between two 20-byte node IDs."""
-    return bytes(x ^ y for x, y in zip(a, b))
+
+def to_int(node_id: bytes) -> int:
+    return int.from_bytes(node_id, "big")
+
+
+def distance(a: bytes, b: bytes) -> int:
+    """XOR distance between two 20-byte node IDs, as an integer."""
+    return to_int(a) ^ to_int(b)
 
 
 def id_for_peer(ip: str, port: int) -> bytes:
     """Stable node ID from address (for routing table)."""
     return hashlib.sha1(f"{ip}:{port}".encode()).digest()
+
+
+class Node:
+    __slots__ = ("id", "value", "addr", "last_seen", "failures")
+
+    def __init__(self, node_id, addr):
+        self.id = node_id
+        self.value = to_int(node_id)
+        self.addr = addr
+        self.last_seen = time.monotonic()
+        self.failures = 0
+
+    def good(self, now=None):
+        return self.failures == 0 and (now or time.monotonic()) - self.last_seen < GOOD_FOR
+
+
+class KBucket:
+    def __init__(self, lo, hi):
+        self.lo = lo  # covers node ID values lo <= value < hi
+        self.hi = hi
+        self.nodes = []  # least recently seen first
+        self.replacements = []  # most recent last, at most k
+
+    def covers(self, value):
+        return self.lo <= value < self.hi
+
+    def find(self, value):
+        for node in self.nodes:
+            if node.value == value:
+                return node
+        return None
+
+
+class RoutingTable:
+    def __init__(self, own_id, k=K):
+        self.own_id = own_id
+        self.own = to_int(own_id)
+        self.k = k
+        self.buckets = [KBucket(0, 1 << ID_BITS)]
+        self._los = [0]  # bucket lower bounds, for bisect
+
+    def _index(self, value):
+        return bisect.bisect_right(self._los, value) - 1
+
+    def bucket_for(self, value):
+        return self.buckets[self._index(value)]
+
+    def add(self, node_id, addr):
+        """Record a node that answered us; returns True if it is in the table afterwards."""
+        if len(node_id) != 20 or node_id == self.own_id:
+            return False
+        value = to_int(node_id)
+        while True:
+            index = self._index(value)
+            bucket = self.buckets[index]
+            node = bucket.find(value)
+            if node is not None:
+                node.addr = addr
+                node.last_seen = time.monotonic()
+                node.failures = 0
+                bucket.nodes.remove(node)
+                bucket.nodes.append(node)
+                return True
+            if len(bucket.nodes) < self.k:
+                bucket.nodes.append(Node(node_id, addr))
+                return True
+            if bucket.covers(self.own) and bucket.hi - bucket.lo > 1:
+                self._split(index)
+                continue
+            bad = next((n for n in bucket.nodes if n.failures >= MAX_FAILURES), None)
+            if bad is not None:
+                bucket.nodes.remove(bad)
+                bucket.nodes.append(Node(node_id, addr))
+                return True
+            bucket.replacements = [n for n in bucket.replacements if n.value != value]
+            bucket.replacements.append(Node(node_id, addr))
+            del bucket.replacements[:-self.k]
+            return False
+
+    def _split(self, index):
+        bucket = self.buckets[index]
+        mid = (bucket.lo + bucket.hi) // 2
+        low, high = KBucket(bucket.lo, mid), KBucket(mid, bucket.hi)
+        for node in bucket.nodes:
+            (low if node.value < mid else high).nodes.append(node)
+        for node in bucket.replacements:
+            (low if node.value < mid else high).replacements.append(node)
+        self.buckets[index:index + 1] = [low, high]
+        self._los.insert(index + 1, mid)
+
+    def failed(self, node_id):
+        """A query to node_id went unanswered; after MAX_FAILURES a cached replacement takes its place."""
+        value = to_int(node_id)
+        bucket = self.bucket_for(value)
+        node = bucket.find(value)
+        if node is None:
+            return
+        node.failures += 1
+        if node.failures >= MAX_FAILURES and bucket.replacements:
+            bucket.nodes.remove(node)
+            bucket.nodes.append(bucket.replacements.pop())
+
+    def closest(self, target: bytes, count=None):
+        """The count (default k) known nodes closest to target, nearest first; unresponsive ones last."""
+        value = to_int(target)
+        return heapq.nsmallest(
+            count or self.k, self.nodes(),
+            key=lambda n: (n.failures >= MAX_FAILURES, n.value ^ value),
+        )
+
+    def nodes(self):
+        return [node for bucket in self.buckets for node in bucket.nodes]
+
+    def good_nodes(self):
+        now = time.monotonic()
+        return [node for node in self.nodes() if node.good(now)]
+
+    def __len__(self):
+        return sum(len(bucket.nodes) for bucket in self.buckets)
+
+    def stats(self):
+        return {
+            "nodes": len(self),
+            "good": len(self.good_nodes()),
+            "buckets": len(self.buckets),
+            "replacements": sum(len(bucket.replacements) for bucket in self.buckets),
+        }
@@ -0,0 +1,136 @@
+"""
+State for answering DHT queries (BEP 5 server side):
+
+- TokenManager: get_peers tokens are a hash of the querier's IP and a secret that rotates every
+  5 minutes; announce_peer accepts tokens made with the current or the previous secret, so a
+  token stays valid for 5-10 minutes without being stored anywhere.
+- PeerStore: peers announced to us per info hash, expiring after PEER_TTL, with caps on the
+  number of info hashes and of peers per info hash (oldest dropped first).
+- IPRateLimiter: a token bucket per source IP; queries over the limit are dropped unanswered.
+"""
+import hashlib
+import hmac
+import os
+import random
+import time
+from collections import OrderedDict
+
+TOKEN_ROTATE = 300.0
+TOKEN_SIZE = 8
+
+PEER_TTL = 30 * 60.0
+MAX_INFO_HASHES = 2000
+MAX_PEERS_PER_INFO_HASH = 200
+MAX_VALUES = 50  # peers returned per get_peers answer (fits a UDP datagram)
+PURGE_INTERVAL = 60.0
+
+QUERY_RATE = 5.0  # queries/s per IP
+QUERY_BURST = 20.0
+MAX_TRACKED_IPS = 10000
+
+
+class TokenManager:
+    def __init__(self, rotate_interval=TOKEN_ROTATE):
+        self.rotate_interval = rotate_interval
+        self._secrets = [os.urandom(16), os.urandom(16)]  # current, previous
+        self._rotated = time.monotonic()
+
+    def _rotate(self):
+        now = time.monotonic()
+        while now - self._rotated >= self.rotate_interval:
+            self._secrets = [os.urandom(16), self._secrets[0]]
+            self._rotated += self.rotate_interval
+
+    def _make(self, secret, ip):
+        return hashlib.sha1(secret + ip.encode()).digest()[:TOKEN_SIZE]
+
+    def token(self, ip):
+        self._rotate()
+        return self._make(self._secrets[0], ip)
+
+    def valid(self, token, ip):
+        self._rotate()
+        if not isinstance(token, bytes):
+            return False
+        return any(hmac.compare_digest(token, self._make(secret, ip)) for secret in self._secrets)
+
+
+class PeerStore:
+    def __init__(self, ttl=PEER_TTL, max_info_hashes=MAX_INFO_HASHES, max_peers=MAX_PEERS_PER_INFO_HASH):
+        self.ttl = ttl
+        self.max_info_hashes = max_info_hashes
+        self.max_peers = max_peers
+        self._swarms = OrderedDict()  # info_hash -> {(ip, port): expiry}, least recently announced first
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+
+    def _expire(self, info_hash, now):
+        peers = self._swarms.get(info_hash)
+        if peers is None:
+            return None
+        for peer in [p for p, expiry in peers.items() if expiry <= now]:
+            del peers[peer]
+        if not peers:
+            del self._swarms[info_hash]
+            return None
+        return peers
+
+    def purge(self):
+        now = time.monotonic()
+        for info_hash in list(self._swarms):
+            self._expire(info_hash, now)
+        self._next_purge = now + PURGE_INTERVAL
+
+    def add(self, info_hash, peer):
+        now = time.monotonic()
+        if now >= self._next_purge:
+            self.purge()
+        peers = self._swarms.get(info_hash)
+        if peers is None:
+            if len(self._swarms) >= self.max_info_hashes:
+                self._swarms.popitem(last=False)
+            peers = self._swarms[info_hash] = {}
+        else:
+            self._swarms.move_to_end(info_hash)
+        peers.pop(peer, None)  # re-insert: dict order is announce order, oldest first
+        peers[peer] = now + self.ttl
+        while len(peers) > self.max_peers:
+            del peers[next(iter(peers))]
+
+    def get(self, info_hash, count=MAX_VALUES):
+        """Up to count random live peers for info_hash."""
+        peers = self._expire(info_hash, time.monotonic())
+        if not peers:
+            return []
+        peers = list(peers)
+        return random.sample(peers, count) if len(peers) > count else peers
+
+    def __len__(self):
+        return sum(len(peers) for peers in self._swarms.values())
+
+    def stats(self):
+        return {"info_hashes": len(self._swarms), "peers": len(self)}
+
+
+class IPRateLimiter:
+    def __init__(self, rate=QUERY_RATE, burst=QUERY_BURST, max_tracked=MAX_TRACKED_IPS):
+        self.rate = rate
+        self.burst = burst
+        self.max_tracked = max_tracked
+        self._buckets = OrderedDict()  # ip -> [tokens, stamp], least recently seen first
+        self.dropped = 0
+
+    def allow(self, ip):
+        now = time.monotonic()
+        bucket = self._buckets.pop(ip, None)
+        if bucket is None:
+            bucket = [self.burst, now]
+            if len(self._buckets) >= self.max_tracked:
+                self._buckets.popitem(last=False)
+        self._buckets[ip] = bucket
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            self.dropped += 1
+            return False
+        bucket[0] -= 1
+        return True
@@ -0,0 +1,179 @@
+"""
+Choking algorithm (BEP 3 style): a fixed number of upload slots, reassigned every interval by
+measured rate. While leeching, interested peers that upload to us fastest are unchoked
+(tit-for-tat); while seeding, the peers that download from us fastest. One slot rotates as an
+optimistic unchoke every few rounds, favouring newly connected peers, so peers without history
+get a chance to prove themselves.
+
+One Choker per torrent keeps the torrent's connections; it also broadcasts HAVE to them.
+"""
+import asyncio
+import random
+import time
+
+from core.messages import choke, have, unchoke
+
+UPLOAD_SLOTS = 4
+RECHOKE_INTERVAL = 10.0
+OPTIMISTIC_EVERY = 3  # rechoke rounds between optimistic unchoke rotations
+NEW_PEER_WEIGHT = 3  # new peers are this much likelier to be picked as optimistic unchoke
+
+
+class _PeerRates:
+    def __init__(self, conn, now):
+        self.connected_at = now
+        self.last_downloaded = conn.downloaded
+        self.last_uploaded = conn.uploaded
+        self.download_rate = 0.0  # bytes/s from the peer over the last round
+        self.upload_rate = 0.0  # bytes/s to the peer over the last round
+
+
+class Choker:
+    def __init__(
+        self,
+        slots=UPLOAD_SLOTS,
+        interval=RECHOKE_INTERVAL,
+        optimistic_every=OPTIMISTIC_EVERY,
+        seeding=None,
+    ):
+        self.slots = max(1, slots)
+        self.interval = interval
+        self.optimistic_every = max(1, optimistic_every)
+        self.seeding = seeding or (lambda: False)  # callable: rank by upload rate when True
+        self.peers = {}  # PeerConnection -> _PeerRates
+        self.optimistic = None
+        self.rounds = 0
+        self._last_round = time.monotonic()
+
+        self.unchokes = 0
+        self.chokes = 0
+        self._closed_uploaded = 0  # totals of connections already removed
+        self._closed_downloaded = 0
+
+    def add(self, conn):
+        """Register a connection; it stays choked until it is interested and gets a slot."""
+        conn.choker = self
+        self.peers[conn] = _PeerRates(conn, time.monotonic())
+
+    def remove(self, conn):
+        if self.peers.pop(conn, None) is not None:
+            self._closed_uploaded += conn.uploaded
+            self._closed_downloaded += conn.downloaded
+        conn.choker = None
+        if conn is self.optimistic:
+            self.optimistic = None
+
+    def transferred(self):
+        """(uploaded, downloaded) block bytes over every connection this torrent has had."""
+        uploaded = self._closed_uploaded + sum(conn.uploaded for conn in self.peers)
+        downloaded = self._closed_downloaded + sum(conn.downloaded for conn in self.peers)
+        return uploaded, downloaded
+
+    def unchoked(self):
+        return [conn for conn in self.peers if not conn.am_choking]
+
+    async def _set_choked(self, conn, choked):
+        if conn.am_choking == choked:
+            return
+        try:
+            await conn.send(choke() if choked else unchoke())
+        except (ConnectionError, OSError, RuntimeError):
+            return  # closing (or busy in sendfile): its worker removes it
+        conn.am_choking = choked
+        if choked:
+            self.chokes += 1
+        else:
+            self.unchokes += 1
+
+    async def interest_changed(self, conn):
+        """A newly interested peer is unchoked at once while a slot is free; the rest wait for a rechoke."""
+        if conn.peer_interested and conn.am_choking and conn in self.peers:
+            if sum(1 for c in self.unchoked() if c.peer_interested) < self.slots:
+                await self._set_choked(conn, False)
+
+    def broadcast_have(self, index):
+        """Announce a newly completed piece to every connection (HAVE is tiny: no drain)."""
+        message = have(index)
+        for conn in list(self.peers):
+            try:
+                conn.writer.write(message)
+            except (ConnectionError, OSError, RuntimeError):
+                pass
+
+    def _measure(self):
+        now = time.monotonic()
+        elapsed = max(now - self._last_round, 1e-3)
+        self._last_round = now
+        for conn, rates in self.peers.items():
+            rates.download_rate = (conn.downloaded - rates.last_downloaded) / elapsed
+            rates.upload_rate = (conn.uploaded - rates.last_uploaded) / elapsed
+            rates.last_downloaded = conn.downloaded
+            rates.last_uploaded = conn.uploaded
+
+    def _pick_optimistic(self, candidates):
+        if not candidates:
+            return None
+        now = time.monotonic()
+        new_after = now - self.interval * self.optimistic_every
+        weights = [
+            NEW_PEER_WEIGHT if self.peers[conn].connected_at >= new_after else 1 for conn in candidates
+        ]
+        return random.choices(candidates, weights=weights)[0]
+
+    async def rechoke(self):
+        """Reassign upload slots by the rates measured since the previous round."""
+        self._measure()
+        self.rounds += 1
+        seeding = self.seeding()
+        interested = [conn for conn in self.peers if conn.peer_interested]
+
+        def rate(conn):
+            rates = self.peers[conn]
+            if seeding:
+                return (rates.upload_rate, rates.download_rate)
+            return (rates.download_rate, rates.upload_rate)
+
+        interested.sort(key=rate, reverse=True)
+        regular = interested[:self.slots - 1] if len(interested) > self.slots else interested
+        unchoke_set = set(regular)
+        candidates = [conn for conn in interested if conn not in unchoke_set]
+        rotate = self.rounds % self.optimistic_every == 1 or self.optimistic_every == 1
+        if self.optimistic not in candidates or rotate:
+            self.optimistic = self._pick_optimistic(candidates)
+        if self.optimistic is not None:
+            unchoke_set.add(self.optimistic)
+
+        for conn in list(self.peers):
+            await self._set_choked(conn, conn not in unchoke_set)
+
+    async def run(self):
+        """Rechoke every interval until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.rechoke()
+
+    def stats(self):
+        """Slot configuration and per-peer choke state and rates."""
+        peers = []
+        for conn, rates in self.peers.items():
+            peername = conn.writer.get_extra_info("peername")
+            peers.append({
+                "peer": peername[:2] if peername else None,
+                "am_choking": conn.am_choking,
+                "peer_interested": conn.peer_interested,
+                "optimistic": conn is self.optimistic,
+                "download_rate": rates.download_rate,
+                "upload_rate": rates.upload_rate,
+            })
+        return {
+            "slots": self.slots,
+            "interval": self.interval,
+            "seeding": self.seeding(),
+            "rounds": self.rounds,
+            "peers": len(self.peers),
+            "interested": sum(1 for conn in self.peers if conn.peer_interested),
+            "unchoked": len(self.unchoked()),
+            "unchokes": self.unchokes,
+            "chokes": self.chokes,
+            "peer_states": peers,
+        }
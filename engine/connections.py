@@ -0,0 +1,321 @@
+"""
+Peer connection manager for one torrent: keeps a deduplicated candidate set (tracker, DHT, PEX),
+keeps `target` connections open, and replaces peers that do not deliver.
+
+- Connects race: several attempts run at once (bounded by max_half_open), more than the free
+  slots, so dead addresses cost one timeout in parallel instead of one after another. An attempt
+  that completes after the slots are full takes the slot of the slowest established peer, or is
+  closed without penalty.
+- Failed attempts and peers that delivered nothing are retried with exponential backoff.
+- Connected peers are scored by delivered bytes/s over each evaluation window; the slowest ones
+  are closed once they are old enough, so their slots go to untried candidates.
+- With nothing connected or connecting and every candidate in backoff for give_up_after
+  seconds, the pool is stalled(): the caller may give up instead of waiting out the backoff.
+"""
+import asyncio
+import random
+import time
+
+STATE_IDLE = "idle"
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+
+MAX_HALF_OPEN = 8
+RACE = 3  # connect attempts per free slot
+BACKOFF_BASE = 15.0  # seconds after the first failure, doubled per further failure
+BACKOFF_MAX = 1800.0
+MAX_FAILURES = 8  # candidates failing this often are forgotten
+EVICT_BACKOFF = 300.0  # an evicted (slow) peer is not retried before this
+GIVE_UP_AFTER = 60.0  # seconds without connections or a candidate to try before stalled()
+EVALUATE_INTERVAL = 20.0
+MIN_AGE = 30.0  # seconds a peer gets to ramp up before it can be evicted
+SLOW_FRACTION = 0.25  # evict peers slower than this fraction of the median score
+
+
+class Candidate:
+    def __init__(self, addr):
+        self.addr = addr
+        self.state = STATE_IDLE
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.score = None  # bytes/s during the last connection, None if never connected
+        self.conn = None
+        self.task = None
+        self.connected_at = None
+        self._last_bytes = 0
+        self.evict = False
+
+    def backoff(self, now):
+        self.next_attempt = now + min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        target=20,
+        max_half_open=MAX_HALF_OPEN,
+        race=RACE,
+        evaluate_interval=EVALUATE_INTERVAL,
+        min_age=MIN_AGE,
+        can_connect=None,
+        give_up_after=GIVE_UP_AFTER,
+    ):
+        self.target = target
+        self.max_half_open = max_half_open
+        self.race = max(1, race)
+        self.evaluate_interval = evaluate_interval
+        self.min_age = min_age
+        self.give_up_after = give_up_after
+        self._idle_since = None  # since when nothing is connected, connecting or ready (stalled())
+        self.can_connect = can_connect  # optional callable: False while a global limit is reached
+        self.candidates = {}  # (ip, port) -> Candidate
+        self.half_open = 0
+        self.connected = 0
+        self.tasks = set()
+        self._wakeup = asyncio.Event()
+        self._last_evaluation = time.monotonic()
+
+        self.attempts = 0
+        self.failed = 0
+        self.evicted = 0
+        self.surplus = 0  # connects that lost the race and were closed
+
+    def add(self, peers):
+        """Add candidate (ip, port) addresses; known ones are kept with their history."""
+        added = False
+        for addr in peers:
+            if addr not in self.candidates:
+                self.candidates[addr] = Candidate(addr)
+                added = True
+        if added:
+            self._wakeup.set()
+
+    def ready(self, now=None):
+        """Candidates that may be tried now: best previous score first, then untried, then failed."""
+        now = now or time.monotonic()
+        ready = [c for c in self.candidates.values() if c.state == STATE_IDLE and c.next_attempt <= now]
+        random.shuffle(ready)
+        ready.sort(key=lambda c: (c.failures, -(c.score or 0.0)))
+        return ready
+
+    def wake(self):
+        """Re-check candidates now, e.g. after a connection slot elsewhere was freed."""
+        self._wakeup.set()
+
+    def waiting(self):
+        """Number of candidates that could be tried now."""
+        now = time.monotonic()
+        return sum(1 for c in self.candidates.values() if c.state == STATE_IDLE and c.next_attempt <= now)
+
+    def _slot_available(self):
+        return self.can_connect is None or self.can_connect()
+
+    def _free_slots(self):
+        return self.target - self.connected
+
+    def _fill(self, start_worker):
+        now = time.monotonic()
+        limit = min(self.max_half_open, max(0, self._free_slots()) * self.race)
+        if self.half_open >= limit:
+            return
+        for cand in self.ready(now):
+            if self.half_open >= limit or not self._slot_available():
+                break
+            self._start(cand, start_worker)
+
+    def _start(self, cand, start_worker):
+        cand.state = STATE_CONNECTING
+        self.half_open += 1
+        self.attempts += 1
+        task = asyncio.create_task(self._attempt(cand, start_worker))
+        cand.task = task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _attempt(self, cand, start_worker):
+        def on_connected(conn):
+            self.half_open -= 1
+            full = not self._slot_available() or (self.connected >= self.target and not self._evict_slowest())
+            if full:
+                # Lost the race: every slot filled while this connect was in flight.
+                self.surplus += 1
+                cand.state = STATE_IDLE
+                cand.next_attempt = time.monotonic() + self.evaluate_interval
+                return False
+            cand.state = STATE_CONNECTED
+            cand.conn = conn
+            cand.connected_at = time.monotonic()
+            cand._last_bytes = conn.downloaded
+            self.connected += 1
+            return True
+
+        try:
+            await start_worker(cand.addr, on_connected)
+        except Exception:
+            pass
+        finally:
+            now = time.monotonic()
+            if cand.state == STATE_CONNECTING:
+                self.half_open -= 1
+                cand.state = STATE_IDLE
+                self._failed(cand, now)
+            elif cand.conn is not None:  # connected, or evicted to make room (already uncounted)
+                if cand.state == STATE_CONNECTED:
+                    self.connected -= 1
+                cand.state = STATE_IDLE
+                delivered = cand.conn.downloaded
+                elapsed = max(now - cand.connected_at, 1e-3)
+                cand.score = delivered / elapsed
+                if cand.evict:
+                    cand.evict = False
+                    cand.next_attempt = now + EVICT_BACKOFF
+                elif delivered:
+                    cand.failures = 0
+                    cand.next_attempt = now + BACKOFF_BASE
+                else:
+                    self._failed(cand, now)
+                cand.conn = None
+            self._wakeup.set()
+
+    def _failed(self, cand, now):
+        self.failed += 1
+        cand.failures += 1
+        if cand.failures >= MAX_FAILURES:
+            del self.candidates[cand.addr]
+        else:
+            cand.backoff(now)
+
+    def _connected(self):
+        return [c for c in self.candidates.values() if c.state == STATE_CONNECTED]
+
+    def _window_scores(self):
+        """Delivered bytes/s of each connected peer since the previous evaluation."""
+        now = time.monotonic()
+        elapsed = max(now - self._last_evaluation, 1e-3)
+        self._last_evaluation = now
+        for cand in self._connected():
+            delivered = cand.conn.downloaded - cand._last_bytes
+            cand._last_bytes = cand.conn.downloaded
+            cand.score = delivered / elapsed
+
+    def _eviction_candidate(self):
+        """Slowest connected peer that is old enough and far below the median, or None."""
+        now = time.monotonic()
+        connected = self._connected()
+        aged = [c for c in connected if not c.evict and now - c.connected_at >= self.min_age]
+        if not aged:
+            return None
+        scores = sorted(c.score or 0.0 for c in connected)
+        median = scores[len(scores) // 2]
+        slowest = min(aged, key=lambda c: c.score or 0.0)
+        if (slowest.score or 0.0) <= SLOW_FRACTION * median or not slowest.score:
+            return slowest
+        return None
+
+    def _evict(self, cand):
+        cand.evict = True
+        self.evicted += 1
+        try:
+            cand.conn.writer.close()
+        except Exception:
+            pass
+
+    def _evict_slowest(self):
+        cand = self._eviction_candidate()
+        if cand is None:
+            return False
+        self._evict(cand)
+        self.connected -= 1  # its slot goes to the newcomer right away
+        cand.state = STATE_IDLE
+        cand.next_attempt = time.monotonic() + EVICT_BACKOFF
+        return True
+
+    def evaluate(self):
+        """Re-score connected peers; with slots full and fresh candidates waiting, drop the slowest."""
+        self._window_scores()
+        full = self.connected >= self.target or (self.connected and not self._slot_available())
+        if full and self.waiting():
+            cand = self._eviction_candidate()
+            if cand is not None:
+                self._evict(cand)
+
+    def low(self):
+        """No candidate to try now and free slots left: more addresses are needed."""
+        return not self.waiting() and not self.half_open and self.connected < self.target
+
+    def stalled(self):
+        """
+        True once no connection has been open or in flight and no candidate ready to try for
+        give_up_after seconds: the known peers are all failing, and their backoff (up to
+        BACKOFF_MAX) would otherwise keep a caller waiting for the pool to empty for half an hour.
+        """
+        now = time.monotonic()
+        if self.tasks or self.waiting():
+            self._idle_since = None
+            return False
+        if self._idle_since is None:
+            self._idle_since = now
+        return now - self._idle_since >= self.give_up_after
+
+    async def _read(self, peer_queue):
+        while True:
+            peers = [await peer_queue.get()]
+            while not peer_queue.empty():
+                peers.append(peer_queue.get_nowait())
+            self.add(peers)
+
+    async def run(self, start_worker, done, peer_queue=None, on_low=None):
+        """
+        Keep connections open until done() is true. start_worker(addr, on_connected) runs one
+        peer connection; it must call on_connected(conn) once the handshake succeeded and stop
+        if that returns False. Peers put on peer_queue (trackers, DHT, PEX) become candidates
+        the moment they arrive. on_low() is called while low() is true.
+        """
+        next_evaluation = time.monotonic() + self.evaluate_interval
+        reader = asyncio.create_task(self._read(peer_queue)) if peer_queue is not None else None
+        try:
+            while not done():
+                self._fill(start_worker)
+                if on_low is not None and self.low():
+                    on_low()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    pass
+                if time.monotonic() >= next_evaluation:
+                    next_evaluation = time.monotonic() + self.evaluate_interval
+                    self.evaluate()
+        finally:
+            if reader is not None:
+                reader.cancel()
+            # Connected workers stop by themselves once done(); pending connects are abandoned.
+            for cand in self.candidates.values():
+                if cand.state == STATE_CONNECTING and cand.task is not None:
+                    cand.task.cancel()
+
+    async def wait_closed(self):
+        """Wait for every connection task to finish."""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def close(self):
+        """Cancel every connection and wait for them."""
+        for task in list(self.tasks):
+            task.cancel()
+        await self.wait_closed()
+
+    def stats(self):
+        connected = self._connected()
+        return {
+            "target": self.target,
+            "connected": self.connected,
+            "half_open": self.half_open,
+            "candidates": len(self.candidates),
+            "ready": self.waiting(),
+            "attempts": self.attempts,
+            "failed": self.failed,
+            "evicted": self.evicted,
+            "surplus": self.surplus,
+            "scores": sorted((c.score or 0.0 for c in connected), reverse=True),
+        }
@@ -0,0 +1,196 @@
+"""
+Continuous peer discovery for one torrent. Every source feeds one PeerStream, which the
+ConnectionManager reads while it runs, so the first connect starts as soon as any source has an
+address instead of after every source answered:
+
+- trackers: each announce-list tier's answer as it arrives, then its re-announces;
+- DHT: iterative lookups whose peers are streamed as answers arrive, repeated every
+  DHT_INTERVAL (each one announces us when we listen);
+- PEX: workers put the peers of ut_pex messages on the stream;
+- inbound connections are already connected, so they are only counted.
+
+Discovery keeps going for the whole download. When the manager runs out of candidates,
+replenish() asks the trackers again as soon as their min interval allows and starts a new DHT
+lookup, at most every DHT_MIN_INTERVAL.
+"""
+import asyncio
+import time
+
+SOURCE_TRACKER = "tracker"
+SOURCE_DHT = "dht"
+SOURCE_PEX = "pex"
+SOURCE_INBOUND = "inbound"
+
+MAX_QUEUED = 2000  # addresses waiting in the stream; more are dropped (e.g. while seeding)
+DHT_INTERVAL = 900.0  # seconds between DHT lookups + announces (nodes keep peers ~30 min)
+DHT_MIN_INTERVAL = 60.0  # earliest a low peer pool may start the next DHT lookup
+REPLENISH_INTERVAL = 5.0
+POLL_INTERVAL = 0.5
+
+
+class PeerStream(asyncio.Queue):
+    """
+    Queue of (ip, port) addresses from every discovery source, counted per source. Plain
+    put_nowait() (the workers' PEX callback) counts as PEX.
+    """
+
+    def __init__(self, maxsize=MAX_QUEUED):
+        super().__init__(maxsize)
+        self.counts = {}
+        self.dropped = 0
+        self.created = time.monotonic()
+        self.first_peer = None  # seconds from creation to the first address
+
+    def count(self, source, n=1):
+        """Record n addresses from source (also used for inbound connections, which are not queued)."""
+        if self.first_peer is None:
+            self.first_peer = time.monotonic() - self.created
+        self.counts[source] = self.counts.get(source, 0) + n
+
+    def put_nowait(self, item, source=SOURCE_PEX):
+        super().put_nowait(item)
+        self.count(source)
+
+    def add(self, peers, source):
+        """Queue every address of peers; ones that do not fit are dropped."""
+        for peer in peers:
+            try:
+                self.put_nowait(peer, source)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    def found(self):
+        return sum(self.counts.values())
+
+    def stats(self):
+        return {
+            "queued": self.qsize(),
+            "sources": dict(self.counts),
+            "dropped": self.dropped,
+            "first_peer": self.first_peer,
+        }
+
+
+class PeerDiscovery:
+    def __init__(
+        self, info_hash, stream, announcer=None, dht=None, announce_port=None,
+        dht_interval=DHT_INTERVAL, dht_min_interval=DHT_MIN_INTERVAL,
+    ):
+        """
+        stream: the PeerStream every source feeds. announcer: trackers.Announcer, run here and
+        stopped by close(). dht: a running dht.node.DHTNode (left open by close()).
+        announce_port: port announced to the DHT, None when we do not accept connections.
+        """
+        self.info_hash = info_hash
+        self.stream = stream
+        self.announcer = announcer
+        self.dht = dht
+        self.announce_port = announce_port
+        self.dht_interval = dht_interval
+        self.dht_min_interval = dht_min_interval
+        if announcer is not None:
+            announcer.on_peers = lambda peers: stream.add(peers, SOURCE_TRACKER)
+        self._tasks = []
+        self._started = False
+        self._closed = False
+        self._dht_wakeup = None  # asyncio.Event, created inside the loop
+        self._dht_busy = False
+        self._last_lookup = None
+        self._last_replenish = None
+        self.lookups = 0
+        self.replenished = 0
+        self.dht_error = None
+
+    def start(self):
+        """Start every source in the background (a second call does nothing)."""
+        if self._started:
+            return
+        self._started = True
+        if self.announcer is not None:
+            self._tasks.append(asyncio.create_task(self.announcer.run()))
+        if self.dht is not None:
+            self._dht_wakeup = asyncio.Event()
+            self._dht_busy = True
+            self._tasks.append(asyncio.create_task(self._run_dht()))
+
+    async def _run_dht(self):
+        while True:
+            self._dht_busy = True
+            self._last_lookup = time.monotonic()
+            self.lookups += 1
+            try:
+                async for peers in self.dht.iter_peers(self.info_hash, announce_port=self.announce_port):
+                    self.stream.add(peers, SOURCE_DHT)
+                self.dht_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.dht_error = str(e) or type(e).__name__
+            finally:
+                self._dht_busy = False
+            self._dht_wakeup.clear()
+            try:
+                await asyncio.wait_for(self._dht_wakeup.wait(), timeout=self.dht_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def busy(self):
+        """True while a source may deliver peers soon: an announce due or in flight, or a DHT lookup."""
+        return (self.announcer is not None and self.announcer.busy()) or self._dht_busy
+
+    def replenish(self):
+        """The peer pool ran low: ask every source for more as soon as it allows."""
+        now = time.monotonic()
+        if self.busy() or (self._last_replenish is not None and now - self._last_replenish < REPLENISH_INTERVAL):
+            return
+        self._last_replenish = now
+        self.replenished += 1
+        if self.announcer is not None:
+            self.announcer.reannounce()
+        if self._dht_wakeup is not None and now - self._last_lookup >= self.dht_min_interval:
+            self._dht_busy = True  # busy from now on, not from when the task wakes up
+            self._dht_wakeup.set()
+
+    async def next_peer(self):
+        """Next address from the stream; None once it is empty and no source is busy."""
+        while True:
+            try:
+                return await asyncio.wait_for(self.stream.get(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                if self.stream.empty() and not self.busy():
+                    return None
+
+    def completed(self):
+        """The download finished: tell the trackers."""
+        if self.announcer is not None:
+            self.announcer.completed()
+
+    def error(self):
+        """Why no peers were found, if a source failed; None otherwise."""
+        reasons = []
+        if self.announcer is not None:
+            reasons += [f"Tracker: {tier.error}" for tier in self.announcer.tiers if tier.error][:1]
+        if self.dht_error:
+            reasons.append(f"DHT: {self.dht_error}")
+        return "; ".join(reasons) or None
+
+    async def close(self):
+        """Stop the DHT lookups and the announcer (which sends stopped); later calls do nothing."""
+        if self._closed:
+            return
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.announcer is not None:
+            await self.announcer.stop()
+
+    def stats(self):
+        return {
+            **self.stream.stats(),
+            "busy": self.busy(),
+            "dht_lookups": self.lookups,
+            "dht_error": self.dht_error,
+            "replenished": self.replenished,
+        }
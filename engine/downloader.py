@@ -1,39 +1,186 @@
 """
-Orchestrate multi-peer download: tracker/DHT -> peers, PieceManager (rarest-first), workers.
-Supports .torrent files and magnet links (DHT + ut_metadata).
+Orchestrate multi-peer download: tracker/DHT/PEX -> peer stream, PieceManager (rarest-first),
+workers. Supports .torrent files and magnet links (DHT + ut_metadata).
 """
 import asyncio
 import os
 
 from core.torrent import Torrent
 from core.piece_manager import PieceManager
-from trackers import get_peers
+from trackers import Announcer
+from core.peer_connection import MAX_PIPELINE_DEPTH
+from storage import DiskWriter, FileLayout
+from storage.resume import load_resume, recheck, resume_path, save_resume
+from storage.writer import FSYNC_CLOSE
+from .choker import Choker, RECHOKE_INTERVAL, UPLOAD_SLOTS
+from .connections import ConnectionManager
+from .discovery import PeerDiscovery, PeerStream
+from .hasher import HashPool
 from .worker import run_worker, connect_peer
 
+RESUME_INTERVAL = 30.0  # seconds between resume file saves
+MAGNET_METADATA_PEERS = 10  # peers asked for the metadata before a magnet download gives up
 
-async def _run_download(torrent, peers, peer_id, download_path, max_workers, peer_queue=None):
-    with open(download_path, "wb") as f:
-        f.truncate(torrent.length)
+
+async def _prepare_storage(torrent, layout, download_path, hash_pool, resume, on_recheck_progress):
+    """Create and size the output files; return the pieces already on disk (resume file, else recheck)."""
+    files = layout.paths()
+    if resume and layout.exists():
+        completed = load_resume(resume_path(download_path), torrent, files)
+        if completed is not None:
+            return completed
+        layout.create()
+        return await recheck(torrent, layout, hash_pool, on_recheck_progress)
+    for path in files:
+        if os.path.exists(path):
+            os.truncate(path, 0)
+    layout.create()
+    return set()
+
+
+def _announce_counters(piece_manager, choker):
+    """uploaded / downloaded / left for tracker announces."""
+    uploaded, downloaded = choker.transferred()
+    return {"uploaded": uploaded, "downloaded": downloaded, "left": piece_manager.left()}
+
+
+async def _save_resume_periodically(torrent, layout, download_path, piece_manager, disk_writer, interval):
+    while True:
+        await asyncio.sleep(interval)
+        # Only record pieces that are durably on disk.
+        completed = set(piece_manager.completed)
+        await disk_writer.sync()
+        save_resume(resume_path(download_path), torrent, completed, layout.paths())
+
+
+async def _run_download(
+    torrent,
+    peers,
+    peer_id,
+    download_path,
+    max_workers,
+    peer_queue=None,
+    max_pipeline_depth=MAX_PIPELINE_DEPTH,
+    fsync=FSYNC_CLOSE,
+    hash_threads=None,
+    resume=True,
+    on_recheck_progress=None,
+    wire_protocol=False,
+    upload_slots=UPLOAD_SLOTS,
+    rechoke_interval=RECHOKE_INTERVAL,
+    rate_limits=None,
+    discovery=None,
+):
+    """
+    Download torrent into download_path (the file for single-file torrents, the directory holding
+    the files for multi-file torrents). With resume, pieces recorded in the resume file (or found
+    by a parallel recheck when it does not match) are not downloaded again, and progress is saved
+    every RESUME_INTERVAL seconds and on shutdown. Peers are uploaded to while downloading:
+    upload_slots of them are unchoked at a time, re-chosen every rechoke_interval seconds.
+    rate_limits: global engine.ratelimit.RateLimits (changeable while running); the torrent gets
+    a child level and every peer one below that.
+    discovery: engine.discovery.PeerDiscovery feeding peer_queue; it is started before the
+    storage is checked, so peers are found meanwhile, and its announcer gets the real counters
+    and the completed event. The caller closes it.
+    """
+    layout = FileLayout(torrent, download_path)
+    hash_pool = HashPool(threads=hash_threads)
     piece_manager = PieceManager(torrent, download_path)
-    tasks = []
-    for ip, p in peers[:max_workers]:
-        tasks.append(asyncio.create_task(
-            run_worker(ip, p, torrent, peer_id, piece_manager, download_path, peer_queue=peer_queue)
-        ))
-
-    if peer_queue:
-        while not piece_manager.is_done():
-            try:
-                ip, p = await asyncio.wait_for(peer_queue.get(), timeout=0.5)
-                tasks.append(asyncio.create_task(
-                    run_worker(ip, p, torrent, peer_id, piece_manager, download_path, peer_queue=peer_queue)
-                ))
-            except asyncio.TimeoutError:
-                pass
-    await asyncio.gather(*tasks)
+    disk_writer = None
+    saver = None
+    choker = Choker(slots=upload_slots, interval=rechoke_interval, seeding=piece_manager.is_done)
+    torrent_limits = rate_limits.child() if rate_limits is not None else None
+    rechoker = None
+    if discovery is not None:
+        if discovery.announcer is not None:
+            discovery.announcer.counters = lambda: _announce_counters(piece_manager, choker)
+        discovery.start()
+    try:
+        completed = await _prepare_storage(
+            torrent, layout, download_path, hash_pool, resume, on_recheck_progress,
+        )
+        for index in completed:
+            piece_manager.mark_completed(index)
+        disk_writer = DiskWriter(layout, fsync=fsync)
+        if resume:
+            saver = asyncio.create_task(_save_resume_periodically(
+                torrent, layout, download_path, piece_manager, disk_writer, RESUME_INTERVAL,
+            ))
+        rechoker = asyncio.create_task(choker.run())
+        was_done = piece_manager.is_done()
+        await _run_workers(
+            torrent, peers, peer_id, download_path, max_workers, peer_queue,
+            piece_manager, disk_writer, hash_pool, max_pipeline_depth, wire_protocol, choker,
+            torrent_limits, discovery,
+        )
+        if discovery is not None and piece_manager.is_done() and not was_done:
+            discovery.completed()
+    finally:
+        if rechoker is not None:
+            rechoker.cancel()
+        if saver is not None:
+            saver.cancel()
+        if disk_writer is not None:
+            await disk_writer.close()
+            if resume:
+                save_resume(resume_path(download_path), torrent, piece_manager.completed, layout.paths())
+        hash_pool.close()
     return download_path if piece_manager.is_done() else None
 
 
+async def _run_workers(
+    torrent, peers, peer_id, download_path, max_workers, peer_queue,
+    piece_manager, disk_writer, hash_pool, max_pipeline_depth, wire_protocol=False, choker=None,
+    rate_limits=None, discovery=None,
+):
+    """
+    Keep max_workers peer connections open through a ConnectionManager until the download is
+    done (or no candidate is left to try, or every one has kept failing for the manager's
+    give_up_after, and discovery has nothing in flight); peers from peer_queue join the
+    candidates as they arrive, and a low pool asks discovery for more.
+    """
+    manager = ConnectionManager(target=max_workers)
+    manager.add(peers)
+
+    def start_worker(addr, on_connected):
+        return run_worker(
+            addr[0], addr[1], torrent, peer_id, piece_manager, download_path,
+            peer_queue=peer_queue, max_pipeline_depth=max_pipeline_depth,
+            disk_writer=disk_writer, hash_pool=hash_pool, wire_protocol=wire_protocol,
+            choker=choker, rate_limits=rate_limits, on_connected=on_connected,
+        )
+
+    def done():
+        if piece_manager.is_done():
+            return True
+        stalled = manager.stalled()  # called every time: it times how long the pool has been dead
+        if manager.tasks or (peer_queue is not None and not peer_queue.empty()):
+            return False
+        if manager.candidates and not stalled:
+            return False
+        return discovery is None or not discovery.busy()
+
+    try:
+        await manager.run(
+            start_worker, done, peer_queue=peer_queue,
+            on_low=discovery.replenish if discovery is not None else None,
+        )
+        await manager.wait_closed()
+    finally:
+        await manager.close()
+
+
+async def _open_dht(port):
+    """A DHT node of our own on port + 1 for one download, or None if it cannot be opened."""
+    from dht.node import DHTNode
+    try:
+        dht = DHTNode(port=port + 1)
+        await dht.start()
+    except OSError:
+        return None
+    return dht
+
+
 async def download(
     torrent_path,
     download_path="download.bin",
@@ -42,28 +189,50 @@ async def download(
     max_workers=20,
     use_dht=True,
     peer_queue=None,
+    max_pipeline_depth=MAX_PIPELINE_DEPTH,
+    fsync=FSYNC_CLOSE,
+    hash_threads=None,
+    resume=True,
+    on_recheck_progress=None,
+    metadata_cache=None,
+    wire_protocol=False,
+    upload_slots=UPLOAD_SLOTS,
+    rechoke_interval=RECHOKE_INTERVAL,
+    rate_limits=None,
+    dht=None,
 ):
-    """Download from a .torrent file."""
-    torrent = Torrent(torrent_path)
+    """
+    Download from a .torrent file. metadata_cache: optional core.metacache.MetadataCache.
+    Peers are discovered while the download runs (engine.discovery): every announce-list tier
+    and a DHT lookup start together, and each address goes to the connection manager as soon as
+    it arrives, so the first connect does not wait for the other sources. Re-announces and new
+    lookups keep adding peers, sooner when the pool runs low.
+    dht: a running dht.node.DHTNode to look up peers with (shared between downloads); without
+    one and with use_dht, a node is opened on port + 1 for the download.
+    peer_queue: an engine.discovery.PeerStream to feed extra peers through.
+    """
+    torrent = Torrent.load(torrent_path, metadata_cache)
     peer_id = peer_id or (b"-PC0001-" + os.urandom(12))
-    try:
-        peers = await get_peers(torrent, peer_id, port)
-    except Exception as e:
-        return None, str(e)
-    if use_dht:
-        try:
-            from dht.node import DHTNode
-            dht = DHTNode(port=port + 1)
-            dht_peers = await dht.get_peers(torrent.info_hash)
-            dht.close()
-            peers = list(dict.fromkeys(peers + dht_peers))
-        except Exception:
-            pass
-    if not peers:
-        return None, "No peers"
     if peer_queue is None:
-        peer_queue = asyncio.Queue()
-    result = await _run_download(torrent, peers, peer_id, download_path, max_workers, peer_queue)
+        peer_queue = PeerStream()
+    own_dht = await _open_dht(port) if dht is None and use_dht else None
+    discovery = PeerDiscovery(
+        torrent.info_hash, peer_queue, announcer=Announcer(torrent, peer_id, port), dht=dht or own_dht,
+    )
+    try:
+        result = await _run_download(
+            torrent, [], peer_id, download_path, max_workers, peer_queue,
+            max_pipeline_depth=max_pipeline_depth, fsync=fsync, hash_threads=hash_threads,
+            resume=resume, on_recheck_progress=on_recheck_progress, wire_protocol=wire_protocol,
+            upload_slots=upload_slots, rechoke_interval=rechoke_interval, rate_limits=rate_limits,
+            discovery=discovery,
+        )
+    finally:
+        await discovery.close()
+        if own_dht is not None:
+            own_dht.close()
+    if result is None and not peer_queue.found():
+        return None, discovery.error() or "No peers"
     return result, None
 
 
@@ -73,21 +242,56 @@ async def download_magnet(
     peer_id=None,
     port=6881,
     max_workers=20,
+    max_pipeline_depth=MAX_PIPELINE_DEPTH,
+    fsync=FSYNC_CLOSE,
+    hash_threads=None,
+    resume=True,
+    on_recheck_progress=None,
+    wire_protocol=False,
+    upload_slots=UPLOAD_SLOTS,
+    rechoke_interval=RECHOKE_INTERVAL,
+    rate_limits=None,
+    dht=None,
 ):
-    """Download from a magnet link: DHT get_peers + ut_metadata, then same pipeline."""
+    """
+    Download from a magnet link: DHT get_peers + ut_metadata, then same pipeline. Metadata is
+    asked for from each peer as the DHT lookup finds it, and the lookup keeps feeding the
+    download afterwards.
+    dht: a running dht.node.DHTNode to share; without one a node is opened on port + 1.
+    """
     from core.magnet import parse_magnet
-    from core.bencode import decode
-    from extensions.metadata import fetch_metadata
 
     info_hash = parse_magnet(magnet_uri)
     peer_id = peer_id or (b"-PC0001-" + os.urandom(12))
 
-    from dht.node import DHTNode
-    dht = DHTNode(port=port + 1)
-    peers = await dht.get_peers(info_hash)
-    dht.close()
-    if not peers:
+    own_dht = await _open_dht(port) if dht is None else None
+    if dht is None and own_dht is None:
         return None, "No peers from DHT"
+    peer_queue = PeerStream()
+    discovery = PeerDiscovery(info_hash, peer_queue, dht=dht or own_dht)
+    discovery.start()
+    try:
+        return await _fetch_magnet(
+            info_hash, peer_id, download_path, max_workers, peer_queue, discovery,
+            max_pipeline_depth=max_pipeline_depth, fsync=fsync, hash_threads=hash_threads,
+            resume=resume, on_recheck_progress=on_recheck_progress, wire_protocol=wire_protocol,
+            upload_slots=upload_slots, rechoke_interval=rechoke_interval, rate_limits=rate_limits,
+        )
+    finally:
+        await discovery.close()
+        if own_dht is not None:
+            own_dht.close()
+
+
+async def _fetch_magnet(
+    info_hash, peer_id, download_path, max_workers, peer_queue, discovery, wire_protocol=False, **kwargs,
+):
+    """
+    Fetch the metadata from the first of up to MAGNET_METADATA_PEERS streamed peers that has it,
+    then run the download (kwargs go to _run_download).
+    """
+    from core.bencode import decode
+    from extensions.metadata import fetch_metadata
 
     # Minimal object for handshake (only info_hash needed)
     class MagnetHandshake:
@@ -95,9 +299,19 @@ async def download_magnet(
     magnet_torrent = MagnetHandshake()
     magnet_torrent.info_hash = info_hash
 
+    peers = []
     metadata_bin = None
-    for ip, p in peers[:10]:
-        conn, err = await connect_peer(ip, p, magnet_torrent, peer_id, download_path)
+    while metadata_bin is None and len(peers) < MAGNET_METADATA_PEERS:
+        peer = await discovery.next_peer()
+        if peer is None:
+            break
+        if peer in peers:
+            continue
+        peers.append(peer)
+        ip, p = peer
+        conn, err = await connect_peer(
+            ip, p, magnet_torrent, peer_id, download_path, wire_protocol=wire_protocol,
+        )
         if err is not None:
             continue
         try:
@@ -111,11 +325,15 @@ async def download_magnet(
                 pass
             continue
 
+    if not peers:
+        return None, f"No peers from DHT: {discovery.dht_error}" if discovery.dht_error else "No peers from DHT"
     if metadata_bin is None:
         return None, "Could not fetch metadata from any peer"
 
     info = decode(metadata_bin)
     torrent = Torrent.from_metadata(info, info_hash)
-    peer_queue = asyncio.Queue()
-    result = await _run_download(torrent, peers, peer_id, download_path, max_workers, peer_queue)
+    result = await _run_download(
+        torrent, peers, peer_id, download_path, max_workers, peer_queue,
+        wire_protocol=wire_protocol, discovery=discovery, **kwargs,
+    )
     return result, None
@@ -0,0 +1,69 @@
+"""
+SHA-1 verification off the event loop: pieces are hashed on a thread pool (hashlib releases the
+GIL for large buffers, so several cores can hash while the loop keeps serving sockets).
+The number of pending hashes is bounded; callers wait for a slot, which throttles downloads
+when hashing cannot keep up.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HashPool:
+    def __init__(self, threads=None, max_pending=None):
+        self.threads = threads or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending or 2 * self.threads
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="hasher")
+        self._slots = None  # asyncio.Semaphore, created on first use inside the loop
+        self.pending = 0
+
+        self.jobs = 0
+        self.failures = 0
+        self.bytes_hashed = 0
+        self.hash_seconds = 0.0  # summed over threads
+        self.wait_seconds = 0.0  # time spent waiting for a slot
+        self.max_wait = 0.0
+
+    def stats(self):
+        """Hash throughput (per thread-second of work) and queue wait time."""
+        return {
+            "pending": self.pending,
+            "jobs": self.jobs,
+            "failures": self.failures,
+            "bytes_hashed": self.bytes_hashed,
+            "throughput": self.bytes_hashed / self.hash_seconds if self.hash_seconds else 0.0,
+            "avg_wait": self.wait_seconds / self.jobs if self.jobs else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+    async def run(self, fn, *args, nbytes=0):
+        """Run fn(*args) on a hash thread once a slot is free; nbytes is counted towards throughput."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        queued = time.monotonic()
+        self.pending += 1
+        try:
+            async with self._slots:
+                started = time.monotonic()
+                wait = started - queued
+                self.wait_seconds += wait
+                self.max_wait = max(self.max_wait, wait)
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._executor, fn, *args)
+                self.hash_seconds += time.monotonic() - started
+                self.bytes_hashed += nbytes
+                self.jobs += 1
+                return result
+        finally:
+            self.pending -= 1
+
+    async def verify(self, piece):
+        """Piece.verify() on a hash thread. Only blocks not already hashed in order are hashed there."""
+        ok = await self.run(piece.verify, nbytes=piece.unhashed_bytes())
+        if not ok:
+            self.failures += 1
+        return ok
+
+    def close(self):
+        self._executor.shutdown(wait=False)
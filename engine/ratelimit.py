@@ -0,0 +1,169 @@
+"""
+Hierarchical token-bucket rate limiting for upload and download: global -> torrent -> peer.
+A transfer of n bytes takes n tokens at every level of its chain. Buckets may go into debt (a
+16 KiB block passes even with a smaller burst); once a bucket is in debt, later transfers queue
+on it in FIFO order, so waiting peers get turns block by block and share the rate evenly.
+
+Download limiting delays the next socket read instead of dropping data: the kernel receive
+window fills and the sender slows down. Rates are bytes/s, 0 means unlimited, and can be changed
+at any time. TokenBucket.consume() is synchronous when nothing has to wait, so an unlimited
+chain costs a few attribute checks per block.
+"""
+import asyncio
+import time
+import weakref
+from collections import deque
+
+BURST_SECONDS = 0.5  # default burst: this many seconds of traffic at the configured rate
+
+
+class TokenBucket:
+    def __init__(self, rate=0, burst=None, parent=None):
+        self.parent = parent
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0.0
+        self._stamp = time.monotonic()
+        self._waiters = deque()  # (nbytes, future), served in order
+        self._timer = None
+        self.bytes = 0  # bytes that passed this bucket
+        self.waits = 0  # transfers that had to wait here
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """Change the rate (bytes/s, 0 = unlimited) and burst (bytes) at runtime."""
+        self._refill()
+        self.rate = max(0, int(rate or 0))
+        self.burst = burst if burst is not None else max(int(self.rate * BURST_SECONDS), 16 * 1024)
+        self.tokens = min(self.tokens, self.burst) if self.rate else 0.0
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._waiters:
+            self._release()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        return self.tokens
+
+    def _take_nowait(self, n):
+        if self.rate and (self._waiters or self._refill() <= 0):
+            return False
+        self.tokens -= n if self.rate else 0
+        self.bytes += n
+        return True
+
+    def consume(self, n):
+        """
+        Take n tokens along the chain to the root. Returns None if the transfer may proceed now,
+        otherwise an awaitable that completes when it may:
+            waiter = bucket.consume(n)
+            if waiter is not None:
+                await waiter
+        """
+        bucket = self
+        while bucket is not None:
+            if not bucket._take_nowait(n):
+                return self._consume_slow(bucket, n)
+            bucket = bucket.parent
+        return None
+
+    async def _consume_slow(self, bucket, n):
+        while bucket is not None:
+            if not bucket._take_nowait(n):
+                bucket.waits += 1
+                fut = asyncio.get_running_loop().create_future()
+                bucket._waiters.append((n, fut))
+                bucket._schedule()
+                await fut
+            bucket = bucket.parent
+
+    def _schedule(self):
+        if self._timer is not None or not self._waiters:
+            return
+        delay = max(0.0, -self.tokens / self.rate) if self.rate else 0.0
+        self._timer = asyncio.get_running_loop().call_later(max(delay, 0.001), self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._release()
+
+    def _release(self):
+        """Grant queued transfers while there are tokens (all of them when unlimited)."""
+        self._refill()
+        while self._waiters and (not self.rate or self.tokens > 0):
+            n, fut = self._waiters.popleft()
+            if fut.done():  # cancelled
+                continue
+            if self.rate:
+                self.tokens -= n
+            self.bytes += n
+            fut.set_result(None)
+        if self._waiters:
+            self._schedule()
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "tokens": self._refill() if self.rate else None,
+            "queued": len(self._waiters),
+            "bytes": self.bytes,
+            "waits": self.waits,
+        }
+
+
+class RateLimits:
+    """
+    Upload and download buckets for one level. child() adds a torrent under the global limits;
+    peer() adds a peer under a torrent, limited to the peer_upload / peer_download defaults.
+    """
+
+    def __init__(self, upload=0, download=0, parent=None, peer_upload=None, peer_download=None):
+        self.parent = parent
+        self.upload = TokenBucket(upload, parent=parent.upload if parent else None)
+        self.download = TokenBucket(download, parent=parent.download if parent else None)
+        self.peer_upload = peer_upload if peer_upload is not None else (parent.peer_upload if parent else 0)
+        self.peer_download = peer_download if peer_download is not None else (parent.peer_download if parent else 0)
+        self.is_peer = False
+        self._children = weakref.WeakSet()
+
+    def child(self, upload=0, download=0):
+        limits = RateLimits(upload, download, parent=self)
+        self._children.add(limits)
+        return limits
+
+    def peer(self):
+        limits = RateLimits(self.peer_upload, self.peer_download, parent=self)
+        limits.is_peer = True
+        self._children.add(limits)
+        return limits
+
+    def set_rates(self, upload=None, download=None):
+        """Change this level's rates (bytes/s, 0 = unlimited); None leaves a direction unchanged."""
+        if upload is not None:
+            self.upload.set_rate(upload)
+        if download is not None:
+            self.download.set_rate(download)
+
+    def set_peer_rates(self, upload=None, download=None):
+        """Change the per-peer defaults here and for every peer below this level."""
+        if upload is not None:
+            self.peer_upload = upload
+        if download is not None:
+            self.peer_download = download
+        for child in list(self._children):
+            if child.is_peer:
+                child.set_rates(upload, download)
+            else:
+                child.set_peer_rates(upload, download)
+
+    def stats(self):
+        return {
+            "upload": self.upload.stats(),
+            "download": self.download.stats(),
+            "peer_upload": self.peer_upload,
+            "peer_download": self.peer_download,
+        }
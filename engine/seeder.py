@@ -1,32 +1,47 @@
 """
-Handle REQUEST messages: read block from disk and send PIECE.
+Upload side of a connection: send BITFIELD, then serve REQUESTs (read through the shared
+UploadReader) while the torrent's Choker keeps the peer unchoked.
 Seed-only mode: run_seeder() starts a TCP server that handshakes and serves REQUESTs.
 """
 import asyncio
-import struct
 import os
 
 from core.torrent import Torrent
 from core.peer_connection import PeerConnection
-from core.messages import REQUEST, PIECE, build_message
+from core.messages import BITFIELD, build_message, unchoke
+from core.piece_manager import make_bitfield
 from extensions.handshake import build_handshake
+from storage import FileLayout, UploadReader
+from storage.reader import CACHE_BYTES
+from .choker import Choker, RECHOKE_INTERVAL, UPLOAD_SLOTS
 
 
-async def handle_request(payload, path, piece_length, send):
-    if len(payload) < 12:
-        return
-    index, begin, length = struct.unpack("!III", payload[:12])
+async def serve_requests(conn, upload, choker=None):
+    """
+    Serve a handshaken connection until the peer goes away: BITFIELD of conn.have (every piece
+    when None), then REQUESTs while the peer is unchoked. The choker assigns upload slots;
+    without one the peer is unchoked right away.
+    """
+    conn.upload = upload
+    num_pieces = conn.torrent.num_pieces
+    pieces = range(num_pieces) if conn.have is None else conn.have
+    if pieces:
+        await conn.send(build_message(BITFIELD, make_bitfield(pieces, num_pieces)))
+    if choker is None:
+        conn.am_choking = False
+        await conn.send(unchoke())
+    else:
+        choker.add(conn)
     try:
-        with open(path, "rb") as f:
-            f.seek(index * piece_length + begin)
-            block = f.read(length)
-    except (OSError, IOError):
-        return
-    msg = struct.pack("!II", index, begin) + block
-    await send(build_message(PIECE, msg))
+        while True:
+            for msg_id, payload in await conn.recv():
+                await conn.handle_upload_message(msg_id, payload)
+    finally:
+        if choker is not None:
+            choker.remove(conn)
 
 
-async def _handle_seed_client(reader, writer, torrent, download_path, peer_id):
+async def _handle_seed_client(reader, writer, torrent, upload, peer_id, choker, rate_limits):
     try:
         their_handshake = await asyncio.wait_for(reader.readexactly(68), timeout=10)
         if their_handshake[28:48] != torrent.info_hash:
@@ -36,17 +51,10 @@ async def _handle_seed_client(reader, writer, torrent, download_path, peer_id):
         writer.write(our_handshake)
         await writer.drain()
 
-        conn = PeerConnection(reader, writer, torrent=torrent, download_path=download_path)
-        while True:
-            msgs = await conn.recv()
-            for msg_id, payload in msgs:
-                if msg_id == REQUEST:
-                    await handle_request(
-                        payload,
-                        download_path,
-                        torrent.piece_length,
-                        conn.send,
-                    )
+        conn = PeerConnection(reader, writer, torrent=torrent, upload=upload)
+        if rate_limits is not None:
+            conn.limits = rate_limits.peer()
+        await serve_requests(conn, upload, choker)
     except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
         pass
     finally:
@@ -57,16 +65,38 @@ async def _handle_seed_client(reader, writer, torrent, download_path, peer_id):
             pass
 
 
-async def run_seeder(torrent_path, download_path, port=6881, peer_id=None):
+async def run_seeder(
+    torrent_path,
+    download_path,
+    port=6881,
+    peer_id=None,
+    cache_bytes=CACHE_BYTES,
+    zero_copy=False,
+    upload_slots=UPLOAD_SLOTS,
+    rechoke_interval=RECHOKE_INTERVAL,
+    rate_limits=None,
+):
     """
     Run a TCP server that seeds the given torrent. Each connection: handshake then serve REQUESTs.
+    All connections share one UploadReader: descriptor pool, piece cache (cache_bytes) and, with
+    zero_copy, sendfile for blocks that are not cached. upload_slots peers are unchoked at a time,
+    re-chosen every rechoke_interval seconds (fastest downloaders, plus an optimistic unchoke).
+    rate_limits (engine.ratelimit.RateLimits) caps upload in total and per peer; it may be changed
+    while the seeder runs.
     """
     torrent = Torrent(torrent_path)
     peer_id = peer_id or (b"-PC0001-" + os.urandom(12))
+    upload = UploadReader(FileLayout(torrent, download_path), cache_bytes=cache_bytes, zero_copy=zero_copy)
+    choker = Choker(slots=upload_slots, interval=rechoke_interval, seeding=lambda: True)
+    rechoker = asyncio.create_task(choker.run())
     server = await asyncio.start_server(
-        lambda r, w: _handle_seed_client(r, w, torrent, download_path, peer_id),
+        lambda r, w: _handle_seed_client(r, w, torrent, upload, peer_id, choker, rate_limits),
         "0.0.0.0",
         port,
     )
-    async with server:
-        await server.serve_forever()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        rechoker.cancel()
+        upload.close()
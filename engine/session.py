@@ -0,0 +1,493 @@
+"""
+Multi-torrent session: one TCP listener that routes inbound handshakes by info hash, one
+long-lived DHT node and tracker client, one hash pool and descriptor pool, and global connection
+and half-open limits shared fairly between torrents. Torrents can be added and removed while the
+session runs; each one's progress is exposed through TorrentHandle.status().
+"""
+import asyncio
+import os
+
+from core import wire
+from core.torrent import Torrent
+from core.piece_manager import PieceManager
+from core.peer_connection import PeerConnection, MAX_PIPELINE_DEPTH
+from extensions.handshake import build_handshake
+from storage import DiskWriter, FileLayout, FilePool, UploadReader
+from storage.reader import CACHE_BYTES
+from storage.resume import resume_path, save_resume
+from storage.writer import FSYNC_CLOSE
+from trackers import TrackerClient
+from .downloader import RESUME_INTERVAL, _announce_counters, _prepare_storage, _save_resume_periodically
+from .choker import Choker, RECHOKE_INTERVAL, UPLOAD_SLOTS
+from .connections import ConnectionManager
+from .discovery import SOURCE_INBOUND, PeerDiscovery, PeerStream
+from .hasher import HashPool
+from .ratelimit import RateLimits
+from .seeder import serve_requests
+from .worker import connect_peer, run_worker
+
+MAX_CONNECTIONS = 200  # peer connections across all torrents
+MAX_HALF_OPEN = 20  # outbound connects (TCP + handshake) in progress at once
+MAX_PEERS_PER_TORRENT = 50
+HANDSHAKE_TIMEOUT = 10
+
+STATE_CHECKING = "checking"
+STATE_DOWNLOADING = "downloading"
+STATE_SEEDING = "seeding"
+STATE_ERROR = "error"
+
+
+def fair_shares(demands, total):
+    """
+    Split total slots by max-min fairness: nobody gets more than it asks for, and slots one
+    consumer does not need are shared evenly by the others. Returns a list parallel to demands.
+    """
+    shares = [0] * len(demands)
+    order = sorted(range(len(demands)), key=demands.__getitem__)
+    left = total
+    for n, i in enumerate(order):
+        remaining = len(order) - n
+        even = left // remaining
+        if demands[i] <= even:
+            shares[i] = demands[i]
+            left -= demands[i]
+            continue
+        # Everyone left wants more than an even split: split evenly, remainder to the first ones.
+        extra = left - even * remaining
+        for k, j in enumerate(order[n:]):
+            shares[j] = even + (1 if k < extra else 0)
+        break
+    return shares
+
+
+class TorrentHandle:
+    """Per-torrent state inside a Session."""
+
+    def __init__(
+        self, torrent, download_path, max_peers=MAX_PEERS_PER_TORRENT,
+        upload_slots=UPLOAD_SLOTS, rechoke_interval=RECHOKE_INTERVAL, limits=None,
+    ):
+        self.torrent = torrent
+        self.info_hash = torrent.info_hash
+        self.download_path = download_path
+        self.max_peers = max_peers
+        self.layout = FileLayout(torrent, download_path)
+        self.piece_manager = PieceManager(torrent, download_path)
+        self.state = STATE_CHECKING
+        self.error = None
+        self.disk_writer = None
+        self.upload = None
+        self.choker = Choker(slots=upload_slots, interval=rechoke_interval, seeding=self.piece_manager.is_done)
+        self.finished = asyncio.Event()  # set once every piece is on disk
+        self.limits = limits  # RateLimits: this torrent's level; set_rates() changes it at runtime
+
+        # Outbound candidates (tracker, DHT, PEX via peer_queue) with backoff and eviction;
+        # Session sets peers.can_connect to its slot check.
+        self.peers = ConnectionManager(target=max_peers)
+        self.peer_queue = PeerStream()  # every discovery source; read by peers while downloading
+        self.connected = set()  # addresses we connected to (their listen address)
+        # Peer IDs with an established connection, inbound or outbound: an inbound peername has
+        # an ephemeral port, so the same peer connecting both ways is only recognised by its ID.
+        self.peer_ids = set()
+        self.connections = 0
+        self.half_open = 0
+        self.quota = 0
+        self.task = None
+        self.announcer = None  # trackers.Announcer
+        self.discovery = None  # engine.discovery.PeerDiscovery, started before the data is checked
+        self._peer_tasks = set()
+
+    def add_peers(self, peers):
+        """Add discovered peers as connect candidates, skipping ones already connected."""
+        self.peers.add(peer for peer in peers if peer not in self.connected)
+
+    def demand(self):
+        """Connections this torrent could use right now."""
+        if self.state != STATE_DOWNLOADING:
+            return self.connections
+        return min(self.max_peers, self.connections + self.peers.waiting() + self.peer_queue.qsize())
+
+    def status(self):
+        pm = self.piece_manager
+        return {
+            "name": self.torrent.name,
+            "info_hash": self.info_hash.hex(),
+            "state": self.state,
+            "error": self.error,
+            "progress": len(pm.completed) / pm.num_pieces if pm.num_pieces else 1.0,
+            "pieces_done": len(pm.completed),
+            "num_pieces": pm.num_pieces,
+            "pieces": pm.stats(),
+            "connections": self.connections,
+            "half_open": self.half_open,
+            "quota": self.quota,
+            "peers_queued": self.peers.waiting() + self.peer_queue.qsize(),
+            "peers": self.peers.stats(),
+            "disk": self.disk_writer.stats() if self.disk_writer else None,
+            "upload": self.upload.stats() if self.upload else None,
+            "choker": self.choker.stats(),
+            "rate_limits": self.limits.stats() if self.limits else None,
+            "trackers": self.announcer.stats() if self.announcer else None,
+            "discovery": self.discovery.stats() if self.discovery else None,
+        }
+
+    def _track(self, task):
+        self._peer_tasks.add(task)
+        task.add_done_callback(self._peer_tasks.discard)
+
+
+class Session:
+    def __init__(
+        self,
+        peer_id=None,
+        port=6881,
+        max_connections=MAX_CONNECTIONS,
+        max_half_open=MAX_HALF_OPEN,
+        use_dht=True,
+        listen=True,
+        max_pipeline_depth=MAX_PIPELINE_DEPTH,
+        fsync=FSYNC_CLOSE,
+        hash_threads=None,
+        cache_bytes=CACHE_BYTES,
+        resume=True,
+        metadata_cache=None,
+        wire_protocol=False,
+        upload_slots=UPLOAD_SLOTS,
+        rechoke_interval=RECHOKE_INTERVAL,
+        rate_limits=None,
+        dht_cache=None,
+    ):
+        self.peer_id = peer_id or (b"-PC0001-" + os.urandom(12))
+        self.port = port
+        self.max_connections = max_connections
+        self.max_half_open = max_half_open
+        self.use_dht = use_dht
+        self.dht_cache = dht_cache  # file keeping the DHT node ID and good nodes across runs
+        self.listen = listen
+        self.max_pipeline_depth = max_pipeline_depth
+        self.fsync = fsync
+        self.cache_bytes = cache_bytes  # per torrent upload cache
+        self.resume = resume
+        self.metadata_cache = metadata_cache  # core.metacache.MetadataCache for add_torrent(path)
+        self.wire_protocol = wire_protocol  # BufferedProtocol transport (core.wire) for all peers
+        self.upload_slots = upload_slots  # per torrent
+        self.rechoke_interval = rechoke_interval
+        # Global upload / download limits; each torrent and peer gets a level below (see ratelimit).
+        self.rate_limits = rate_limits or RateLimits()
+
+        self.torrents = {}  # info_hash -> TorrentHandle
+        self.hash_pool = HashPool(threads=hash_threads)
+        self.file_pool = FilePool(max_open=256)
+        self.trackers = TrackerClient(self.peer_id, port)
+        self.dht = None  # one DHTNode; its lookups for every torrent share the node's socket
+        self._server = None
+        self._half_open_slots = asyncio.Semaphore(max_half_open)
+        self.connections = 0
+        self.half_open = 0
+        self.inbound_rejected = 0
+
+    async def start(self):
+        """Open the listener and the DHT node."""
+        if self.listen and self.wire_protocol:
+            loop = asyncio.get_running_loop()
+            self._server = await loop.create_server(self._inbound_protocol, "0.0.0.0", self.port)
+        elif self.listen:
+            self._server = await asyncio.start_server(self._on_inbound, "0.0.0.0", self.port)
+        if self.use_dht:
+            try:
+                from dht.node import DHTNode
+                self.dht = DHTNode(port=self.port + 1, cache_path=self.dht_cache)
+                await self.dht.start(bootstrap=True)
+            except OSError:
+                self.dht = None
+
+    async def close(self):
+        """Remove every torrent (saving resume data) and release the shared resources."""
+        for info_hash in list(self.torrents):
+            await self.remove_torrent(info_hash)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self.dht is not None:
+            self.dht.close()
+        self.trackers.close()
+        self.hash_pool.close()
+        self.file_pool.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def add_torrent(self, torrent, download_path, max_peers=MAX_PEERS_PER_TORRENT, peers=()):
+        """
+        Start downloading (or seeding, if the data is complete) torrent, a Torrent or a .torrent
+        path. peers: initial (ip, port) list, in addition to trackers and DHT. Returns the handle.
+        """
+        if not isinstance(torrent, Torrent):
+            torrent = Torrent.load(torrent, self.metadata_cache)
+        handle = self.torrents.get(torrent.info_hash)
+        if handle is not None:
+            return handle
+        handle = TorrentHandle(
+            torrent, download_path, max_peers,
+            upload_slots=self.upload_slots, rechoke_interval=self.rechoke_interval,
+            limits=self.rate_limits.child(),
+        )
+        handle.peers.can_connect = lambda: self._slot_free(handle)
+        handle.add_peers(peers)
+        self.torrents[torrent.info_hash] = handle
+        handle.task = asyncio.create_task(self._run_torrent(handle))
+        return handle
+
+    async def remove_torrent(self, info_hash):
+        """Stop a torrent: close its connections, flush its data and save resume. False if unknown."""
+        handle = self.torrents.pop(info_hash, None)
+        if handle is None:
+            return False
+        tasks = [handle.task, *handle._peer_tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await handle.peers.close()
+        if handle.discovery is not None:
+            await handle.discovery.close()
+        if handle.disk_writer is not None:
+            await handle.disk_writer.close()
+            if self.resume:
+                save_resume(
+                    resume_path(handle.download_path), handle.torrent,
+                    handle.piece_manager.completed, handle.layout.paths(),
+                )
+        if handle.upload is not None:
+            handle.upload.close()
+        self._wake()
+        return True
+
+    def status(self):
+        """Global counters and per-torrent state."""
+        self._update_quotas()
+        return {
+            "connections": self.connections,
+            "max_connections": self.max_connections,
+            "half_open": self.half_open,
+            "inbound_rejected": self.inbound_rejected,
+            "rate_limits": self.rate_limits.stats(),
+            "trackers": self.trackers.stats(),
+            "dht": self.dht.stats() if self.dht is not None else None,
+            "hashing": self.hash_pool.stats(),
+            "torrents": [handle.status() for handle in self.torrents.values()],
+        }
+
+    async def scrape(self):
+        """
+        Seeders / completed / leechers of every torrent from its UDP trackers, one packet per
+        tracker for up to 74 torrents: {info_hash: {tracker url: result}}.
+        """
+        return await self.trackers.scrape([handle.torrent for handle in self.torrents.values()])
+
+    # Connection slots
+
+    def _update_quotas(self, wanting=None):
+        """Recompute every torrent's fair share; wanting asks for one connection more than it holds."""
+        handles = list(self.torrents.values())
+        demands = [max(h.demand(), h.connections + 1) if h is wanting else h.demand() for h in handles]
+        for handle, share in zip(handles, fair_shares(demands, self.max_connections)):
+            handle.quota = share
+
+    def _slot_free(self, handle):
+        if self.connections >= self.max_connections:
+            return False
+        self._update_quotas(wanting=handle)
+        return handle.connections < handle.quota
+
+    def _take_slot(self, handle):
+        self.connections += 1
+        handle.connections += 1
+
+    def _release_slot(self, handle):
+        self.connections -= 1
+        handle.connections -= 1
+        self._wake()
+
+    def _wake(self):
+        """A slot was freed: let every torrent's connection manager try its candidates now."""
+        for handle in self.torrents.values():
+            handle.peers.wake()
+
+    # Per torrent
+
+    async def _run_torrent(self, handle):
+        torrent = handle.torrent
+        pm = handle.piece_manager
+        saver = None
+        # Discovery runs for as long as the torrent is in the session: seeds keep announcing
+        # (trackers and DHT) so others find them, and peers found while the data is checked
+        # wait in the stream.
+        handle.announcer = self.trackers.announcer(
+            torrent, counters=lambda: _announce_counters(pm, handle.choker),
+        )
+        handle.discovery = PeerDiscovery(
+            handle.info_hash, handle.peer_queue, announcer=handle.announcer, dht=self.dht,
+            announce_port=self.port if self.listen else None,
+        )
+        handle.discovery.start()
+        try:
+            completed = await _prepare_storage(
+                torrent, handle.layout, handle.download_path, self.hash_pool, self.resume, None,
+            )
+            for index in completed:
+                pm.mark_completed(index)
+            handle.disk_writer = DiskWriter(handle.layout, pool=self.file_pool, fsync=self.fsync)
+            handle.upload = UploadReader(handle.layout, pool=self.file_pool, cache_bytes=self.cache_bytes)
+            # Run until the torrent is removed: the choker keeps assigning upload slots when seeding.
+            handle._track(asyncio.create_task(handle.choker.run()))
+            if not pm.is_done():
+                handle.state = STATE_DOWNLOADING
+                if self.resume:
+                    saver = asyncio.create_task(_save_resume_periodically(
+                        torrent, handle.layout, handle.download_path, pm, handle.disk_writer,
+                        RESUME_INTERVAL,
+                    ))
+                await self._connect_peers(handle)
+                await handle.disk_writer.flush()
+                handle.discovery.completed()
+            handle.state = STATE_SEEDING
+            handle.finished.set()
+            self._wake()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            handle.state = STATE_ERROR
+            handle.error = str(e)
+            await handle.discovery.close()
+        finally:
+            if saver is not None:
+                saver.cancel()
+
+    async def _connect_peers(self, handle):
+        """Run the torrent's ConnectionManager until every piece is done, asking for peers when it runs low."""
+        def start_worker(peer, on_connected):
+            return self._outbound(handle, peer, on_connected)
+
+        await handle.peers.run(
+            start_worker, handle.piece_manager.is_done, peer_queue=handle.peer_queue,
+            on_low=handle.discovery.replenish,
+        )
+
+    async def _outbound(self, handle, peer, on_connected):
+        """
+        One outbound connection: connect under the session-wide half-open limit, then take a
+        connection slot once the manager accepts the handshake (it may lose a connect race).
+        """
+        ip, port = peer
+        took_slot = False
+        remote_id = None
+
+        def accept(conn):
+            nonlocal took_slot, remote_id
+            if peer in handle.connected or conn.remote_peer_id in handle.peer_ids or on_connected(conn) is False:
+                return False
+            self._take_slot(handle)
+            took_slot = True
+            remote_id = conn.remote_peer_id
+            handle.connected.add(peer)
+            handle.peer_ids.add(remote_id)
+            conn.upload = handle.upload
+            return True
+
+        try:
+            async with self._half_open_slots:
+                self.half_open += 1
+                handle.half_open += 1
+                try:
+                    conn, err = await connect_peer(
+                        ip, port, handle.torrent, self.peer_id, handle.download_path,
+                        max_pipeline_depth=self.max_pipeline_depth, wire_protocol=self.wire_protocol,
+                    )
+                finally:
+                    self.half_open -= 1
+                    handle.half_open -= 1
+            if err is not None:
+                return
+            await run_worker(
+                ip, port, handle.torrent, self.peer_id, handle.piece_manager, handle.download_path,
+                peer_queue=handle.peer_queue, max_pipeline_depth=self.max_pipeline_depth,
+                disk_writer=handle.disk_writer, hash_pool=self.hash_pool, conn=conn,
+                choker=handle.choker, rate_limits=handle.limits, on_connected=accept,
+            )
+        finally:
+            if took_slot:
+                handle.connected.discard(peer)
+                handle.peer_ids.discard(remote_id)
+                self._release_slot(handle)
+
+    def _inbound_protocol(self):
+        """Protocol factory for the listener in wire_protocol mode."""
+        protocol = wire.WireProtocol(
+            on_handshake=lambda p, handshake: asyncio.create_task(self._on_inbound(p, p, handshake)),
+        )
+        # Drop connections that never complete a handshake.
+        asyncio.get_running_loop().call_later(
+            HANDSHAKE_TIMEOUT, lambda: protocol.state == wire.STATE_HANDSHAKE and protocol.close(),
+        )
+        return protocol
+
+    async def _on_inbound(self, reader, writer, their_handshake=None):
+        """Listener callback: read the handshake, route by info hash, then seed or download."""
+        handle = None
+        remote_id = None
+        try:
+            if their_handshake is None:
+                their_handshake = await asyncio.wait_for(reader.readexactly(68), timeout=HANDSHAKE_TIMEOUT)
+            handle = self.torrents.get(their_handshake[28:48])
+            if handle is None or handle.state not in (STATE_DOWNLOADING, STATE_SEEDING):
+                handle = None
+                return
+            peer = writer.get_extra_info("peername")[:2]
+            remote_id = their_handshake[48:68]
+            if remote_id in handle.peer_ids or not self._slot_free(handle):
+                self.inbound_rejected += 1
+                handle = None
+                return
+            self._take_slot(handle)
+            handle.peer_ids.add(remote_id)
+            handle._track(asyncio.current_task())
+            handle.peer_queue.count(SOURCE_INBOUND)
+
+            writer.write(build_handshake(handle.info_hash, self.peer_id, use_extensions=True))
+            await writer.drain()
+            conn = PeerConnection(
+                reader, writer, peer_id=self.peer_id, torrent=handle.torrent,
+                download_path=handle.download_path, max_pipeline_depth=self.max_pipeline_depth,
+                upload=handle.upload,
+            )
+            conn.remote_peer_id = remote_id
+            conn.have = handle.piece_manager.completed
+            conn.limits = handle.limits.peer()
+            if handle.state == STATE_SEEDING:
+                await serve_requests(conn, handle.upload, handle.choker)
+            else:
+                await run_worker(
+                    peer[0], peer[1], handle.torrent, self.peer_id, handle.piece_manager,
+                    handle.download_path, peer_queue=handle.peer_queue,
+                    max_pipeline_depth=self.max_pipeline_depth,
+                    disk_writer=handle.disk_writer, hash_pool=self.hash_pool, conn=conn,
+                    choker=handle.choker, rate_limits=handle.limits,
+                )
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # remove_torrent(); end quietly, the stream protocol logs cancelled handler tasks.
+            pass
+        finally:
+            if handle is not None:
+                handle.peer_ids.discard(remote_id)
+                self._release_slot(handle)
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
@@ -1,27 +1,47 @@
 """
-Single peer worker: handshake, BITFIELD -> update availability, download pieces (rarest-first / endgame).
+Single peer worker: handshake, BITFIELD -> update availability, download blocks from the shared
+piece schedule (rarest-first / endgame), verify and write the pieces it completes.
 PEX: on_extended callback pushes discovered peers to peer_queue.
 """
 import asyncio
 import struct
 
-from core.peer_connection import PeerConnection
-from core.messages import BITFIELD
+from core import wire
+from core.peer_connection import PeerConnection, MAX_PIPELINE_DEPTH
+from core.messages import BITFIELD, HAVE, UNCHOKE, build_message
+from core.piece_manager import Bitfield, make_bitfield
 from core.bencode import decode
 from extensions.handshake import build_handshake
 from extensions.pex import parse_pex
+from storage import DiskWriter, FileLayout
+from .hasher import HashPool
 from .timeouts import with_timeout
 
+BLOCK_TIMEOUT = 60  # seconds without any message from a peer we have requests at
 
-async def connect_peer(ip, port, torrent, peer_id, download_path="download.bin", timeout=15):
+
+async def connect_peer(
+    ip,
+    port,
+    torrent,
+    peer_id,
+    download_path="download.bin",
+    timeout=15,
+    max_pipeline_depth=MAX_PIPELINE_DEPTH,
+    wire_protocol=False,
+):
     """
     Open connection, handshake, return (PeerConnection, None) or (None, error).
+    wire_protocol: use the BufferedProtocol transport (core.wire) instead of asyncio streams.
     """
     try:
-        reader, writer = await asyncio.wait_for(
-            asyncio.open_connection(ip, port),
-            timeout=timeout
-        )
+        if wire_protocol:
+            reader = writer = await asyncio.wait_for(wire.open_connection(ip, port), timeout=timeout)
+        else:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, port),
+                timeout=timeout
+            )
     except Exception as e:
         return None, e
 
@@ -30,7 +50,10 @@ async def connect_peer(ip, port, torrent, peer_id, download_path="download.bin",
     await writer.drain()
 
     try:
-        response = await asyncio.wait_for(reader.readexactly(68), timeout=timeout)
+        if wire_protocol:
+            response = await asyncio.wait_for(reader.read_handshake(), timeout=timeout)
+        else:
+            response = await asyncio.wait_for(reader.readexactly(68), timeout=timeout)
     except Exception as e:
         writer.close()
         return None, e
@@ -39,7 +62,15 @@ async def connect_peer(ip, port, torrent, peer_id, download_path="download.bin",
         writer.close()
         return None, RuntimeError("Info hash mismatch")
 
-    conn = PeerConnection(reader, writer, peer_id=peer_id, torrent=torrent, download_path=download_path)
+    conn = PeerConnection(
+        reader,
+        writer,
+        peer_id=peer_id,
+        torrent=torrent,
+        download_path=download_path,
+        max_pipeline_depth=max_pipeline_depth,
+    )
+    conn.remote_peer_id = response[48:68]
     return conn, None
 
 
@@ -59,53 +90,137 @@ def _make_pex_callback(peer_queue):
     return on_extended
 
 
-async def run_worker(ip, port, torrent, peer_id, piece_manager, download_path="download.bin", peer_queue=None):
+async def run_worker(
+    ip,
+    port,
+    torrent,
+    peer_id,
+    piece_manager,
+    download_path="download.bin",
+    peer_queue=None,
+    max_pipeline_depth=MAX_PIPELINE_DEPTH,
+    disk_writer=None,
+    hash_pool=None,
+    conn=None,
+    wire_protocol=False,
+    choker=None,
+    rate_limits=None,
+    on_connected=None,
+):
     """
-    Connect, process BITFIELD for availability, then pull pieces (rarest-first, endgame when applicable).
+    Connect, process BITFIELD for availability, then pull blocks (rarest-first, endgame when
+    applicable); pieces are shared with the other workers, the one completing a piece verifies it.
     If peer_queue is set, PEX messages are parsed and new peers are put on the queue.
+    max_pipeline_depth caps the number of outstanding block requests to this peer.
+    Verified pieces go through disk_writer (shared by all workers); a piece is marked completed
+    once it is on disk. Without one, the worker uses a private DiskWriter for download_path.
+    Pieces are verified on hash_pool (shared HashPool); without one, on a private single thread.
+    conn: an already handshaken PeerConnection (e.g. an inbound one) instead of connecting to ip:port.
+    wire_protocol: connect over the BufferedProtocol transport (core.wire) instead of streams.
+    choker: the torrent's engine.choker.Choker; the peer is offered our completed pieces and
+    served REQUESTs while the choker unchokes it, and gets HAVE for every piece we finish.
+    rate_limits: the torrent's engine.ratelimit.RateLimits; this peer gets a child bucket pair.
+    on_connected(conn) is called after the handshake (engine.connections.ConnectionManager);
+    if it returns False the connection is closed and the worker returns.
     """
-    conn, err = await connect_peer(ip, port, torrent, peer_id, download_path)
-    if err is not None:
+    if conn is None:
+        conn, err = await connect_peer(
+            ip, port, torrent, peer_id, download_path, max_pipeline_depth=max_pipeline_depth,
+            wire_protocol=wire_protocol,
+        )
+        if err is not None:
+            return
+    if on_connected is not None and on_connected(conn) is False:
+        conn.writer.close()
         return
 
+    own_writer = disk_writer is None
+    if own_writer:
+        disk_writer = DiskWriter(FileLayout(torrent, download_path))
+    own_hash_pool = hash_pool is None
+    if own_hash_pool:
+        hash_pool = HashPool(threads=1)
+
+    def on_written(index, fut):
+        if not fut.cancelled() and fut.exception() is None:
+            piece_manager.mark_completed(index)
+            if choker is not None:
+                choker.broadcast_have(index)
+        else:
+            piece_manager.mark_in_progress_free(index)
+
     on_extended = _make_pex_callback(peer_queue) if peer_queue else None
 
+    # Pieces this peer announced (BITFIELD + HAVE): what we may request from it, and the
+    # availability to undo on disconnect.
+    conn.pieces = Bitfield(piece_manager.num_pieces)
+
+    def on_have(index):
+        if conn.pieces.add(index):
+            piece_manager.add_have(index)
+
+    conn.have = piece_manager.completed
+    # Completed pieces (off the schedule, in progress) not handed to the disk writer yet; the
+    # ones left when the worker ends (timeout, failed verify or write) go back to the schedule.
+    pending = []
+    if rate_limits is not None and conn.limits is None:
+        conn.limits = rate_limits.peer()
+    if choker is not None:
+        choker.add(conn)
+
     try:
+        if piece_manager.completed:
+            await conn.send(build_message(BITFIELD, make_bitfield(piece_manager.completed, piece_manager.num_pieces)))
         # BITFIELD often arrives right after handshake
         try:
             msgs = await with_timeout(conn.recv(), timeout=3)
             if msgs:
                 for msg_id, payload in msgs:
-                    if msg_id == BITFIELD and payload:
-                        piece_manager.update_availability(payload)
+                    if msg_id == BITFIELD:
+                        for index in conn.pieces.update(payload):
+                            piece_manager.add_have(index)
+                    elif msg_id == HAVE and len(payload) >= 4:
+                        on_have(struct.unpack("!I", payload[:4])[0])
+                    elif msg_id == UNCHOKE:
+                        conn.choked = False
+                    else:
+                        await conn.handle_upload_message(msg_id, payload)
         except Exception:
             pass
 
         while not piece_manager.is_done():
-            piece = piece_manager.next_piece()
-            if piece is None:
-                await asyncio.sleep(0.1)
-                continue
-
-            endgame = piece_manager.endgame()
             try:
-                await with_timeout(
-                    conn.download_piece(piece, endgame_mode=endgame, on_extended=on_extended),
-                    timeout=60
+                await asyncio.wait_for(
+                    conn.download_blocks(piece_manager, on_extended=on_extended, on_have=on_have, completed=pending),
+                    timeout=BLOCK_TIMEOUT,
                 )
             except (TimeoutError, ConnectionError, asyncio.TimeoutError):
-                piece_manager.mark_in_progress_free(piece.index)
                 break
-
-            if not piece.verify():
-                piece_manager.mark_in_progress_free(piece.index)
-                continue
-
-            with open(download_path, "r+b") as f:
-                f.seek(piece.index * torrent.piece_length)
-                f.write(piece.data())
-            piece_manager.mark_completed(piece.index)
+            while pending:
+                piece = pending[0]
+                if not await hash_pool.verify(piece):
+                    pending.pop(0)
+                    piece.reset()
+                    piece_manager.mark_in_progress_free(piece.index)
+                    continue
+                # Waits here while the write-back queue is full: backpressure on this peer.
+                written = await disk_writer.write(piece.index * torrent.piece_length, piece.data())
+                pending.pop(0)
+                written.add_done_callback(lambda fut, index=piece.index: on_written(index, fut))
+                piece.reset()
     finally:
+        for piece in pending:
+            piece.reset()
+            piece_manager.mark_in_progress_free(piece.index)
+        if choker is not None:
+            choker.remove(conn)
+        piece_manager.release_peer(conn, conn.inflight)
+        conn.inflight.clear()
+        piece_manager.remove_availability(conn.pieces.bits)
+        if own_writer:
+            await disk_writer.close()
+        if own_hash_pool:
+            hash_pool.close()
         try:
             conn.writer.close()
             await conn.writer.wait_closed()
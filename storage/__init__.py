@@ -0,0 +1,10 @@
+"""
+Storage layer: file layout (piece ranges -> file spans), pooled file descriptors, an asynchronous
+coalescing disk writer and the cached / zero-copy upload read path.
+"""
+from .fdpool import FilePool
+from .layout import FileLayout
+from .reader import UploadReader
+from .writer import DiskWriter
+
+__all__ = ["FileLayout", "FilePool", "DiskWriter", "UploadReader"]
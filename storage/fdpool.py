@@ -0,0 +1,148 @@
+"""
+Pool of long-lived OS file descriptors with positional I/O (pread/pwrite), safe to share
+between the event loop and writer threads. Idle descriptors are closed in LRU order.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+
+if hasattr(os, "pwrite"):
+    def pwrite_all(fd, data, offset):
+        """Write all of data at offset; os.pwrite may write less than asked."""
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view = view[n:]
+            offset += n
+
+    def pread_exact(fd, length, offset):
+        """Read length bytes at offset (fewer only at end of file)."""
+        chunks = []
+        while length > 0:
+            data = os.pread(fd, length, offset)
+            if not data:
+                break
+            chunks.append(data)
+            length -= len(data)
+            offset += len(data)
+        return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+else:
+    # Windows has no positional I/O: emulate it with seek + read/write under a lock.
+    _seek_lock = threading.Lock()
+
+    def pwrite_all(fd, data, offset):
+        """Write all of data at offset."""
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+    def pread_exact(fd, length, offset):
+        """Read length bytes at offset (fewer only at end of file)."""
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            chunks = []
+            while length > 0:
+                data = os.read(fd, length)
+                if not data:
+                    break
+                chunks.append(data)
+                length -= len(data)
+            return b"".join(chunks)
+
+
+def pwritev_all(fd, buffers, offset):
+    """Write adjacent buffers at offset, with a single pwritev syscall where available."""
+    if not hasattr(os, "pwritev") or len(buffers) == 1:
+        for buf in buffers:
+            pwrite_all(fd, buf, offset)
+            offset += len(buf)
+        return
+    written = os.pwritev(fd, buffers, offset)
+    for buf in buffers:
+        # Finish whatever a short vectored write left over.
+        n = len(buf)
+        if written >= n:
+            written -= n
+        else:
+            pwrite_all(fd, memoryview(buf)[written:], offset + written)
+            written = 0
+        offset += n
+
+
+class FilePool:
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self._fds = OrderedDict()  # (path, writable) -> fd, most recently used last
+        self._refs = {}  # fd -> users currently holding it
+        self._lock = threading.Lock()
+
+    def _open(self, path, writable):
+        flags = (os.O_RDWR | os.O_CREAT) if writable else os.O_RDONLY
+        return os.open(path, flags | _O_BINARY, 0o644)
+
+    @contextmanager
+    def fd(self, path, writable=False):
+        """Borrow a descriptor for path; it stays open in the pool after the block."""
+        key = (os.path.abspath(path), writable)
+        with self._lock:
+            fd = self._fds.get(key)
+            if fd is None:
+                fd = self._open(path, writable)
+                self._fds[key] = fd
+            self._fds.move_to_end(key)
+            self._refs[fd] = self._refs.get(fd, 0) + 1
+            self._evict()
+        try:
+            yield fd
+        finally:
+            self._release(fd)
+
+    def _release(self, fd):
+        with self._lock:
+            self._refs[fd] -= 1
+            if not self._refs[fd]:
+                del self._refs[fd]
+                if fd not in self._fds.values():
+                    os.close(fd)
+
+    def _evict(self):
+        for key in list(self._fds):
+            if len(self._fds) <= self.max_open:
+                return
+            fd = self._fds[key]
+            if fd not in self._refs:
+                del self._fds[key]
+                os.close(fd)
+
+    def fsync(self, path=None):
+        """fsync every writable descriptor (or only those for path)."""
+        with self._lock:
+            targets = [
+                fd for (p, writable), fd in self._fds.items()
+                if writable and (path is None or p == os.path.abspath(path))
+            ]
+            # Held like fd() does, so a close() or eviction meanwhile cannot close (and the
+            # number be reused for another file) before the fsync.
+            for fd in targets:
+                self._refs[fd] = self._refs.get(fd, 0) + 1
+        try:
+            for fd in targets:
+                os.fsync(fd)
+        finally:
+            for fd in targets:
+                self._release(fd)
+
+    def close(self, path=None):
+        """Close idle descriptors (all, or only for path); busy ones close when released."""
+        with self._lock:
+            for key in list(self._fds):
+                if path is None or key[0] == os.path.abspath(path):
+                    fd = self._fds.pop(key)
+                    if fd not in self._refs:
+                        os.close(fd)
@@ -0,0 +1,107 @@
+"""
+File layout: maps the torrent's contiguous byte stream onto its files. A sorted index of file
+start offsets turns any (offset, length) range into per-file spans with one bisect, so reads and
+writes that cross file boundaries are split and batched per file.
+
+Single-file torrents are stored at download_path; multi-file torrents under the download_path
+directory, one file per info["files"] entry.
+"""
+import os
+from bisect import bisect_right
+
+from .fdpool import pread_exact, pwritev_all
+
+
+def _safe_components(components):
+    """Drop path components that could escape the download directory."""
+    return [c for c in components if c and c not in (".", "..") and "/" not in c and "\\" not in c]
+
+
+class FileLayout:
+    def __init__(self, torrent, download_path):
+        self.piece_length = torrent.piece_length
+        self.total_length = torrent.length
+        self.files = []  # (path, length, start offset in the torrent stream)
+        offset = 0
+        for components, length in torrent.files:
+            if torrent.multi_file:
+                path = os.path.join(download_path, *_safe_components(components))
+            else:
+                path = download_path
+            self.files.append((path, length, offset))
+            offset += length
+        self._starts = [start for _, _, start in self.files]
+
+    def paths(self):
+        return [path for path, _, _ in self.files]
+
+    def spans(self, offset, length):
+        """[(path, file_offset, n)] covering length bytes of the stream from offset."""
+        spans = []
+        i = bisect_right(self._starts, offset) - 1
+        while length > 0 and i < len(self.files):
+            path, file_length, start = self.files[i]
+            file_offset = offset - start
+            n = min(length, file_length - file_offset)
+            if n > 0:
+                spans.append((path, file_offset, n))
+                offset += n
+                length -= n
+            i += 1
+        return spans
+
+    def piece_spans(self, index, begin=0, length=None):
+        if length is None:
+            length = min(self.piece_length, self.total_length - index * self.piece_length) - begin
+        return self.spans(index * self.piece_length + begin, length)
+
+    def create(self, preallocate=True):
+        """Create directories and size every file (allocating blocks where the OS supports it)."""
+        for path, length, _ in self.files:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "ab") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == length:
+                    continue
+                if size < length and preallocate and hasattr(os, "posix_fallocate"):
+                    try:
+                        os.posix_fallocate(f.fileno(), 0, length)
+                        continue
+                    except OSError:
+                        pass
+                f.truncate(length)
+
+    def exists(self):
+        return any(os.path.exists(path) for path in self.paths())
+
+    def write(self, pool, buffers, offset):
+        """Write adjacent buffers at stream offset, one vectored write per file touched. Thread-safe."""
+        views = [memoryview(b) for b in buffers]
+        total = sum(len(v) for v in views)
+        for path, file_offset, n in self.spans(offset, total):
+            chunk = []
+            while n > 0:
+                view = views[0]
+                if len(view) <= n:
+                    chunk.append(view)
+                    n -= len(view)
+                    views.pop(0)
+                else:
+                    chunk.append(view[:n])
+                    views[0] = view[n:]
+                    n = 0
+            with pool.fd(path, writable=True) as fd:
+                pwritev_all(fd, chunk, file_offset)
+
+    def read(self, pool, offset, length):
+        """Read length bytes from stream offset (fewer if files are short). Thread-safe."""
+        parts = []
+        for path, file_offset, n in self.spans(offset, length):
+            with pool.fd(path) as fd:
+                data = pread_exact(fd, n, file_offset)
+            parts.append(data)
+            if len(data) < n:
+                break
+        return parts[0] if len(parts) == 1 else b"".join(parts)
@@ -0,0 +1,189 @@
+"""
+Upload read path shared by the seeder and PeerConnection: pooled descriptors, an LRU piece cache
+with read-ahead (the first REQUEST for a piece loads all of it), and an optional zero-copy mode
+that sends block data with sendfile instead of reading it into Python. Blocks that cross a file
+boundary are read (or sent) span by span through the FileLayout.
+"""
+import asyncio
+import os
+import struct
+from collections import OrderedDict
+
+from core.messages import PIECE
+from .fdpool import FilePool
+
+CACHE_BYTES = 64 * 1024 * 1024
+MAX_BLOCK = 128 * 1024  # larger REQUESTs are refused, as other clients do
+
+
+class PieceCache:
+    """LRU of piece index -> piece bytes, bounded by total size."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._pieces = OrderedDict()
+
+    def get(self, index):
+        data = self._pieces.get(index)
+        if data is not None:
+            self._pieces.move_to_end(index)
+        return data
+
+    def put(self, index, data):
+        if len(data) > self.max_bytes:
+            return
+        old = self._pieces.pop(index, None)
+        if old is not None:
+            self.size -= len(old)
+        self._pieces[index] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._pieces.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class _Fileno:
+    """Minimal file object for loop.sendfile around a pooled descriptor (positional use only)."""
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def fileno(self):
+        return self._fd
+
+
+class UploadReader:
+    def __init__(
+        self,
+        layout,
+        pool=None,
+        cache_bytes=CACHE_BYTES,
+        zero_copy=False,
+        executor=None,
+    ):
+        self.layout = layout  # storage.layout.FileLayout
+        self.piece_length = layout.piece_length
+        self.total_length = layout.total_length
+        self.num_pieces = (self.total_length + self.piece_length - 1) // self.piece_length
+        self.pool = pool or FilePool()
+        self._own_pool = pool is None
+        self.cache = PieceCache(cache_bytes)
+        self.zero_copy = zero_copy and hasattr(os, "sendfile")
+        self._executor = executor  # None: the loop's default executor
+        self._loading = {}  # piece index -> future of an in-flight read-ahead
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.sendfile_blocks = 0
+        self.bytes_sent = 0
+
+    def stats(self):
+        return {
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_bytes": self.cache.size,
+            "sendfile_blocks": self.sendfile_blocks,
+            "bytes_sent": self.bytes_sent,
+        }
+
+    def _piece_size(self, index):
+        if index == self.num_pieces - 1:
+            return self.total_length - index * self.piece_length
+        return self.piece_length
+
+    def valid(self, index, begin, length):
+        return (
+            0 <= index < self.num_pieces
+            and 0 < length <= MAX_BLOCK
+            and begin + length <= self._piece_size(index)
+        )
+
+    def _read_piece(self, index):
+        """Runs on a reader thread."""
+        return self.layout.read(self.pool, index * self.piece_length, self._piece_size(index))
+
+    async def read_piece(self, index):
+        """Whole piece from the cache, reading it in (once, even with concurrent callers) on a miss."""
+        data = self.cache.get(index)
+        if data is not None:
+            self.cache_hits += 1
+            return data
+        self.cache_misses += 1
+        fut = self._loading.get(index)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = loop.run_in_executor(self._executor, self._read_piece, index)
+            self._loading[index] = fut
+            try:
+                data = await fut
+            finally:
+                del self._loading[index]
+            self.cache.put(index, data)
+            return data
+        return await fut
+
+    async def read_block(self, index, begin, length):
+        """Block bytes, or None for an invalid range."""
+        if not self.valid(index, begin, length):
+            return None
+        data = await self.read_piece(index)
+        return memoryview(data)[begin:begin + length]
+
+    async def send_block(self, writer, index, begin, length):
+        """
+        Send a PIECE for (index, begin, length) on a StreamWriter. Cached pieces are served from
+        memory; otherwise zero-copy mode uses sendfile and normal mode reads the piece ahead.
+        Returns False if the request is invalid or the data could not be read.
+        """
+        if not self.valid(index, begin, length):
+            return False
+        header = struct.pack("!IBII", 9 + length, PIECE, index, begin)
+        if self.zero_copy and self.cache.get(index) is None:
+            writer.write(header)
+            if await self._sendfile(writer, index * self.piece_length + begin, length):
+                return True
+            # sendfile unavailable on this transport: the header is already queued, send the body.
+            block = await self.read_block(index, begin, length)
+            if len(block) != length:
+                raise ConnectionError("short read after PIECE header was sent")
+            writer.write(block)
+        else:
+            try:
+                block = await self.read_block(index, begin, length)
+            except OSError:
+                return False
+            if len(block) != length:
+                return False
+            writer.write(header)
+            writer.write(block)
+        await writer.drain()
+        self.bytes_sent += length
+        return True
+
+    async def _sendfile(self, writer, offset, length):
+        """Send length bytes at offset with sendfile, file by file; False (nothing sent) if unsupported."""
+        loop = asyncio.get_running_loop()
+        sent = 0
+        for path, file_offset, n in self.layout.spans(offset, length):
+            try:
+                with self.pool.fd(path) as fd:
+                    done = await loop.sendfile(writer.transport, _Fileno(fd), file_offset, n, fallback=False)
+            except (asyncio.SendfileNotAvailableError, NotImplementedError):
+                if sent:
+                    raise ConnectionError("sendfile failed in the middle of a block")
+                self.zero_copy = False
+                return False
+            except RuntimeError as e:
+                # This connection is closing: the other peers keep sending with sendfile.
+                raise ConnectionError(str(e)) from e
+            if done != n:
+                raise ConnectionError("short sendfile")
+            sent += n
+        self.sendfile_blocks += 1
+        self.bytes_sent += length
+        return True
+
+    def close(self):
+        if self._own_pool:
+            self.pool.close()
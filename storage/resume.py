@@ -0,0 +1,131 @@
+"""
+Fast resume: a small bencoded file next to the download records the completed-piece bitfield,
+the info hash and each file's size / mtime. If it still matches on startup the download resumes
+without hashing anything; otherwise recheck() hashes the existing data through mmap on the
+hash thread pool, in parallel (pieces spanning several files are hashed span by span).
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+from contextlib import ExitStack
+
+from core.bencode import decode, encode
+
+RESUME_VERSION = 1
+RESUME_SUFFIX = ".resume"
+
+
+def resume_path(download_path):
+    return download_path + RESUME_SUFFIX
+
+
+def _file_state(paths):
+    """[[size, mtime_ns], ...] for the payload files, or None if one is missing."""
+    state = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        state.append([st.st_size, st.st_mtime_ns])
+    return state
+
+
+def _bitfield(completed, num_pieces):
+    bits = bytearray((num_pieces + 7) // 8)
+    for i in completed:
+        bits[i // 8] |= 0x80 >> (i % 8)
+    return bytes(bits)
+
+
+def save_resume(path, torrent, completed, files):
+    """Write the resume file atomically (temp file + rename)."""
+    state = _file_state(files)
+    if state is None:
+        return
+    data = encode({
+        b"version": RESUME_VERSION,
+        b"info_hash": torrent.info_hash,
+        b"piece_length": torrent.piece_length,
+        b"bitfield": _bitfield(completed, torrent.num_pieces),
+        b"files": state,
+    })
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def load_resume(path, torrent, files):
+    """Completed piece indices from the resume file, or None if it is missing or does not match."""
+    try:
+        with open(path, "rb") as f:
+            d = decode(f.read())
+    except (OSError, ValueError, IndexError, TypeError):
+        return None
+    if not isinstance(d, dict):
+        return None
+    if (
+        d.get(b"version") != RESUME_VERSION
+        or d.get(b"info_hash") != torrent.info_hash
+        or d.get(b"piece_length") != torrent.piece_length
+        or d.get(b"files") != _file_state(files)
+    ):
+        return None
+    bits = d.get(b"bitfield", b"")
+    if not isinstance(bits, bytes) or len(bits) != (torrent.num_pieces + 7) // 8:
+        return None
+    return {
+        i for i in range(torrent.num_pieces)
+        if bits[i // 8] & (0x80 >> (i % 8))
+    }
+
+
+def _check_piece(maps, spans, expected):
+    """Runs on a hash thread; hashes straight from the file mappings."""
+    sha1 = hashlib.sha1()
+    for path, file_offset, n in spans:
+        mm = maps.get(path)
+        if mm is None or file_offset + n > len(mm):
+            return False
+        with memoryview(mm)[file_offset:file_offset + n] as view:
+            sha1.update(view)
+    return sha1.digest() == expected
+
+
+async def recheck(torrent, layout, hash_pool, on_progress=None):
+    """
+    Hash every piece of the files in layout on hash_pool; returns the set of good pieces.
+    on_progress(done, total) is called after each piece.
+    """
+    total = torrent.num_pieces
+    good = set()
+    done = 0
+    indices = iter(range(total))
+
+    with ExitStack() as stack:
+        maps = {}
+        for path in layout.paths():
+            try:
+                f = stack.enter_context(open(path, "rb"))
+                if os.fstat(f.fileno()).st_size:
+                    maps[path] = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            except OSError:
+                continue
+
+        async def check_next():
+            nonlocal done
+            for i in indices:
+                spans = layout.piece_spans(i)
+                expected = torrent.pieces[i * 20:(i + 1) * 20]
+                nbytes = sum(n for _, _, n in spans)
+                if await hash_pool.run(_check_piece, maps, spans, expected, nbytes=nbytes):
+                    good.add(i)
+                done += 1
+                if on_progress:
+                    on_progress(done, total)
+
+        # One feeder per pending slot keeps every hash thread busy without a task per piece.
+        await asyncio.gather(*(check_next() for _ in range(hash_pool.max_pending)))
+    return good
@@ -0,0 +1,190 @@
+"""
+Asynchronous disk writer: verified pieces go into a bounded write-back queue that a thread pool
+drains with positional writes, so a slow disk never blocks the event loop. Adjacent pieces are
+coalesced into one vectored write per file (the FileLayout splits runs at file boundaries).
+A full queue makes write() wait, which is the backpressure the
+download workers see.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .fdpool import FilePool
+
+FSYNC_NEVER = "never"
+FSYNC_CLOSE = "close"  # once, when the writer is closed
+FSYNC_INTERVAL = "interval"  # at most every fsync_interval seconds
+FSYNC_ALWAYS = "always"  # after every batch
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_CLOSE, FSYNC_INTERVAL, FSYNC_ALWAYS)
+
+COALESCE_LIMIT = 4 * 1024 * 1024  # max bytes merged into one write
+
+
+class DiskWriter:
+    def __init__(
+        self,
+        layout,
+        pool=None,
+        max_queue=64,
+        threads=2,
+        fsync=FSYNC_CLOSE,
+        fsync_interval=30.0,
+        coalesce_limit=COALESCE_LIMIT,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.layout = layout  # storage.layout.FileLayout
+        self.pool = pool or FilePool()
+        self._own_pool = pool is None
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.coalesce_limit = coalesce_limit
+        self.threads = threads
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="disk-writer")
+        self._drain_task = None
+        self._inflight = set()  # executor futures of batches being written
+        self._last_fsync = time.monotonic()
+        self._closed = False
+
+        self.writes = 0  # pieces written
+        self.batches = 0  # write syscalls issued (after coalescing)
+        self.bytes_written = 0
+        self.errors = 0
+        self._latency_total = 0.0
+        self.max_latency = 0.0
+
+    def full(self):
+        return self._queue.full()
+
+    def stats(self):
+        """Queue depth and write latency (enqueue -> on disk), for sizing the queue and thread pool."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_max": self._queue.maxsize,
+            "batches_in_flight": len(self._inflight),
+            "writes": self.writes,
+            "batches": self.batches,
+            "bytes_written": self.bytes_written,
+            "errors": self.errors,
+            "avg_latency": self._latency_total / self.writes if self.writes else 0.0,
+            "max_latency": self.max_latency,
+        }
+
+    async def write(self, offset, data):
+        """
+        Queue data for writing at offset. Waits while the queue is full (backpressure).
+        Returns a future that resolves once the data is on disk (or raises the write error).
+        data must not be modified until then.
+        """
+        if self._closed:
+            raise RuntimeError("DiskWriter is closed")
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain())
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((offset, data, done, time.monotonic()))
+        return done
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            while len(items) < self.threads * 16 and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            for group in self._coalesce(items):
+                fut = loop.run_in_executor(self._executor, self._write_group, group)
+                self._inflight.add(fut)
+                fut.add_done_callback(lambda f, g=group: self._on_written(f, g))
+            # Keep at most one batch per thread on the executor so the queue, not the
+            # executor backlog, absorbs bursts and applies backpressure.
+            while len(self._inflight) >= self.threads:
+                await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+
+    def _coalesce(self, items):
+        """Group queued writes into runs of adjacent ranges, each at most coalesce_limit bytes."""
+        items.sort(key=lambda item: item[0])
+        groups = []
+        current = []
+        end = size = None
+        for item in items:
+            offset, data = item[0], item[1]
+            if current and offset == end and size + len(data) <= self.coalesce_limit:
+                current.append(item)
+                size += len(data)
+            else:
+                current = [item]
+                groups.append(current)
+                size = len(data)
+            end = offset + len(data)
+        return groups
+
+    def _write_group(self, group):
+        """Runs on a writer thread."""
+        self.layout.write(self.pool, [item[1] for item in group], group[0][0])
+        if self.fsync == FSYNC_ALWAYS:
+            self._fsync_files()
+        elif self.fsync == FSYNC_INTERVAL and time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._last_fsync = time.monotonic()
+            self._fsync_files()
+
+    def _fsync_files(self):
+        """fsync this torrent's files only; a shared pool also holds other torrents' descriptors."""
+        if self._own_pool:
+            self.pool.fsync()
+        else:
+            for path in self.layout.paths():
+                self.pool.fsync(path)
+
+    def _on_written(self, fut, group):
+        self._inflight.discard(fut)
+        for _ in group:
+            self._queue.task_done()
+        now = time.monotonic()
+        error = None if fut.cancelled() else fut.exception()
+        self.batches += 1
+        if error is not None:
+            self.errors += 1
+        for offset, data, done, queued_at in group:
+            if error is None:
+                latency = now - queued_at
+                self.writes += 1
+                self.bytes_written += len(data)
+                self._latency_total += latency
+                self.max_latency = max(self.max_latency, latency)
+            if not done.done():
+                if error is None:
+                    done.set_result(None)
+                else:
+                    done.set_exception(error)
+
+    async def flush(self):
+        """Wait until everything queued so far is on disk."""
+        await self._queue.join()
+
+    async def sync(self):
+        """Flush and fsync, e.g. before recording progress in a resume file."""
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._fsync_files)
+
+    async def close(self):
+        """Flush, apply the fsync policy and release threads and descriptors."""
+        if self._closed:
+            return
+        await self.flush()
+        self._closed = True
+        if self._drain_task is not None:
+            self._drain_task.cancel()
+            try:
+                await self._drain_task
+            except asyncio.CancelledError:
+                pass
+        loop = asyncio.get_running_loop()
+        if self.fsync != FSYNC_NEVER:
+            await loop.run_in_executor(self._executor, self._fsync_files)
+        self._executor.shutdown(wait=True)
+        if self._own_pool:
+            self.pool.close()
+        else:
+            for path in self.layout.paths():
+                self.pool.close(path)
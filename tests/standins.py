@@ -0,0 +1,203 @@
+"""Local stand-ins for the other side of the wire: a seed that serves a whole torrent, and trackers."""
+import asyncio
+import hashlib
+import os
+import socket
+import struct
+from urllib.parse import parse_qs, urlsplit
+
+from core.bencode import encode
+from core.torrent import Torrent
+
+
+def make_torrent(directory, size, piece_length, announce=b"http://127.0.0.1:1/announce"):
+    """Random payload of size bytes and a .torrent for it in directory; returns (data, path, Torrent)."""
+    data = os.urandom(size)
+    pieces = b"".join(hashlib.sha1(data[i:i + piece_length]).digest() for i in range(0, size, piece_length))
+    meta = {
+        b"announce": announce,
+        b"info": {b"name": b"payload.bin", b"length": size, b"piece length": piece_length, b"pieces": pieces},
+    }
+    path = os.path.join(str(directory), "payload.torrent")
+    with open(path, "wb") as f:
+        f.write(encode(meta))
+    return data, path, Torrent(path)
+
+
+async def _seed_connection(reader, writer, data, torrent):
+    try:
+        await reader.readexactly(68)
+        writer.write(bytes([19]) + b"BitTorrent protocol" + bytes(8) + torrent.info_hash + b"-ST0001-000000000000")
+        num_pieces = (len(data) + torrent.piece_length - 1) // torrent.piece_length
+        bitfield = bytearray((num_pieces + 7) // 8)
+        for i in range(num_pieces):
+            bitfield[i // 8] |= 0x80 >> (i % 8)
+        writer.write(struct.pack("!IB", 1 + len(bitfield), 5) + bitfield)
+        writer.write(struct.pack("!IB", 1, 1))  # unchoke
+        await writer.drain()
+        while True:
+            length = struct.unpack("!I", await reader.readexactly(4))[0]
+            if not length:
+                continue
+            msg = await reader.readexactly(length)
+            if msg[0] == 6:  # REQUEST
+                index, begin, size = struct.unpack("!III", msg[1:13])
+                offset = index * torrent.piece_length + begin
+                block = data[offset:offset + size]
+                writer.write(struct.pack("!IBII", 9 + len(block), 7, index, begin) + block)
+                await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_seed(data, torrent, host="127.0.0.1"):
+    """A seed with every piece of torrent; returns the asyncio server (port: server.sockets[0])."""
+    return await asyncio.start_server(lambda r, w: _seed_connection(r, w, data, torrent), host, 0)
+
+
+def server_port(server):
+    return server.sockets[0].getsockname()[1]
+
+
+class HTTPTrackerStandIn:
+    """
+    Announce-only HTTP/1.1 tracker on localhost. body: "length" (Content-Length), "chunked",
+    "eof" (Connection: close, no length, body written in pieces), "none" (204 No Content, no
+    framing headers) or "continue" (100 Continue first, then Content-Length). close_after: close each
+    connection after that many responses without saying so (like an idle timeout server side).
+    log: (connection number, query dict) per request.
+    """
+
+    def __init__(self, peers=(), interval=1800, body="length", close_after=None):
+        self.peers = list(peers)
+        self.interval = interval
+        self.body = body
+        self.close_after = close_after
+        self.log = []
+        self.connections = 0
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{server_port(self.server)}/announce"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    def close(self):
+        self.server.close()
+
+    def _response(self):
+        compact = b"".join(socket.inet_aton(ip) + struct.pack("!H", port) for ip, port in self.peers)
+        return encode({b"interval": self.interval, b"complete": 1, b"incomplete": 2, b"peers": compact})
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        number = self.connections
+        served = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                query = parse_qs(urlsplit(line.split()[1].decode()).query)
+                self.log.append((number, {k: v[0] for k, v in query.items()}))
+                body = self._response()
+                if self.body == "chunked":
+                    half = len(body) // 2
+                    writer.write(
+                        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                        + b"%x\r\n" % half + body[:half] + b"\r\n"
+                        + b"%x;ext=1\r\n" % (len(body) - half) + body[half:] + b"\r\n0\r\n\r\n"
+                    )
+                elif self.body == "none":
+                    writer.write(b"HTTP/1.1 204 No Content\r\n\r\n")
+                elif self.body == "continue":
+                    writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+                elif self.body == "eof":
+                    writer.write(b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n")
+                    for i in range(0, len(body), 7):
+                        writer.write(body[i:i + 7])
+                        await writer.drain()
+                        await asyncio.sleep(0.001)
+                    break
+                else:
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+                await writer.drain()
+                served += 1
+                if self.close_after is not None and served >= self.close_after:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class UDPTrackerStandIn(asyncio.DatagramProtocol):
+    """
+    BEP 15 tracker on localhost that can lose datagrams. drop: number of incoming datagrams to
+    ignore before answering. silent_hashes: scrape packets holding any of these go unanswered.
+    expire() makes every connection ID issued so far invalid (answered with an error).
+    log: (action, number of scraped hashes or None) per answered request.
+    """
+
+    def __init__(self, peers=(), drop=0, silent_hashes=()):
+        self.peers = list(peers)
+        self.drop = drop
+        self.silent_hashes = set(silent_hashes)
+        self.connection_ids = set()
+        self.received = 0
+        self.log = []
+        self.transport = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=("127.0.0.1", 0))
+        return self
+
+    @property
+    def url(self):
+        return "udp://127.0.0.1:%d/announce" % self.transport.get_extra_info("sockname")[1]
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def close(self):
+        self.transport.close()
+
+    def expire(self):
+        self.connection_ids.clear()
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if self.received <= self.drop or len(data) < 16:
+            return
+        connection_id, action, transaction_id = struct.unpack_from("!QII", data)
+        header = struct.pack("!II", action, transaction_id)
+        if action == 0:
+            new_id = int.from_bytes(os.urandom(8), "big")
+            self.connection_ids.add(new_id)
+            self.log.append((action, None))
+            self.transport.sendto(header + struct.pack("!Q", new_id), addr)
+            return
+        if connection_id not in self.connection_ids:
+            self.transport.sendto(struct.pack("!II", 3, transaction_id) + b"Connection ID mismatch", addr)
+            return
+        if action == 1:
+            self.log.append((action, None))
+            compact = b"".join(socket.inet_aton(ip) + struct.pack("!H", port) for ip, port in self.peers)
+            self.transport.sendto(header + struct.pack("!III", 1800, 2, 1) + compact, addr)
+        elif action == 2:
+            hashes = [data[i:i + 20] for i in range(16, len(data), 20)]
+            if self.silent_hashes.intersection(hashes):
+                return
+            self.log.append((action, len(hashes)))
+            # seeders / completed / leechers derived from each hash, so answers can be checked.
+            body = b"".join(struct.pack("!III", h[0], h[1], h[2]) for h in hashes)
+            self.transport.sendto(header + body, addr)
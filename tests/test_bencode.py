@@ -0,0 +1,74 @@
+"""Bencode: iterative decoding, value spans for the info hash, validation of untrusted input."""
+import hashlib
+
+import pytest
+
+from core.bencode import MAX_DEPTH, BencodeError, decode, decode_one, encode
+from core.torrent import Torrent
+
+
+def test_round_trip():
+    value = {b"announce": b"http://t/a", b"info": {b"length": 5, b"name": b"f", b"l": [1, -2, [b"", {}]]}}
+    data = encode(value)
+    assert decode(data, strict=True) == value
+    assert decode(memoryview(data)) == decode(bytearray(data)) == value
+    assert encode({b"b": 1, b"a": 0}) == b"d1:ai0e1:bi1ee"  # keys sorted
+
+
+def test_deep_nesting_without_recursion():
+    depth = 20000  # far past the interpreter's recursion limit
+    value = decode(b"l" * depth + b"e" * depth, max_depth=depth)
+    for _ in range(depth - 1):
+        (value,) = value
+    assert value == []
+    with pytest.raises(BencodeError):
+        decode(b"l" * (MAX_DEPTH + 1) + b"e" * (MAX_DEPTH + 1))
+
+
+def test_spans_of_top_level_values():
+    info = b"d6:lengthi5e4:name1:fe"
+    data = b"d8:announce3:abc4:info" + info + b"3:zzzli1eee"
+    spans = {}
+    decode(data, spans=spans)
+    assert data[slice(*spans[b"info"])] == info
+    assert data[slice(*spans[b"announce"])] == b"3:abc"
+    assert data[slice(*spans[b"zzz"])] == b"li1ee"
+
+
+def test_info_hash_of_raw_bytes(tmp_path):
+    # Keys out of order: re-encoding the decoded dict would give a different hash.
+    info = b"d4:name1:f6:lengthi5e12:piece lengthi16384e6:pieces20:" + b"p" * 20 + b"e"
+    path = tmp_path / "a.torrent"
+    path.write_bytes(b"d8:announce3:abc4:info" + info + b"e")
+    torrent = Torrent(str(path))
+    assert torrent.info_hash == hashlib.sha1(info).digest()
+    assert torrent.info_hash != hashlib.sha1(encode(torrent.info)).digest()
+
+
+def test_decode_one_leaves_trailing_data():
+    assert decode_one(b"xxi42etrailer", start=2) == (42, 6)
+    assert decode(b"i1eJUNK") == 1
+    with pytest.raises(BencodeError):
+        decode(b"i1eJUNK", strict=True)
+
+
+@pytest.mark.parametrize("data", [
+    b"", b"i12", b"5:abc", b"l", b"d1:ae", b"di1ei2ee", b"e", b"ixe", b"i--1e", b"x",
+    b"9" * 40 + b":a", b"i" + b"1" * 40 + b"e",
+])
+def test_malformed_input_rejected(data):
+    with pytest.raises(BencodeError):
+        decode(data)
+
+
+@pytest.mark.parametrize("data", [b"i03e", b"i-0e", b"02:ab", b"d1:bi1e1:ai2ee", b"d1:ai1e1:ai2ee"])
+def test_non_canonical_rejected_when_strict(data):
+    decode(data)
+    with pytest.raises(BencodeError):
+        decode(data, strict=True)
+
+
+def test_size_limit():
+    with pytest.raises(BencodeError):
+        decode(b"4:abcd", max_size=5)
+    assert decode(b"4:abcd", max_size=6) == b"abcd"
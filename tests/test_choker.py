@@ -0,0 +1,86 @@
+"""Choker: slot assignment by rate, optimistic unchoke rotation, and peers whose send fails."""
+import asyncio
+
+from core.messages import CHOKE, UNCHOKE
+from engine.choker import Choker
+
+
+class _Writer:
+    def write(self, data):
+        pass
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+
+class _Conn:
+    def __init__(self, downloaded=0, fail=None):
+        self.am_choking = True
+        self.peer_interested = True
+        self.downloaded = 0
+        self.uploaded = 0
+        self.rate = downloaded  # bytes added to downloaded every round
+        self.fail = fail
+        self.sent = []
+        self.writer = _Writer()
+
+    async def send(self, data):
+        if self.fail is not None:
+            raise self.fail
+        self.sent.append(data[4])
+
+
+def _rounds(choker, conns, n):
+    async def run():
+        unchoked = []
+        for _ in range(n):
+            for conn in conns:
+                conn.downloaded += conn.rate
+            await choker.rechoke()
+            unchoked.append({conns.index(c) for c in choker.unchoked()})
+        return unchoked
+
+    return asyncio.run(run())
+
+
+def test_fastest_keep_slots_and_optimistic_rotates():
+    choker = Choker(slots=3, optimistic_every=1)
+    conns = [_Conn(downloaded=rate) for rate in (5000, 4000, 10, 10, 10, 10)]
+    for conn in conns:
+        choker.add(conn)
+    unchoked = _rounds(choker, conns, 30)
+    for chosen in unchoked:
+        assert len(chosen) == 3 and {0, 1} <= chosen
+    optimistic = {min(chosen - {0, 1}) for chosen in unchoked}
+    assert len(optimistic) > 1  # the third slot rotates among the slow peers
+    assert conns[2].sent.count(UNCHOKE) == conns[2].sent.count(CHOKE) + (2 in unchoked[-1])
+
+
+def test_uninterested_peers_stay_choked():
+    choker = Choker(slots=2)
+    conns = [_Conn(downloaded=100), _Conn(downloaded=50)]
+    conns[1].peer_interested = False
+    for conn in conns:
+        choker.add(conn)
+    assert _rounds(choker, conns, 2) == [{0}, {0}]
+    assert conns[1].sent == []
+
+
+def test_failed_send_keeps_choker_running():
+    choker = Choker(slots=2)
+    conns = [_Conn(downloaded=100, fail=RuntimeError("transport is closing")), _Conn(downloaded=50)]
+    conns[0].am_choking = False
+    for conn in conns:
+        choker.add(conn)
+    conns[0].peer_interested = False  # wants a CHOKE, which fails
+    assert _rounds(choker, conns, 2) == [{0, 1}, {0, 1}]
+    assert conns[0].am_choking is False  # state follows what the peer was actually told
+    assert conns[1].sent == [UNCHOKE] and choker.unchokes == 1 and choker.chokes == 0
+
+
+def test_failed_unchoke_is_not_counted():
+    choker = Choker(slots=2)
+    conn = _Conn(fail=ConnectionError())
+    choker.add(conn)
+    asyncio.run(choker.interest_changed(conn))
+    assert conn.am_choking and choker.unchokes == 0
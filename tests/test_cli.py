@@ -0,0 +1,45 @@
+"""CLI --dht-cache: joining the DHT must neither hold the download back nor crash it."""
+import asyncio
+import socket
+import sys
+
+import cli
+from dht.node import DHTNode
+
+
+def _main(monkeypatch, tmp_path, port):
+    argv = [
+        "cli.py", "download", str(tmp_path / "missing.torrent"),
+        "--port", str(port), "--dht-cache", str(tmp_path / "dht.dat"),
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+    return cli.main()
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("", 0))
+        return sock.getsockname()[1]
+
+
+def test_bootstrap_runs_in_background(monkeypatch, tmp_path, capsys):
+    joined = []
+
+    def bootstrap(self):
+        joined.append(self)
+        return asyncio.sleep(3600)  # a cold cache: the router lookup takes its time
+
+    monkeypatch.setattr(DHTNode, "bootstrap", bootstrap)
+    port = _free_udp_port()
+    assert _main(monkeypatch, tmp_path, port - 1) == 1  # got as far as the missing torrent
+    assert len(joined) == 1
+    assert "Not a file" in capsys.readouterr().err
+
+
+def test_dht_port_in_use_is_reported(monkeypatch, tmp_path, capsys):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as busy:
+        busy.bind(("", 0))
+        port = busy.getsockname()[1]
+        assert _main(monkeypatch, tmp_path, port - 1) == 1
+    err = capsys.readouterr().err
+    assert "DHT node cache not used" in err and "Not a file" in err
@@ -0,0 +1,74 @@
+"""ConnectionManager: a pool of peers that all keep failing is given up on, not waited out."""
+import asyncio
+import functools
+import socket
+import time
+
+from engine import downloader
+from engine.connections import BACKOFF_BASE, ConnectionManager
+
+from .standins import make_torrent
+
+
+def _dead_addrs(n):
+    """Local addresses nothing listens on (connects are refused at once)."""
+    socks = [socket.socket() for _ in range(n)]
+    for sock in socks:
+        sock.bind(("127.0.0.1", 0))
+    addrs = [sock.getsockname() for sock in socks]
+    for sock in socks:
+        sock.close()
+    return addrs
+
+
+class _Conn:
+    downloaded = 0
+
+
+def test_all_candidates_in_backoff_stalls():
+    async def run():
+        manager = ConnectionManager(target=4, give_up_after=0.3)
+        manager.add(_dead_addrs(3))
+
+        async def start_worker(addr, on_connected):
+            raise ConnectionRefusedError
+
+        started = time.monotonic()
+        await asyncio.wait_for(manager.run(start_worker, manager.stalled), 5)
+        return manager, time.monotonic() - started
+
+    manager, elapsed = asyncio.run(run())
+    assert elapsed < BACKOFF_BASE
+    assert manager.failed == 3 and len(manager.candidates) == 3  # kept, in backoff
+
+
+def test_live_connection_is_not_stalled():
+    async def run():
+        manager = ConnectionManager(target=1, give_up_after=0.1)
+        manager.add([("127.0.0.1", 1)])
+        release = asyncio.Event()
+
+        async def start_worker(addr, on_connected):
+            on_connected(_Conn())
+            await release.wait()
+
+        runner = asyncio.ensure_future(manager.run(start_worker, lambda: release.is_set() and manager.stalled()))
+        await asyncio.sleep(0.5)
+        stalled_while_connected = manager.stalled()
+        release.set()
+        await asyncio.wait_for(runner, 5)
+        return stalled_while_connected
+
+    assert asyncio.run(run()) is False
+
+
+def test_download_from_dead_peers_gives_up(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, "ConnectionManager", functools.partial(ConnectionManager, give_up_after=0.5))
+
+    async def run():
+        _, _, torrent = make_torrent(tmp_path, 64 * 1024, 16384)
+        return await asyncio.wait_for(downloader._run_download(
+            torrent, _dead_addrs(4), b"-PC0001-" + b"d" * 12, str(tmp_path / "out.bin"), 4, resume=False,
+        ), 10)
+
+    assert asyncio.run(run()) is None
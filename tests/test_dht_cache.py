@@ -0,0 +1,26 @@
+"""DHT node cache: only good nodes are written for the next start."""
+import os
+
+from dht.node import DHTNode
+from dht.routing import GOOD_FOR, MAX_FAILURES
+
+
+def test_save_keeps_only_good_nodes(tmp_path):
+    path = str(tmp_path / "dht.dat")
+    node = DHTNode(port=0, bootstrap_nodes=[], cache_path=path)
+    good, once, dead, stale = ([os.urandom(20) for _ in range(2)] for _ in range(4))
+    for i, node_id in enumerate(good + once + dead + stale):
+        node.routing.add(node_id, ("10.0.0.%d" % (i + 1), 6881))
+    for node_id in once:
+        node.routing.failed(node_id)
+    for node_id in dead:
+        for _ in range(MAX_FAILURES):
+            node.routing.failed(node_id)
+    for n in node.routing.nodes():
+        if n.id in stale:
+            n.last_seen -= GOOD_FOR + 1
+    node.close()  # saves, like save()
+
+    node_id, cached = DHTNode._load_cache(path)
+    assert node_id == node.node_id
+    assert sorted(n for n, _ in cached) == sorted(good)
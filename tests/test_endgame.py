@@ -0,0 +1,77 @@
+"""Endgame between connections: the first copy of a block wins, the other requester gets CANCEL."""
+import asyncio
+import struct
+
+from core.messages import CANCEL, REQUEST
+from core.peer_connection import PeerConnection
+from core.piece import BLOCK_SIZE
+from core.piece_manager import Bitfield, PieceManager, make_bitfield
+
+
+class _Torrent:
+    num_pieces = 1
+    piece_length = 2 * BLOCK_SIZE
+    length = 2 * BLOCK_SIZE
+    pieces = bytes(20)
+
+
+class _Writer:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    async def drain(self):
+        pass
+
+
+def _messages(writer):
+    """(msg_id, index, begin, length) of every REQUEST / CANCEL written."""
+    data = b"".join(writer.writes)
+    return [struct.unpack_from("!xxxxBIII", data, pos) for pos in range(0, len(data), 17)]
+
+
+def _conn(rate):
+    conn = PeerConnection(None, _Writer(), pipeline_depth=4)
+    conn.pieces = Bitfield(1)
+    conn.pieces.update(make_bitfield([0], 1))
+    conn.rate = rate
+    return conn
+
+
+def _block(begin):
+    return struct.pack("!II", 0, begin) + b"x" * BLOCK_SIZE
+
+
+def test_duplicate_requests_cancelled_and_late_copies_wasted():
+    manager = PieceManager(_Torrent())
+    manager.add_have(0)
+    fast, slow = _conn(100.0), _conn(1.0)
+
+    asyncio.run(fast._fill_pipeline(manager))
+    assert manager.endgame() and set(fast.inflight) == {(0, 0), (0, BLOCK_SIZE)}
+    asyncio.run(slow._fill_pipeline(manager))
+    assert set(slow.inflight) == {(0, 0), (0, BLOCK_SIZE)}
+    assert [m[0] for m in _messages(slow.writer)] == [REQUEST, REQUEST]
+
+    # fast delivers block 0: slow's request for it is withdrawn with a CANCEL.
+    assert fast._handle_block(manager, memoryview(_block(0))) is None
+    assert _messages(slow.writer)[2:] == [(CANCEL, 0, 0, BLOCK_SIZE)]
+    assert set(slow.inflight) == {(0, BLOCK_SIZE)} and slow.cancels == 1 and manager.cancels == 1
+
+    # slow's copy arrives anyway (the CANCEL crossed it): counted as waste, not stored twice.
+    assert slow._handle_block(manager, memoryview(_block(0))) is None
+    assert slow.wasted == BLOCK_SIZE and slow.unsolicited_blocks == 1
+    assert manager.stats()["wasted_bytes"] == BLOCK_SIZE
+
+    piece = slow._handle_block(manager, memoryview(_block(BLOCK_SIZE)))
+    assert piece is not None and piece.complete()
+    assert _messages(fast.writer)[2:] == [(CANCEL, 0, BLOCK_SIZE, BLOCK_SIZE)]
+    assert not fast.inflight and not slow.inflight
+
+
+def test_cancel_without_request_is_ignored():
+    conn = _conn(0.0)
+    conn.cancel(0, 0, BLOCK_SIZE)
+    assert conn.writer.writes == [] and conn.cancels == 0
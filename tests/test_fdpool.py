@@ -0,0 +1,61 @@
+"""FilePool: descriptors in use stay open until released, also during fsync."""
+import os
+
+import pytest
+
+from storage import fdpool
+from storage.fdpool import FilePool
+
+
+def _closed(fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        return True
+    return False
+
+
+def test_close_during_fsync_waits_for_it(tmp_path, monkeypatch):
+    pool = FilePool()
+    path = str(tmp_path / "a.bin")
+    with pool.fd(path, writable=True) as fd:
+        fdpool.pwrite_all(fd, b"data", 0)
+    synced = []
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        pool.close()  # another thread closes the pool between the lookup and the fsync
+        real_fsync(fd)  # EBADF if the descriptor was closed already
+        synced.append(fd)
+
+    monkeypatch.setattr(fdpool.os, "fsync", fsync)
+    pool.fsync()
+    monkeypatch.setattr(fdpool.os, "fsync", real_fsync)
+    assert synced == [fd]
+    assert _closed(fd)  # closed once the fsync let go of it
+
+
+def test_eviction_spares_borrowed_descriptors(tmp_path):
+    pool = FilePool(max_open=1)
+    with pool.fd(str(tmp_path / "a.bin"), writable=True) as a:
+        with pool.fd(str(tmp_path / "b.bin"), writable=True) as b:
+            assert not _closed(a) and not _closed(b)
+        assert not _closed(a)
+    with pool.fd(str(tmp_path / "c.bin"), writable=True):
+        assert _closed(a) and _closed(b)
+    pool.close()
+
+
+def test_fsync_error_releases_descriptors(tmp_path, monkeypatch):
+    pool = FilePool()
+    with pool.fd(str(tmp_path / "a.bin"), writable=True) as fd:
+        pass
+
+    def fsync(fd):
+        raise OSError("disk gone")
+
+    monkeypatch.setattr(fdpool.os, "fsync", fsync)
+    with pytest.raises(OSError):
+        pool.fsync()
+    pool.close()
+    assert _closed(fd)
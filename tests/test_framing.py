@@ -0,0 +1,152 @@
+"""FrameBuffer and WireProtocol: incremental frame parsing; PIECE payload views must survive reads that arrive while they are held."""
+import asyncio
+import struct
+
+import pytest
+
+from core.framing import MAX_FRAME, FrameBuffer
+from core.messages import PIECE
+from core.wire import WireProtocol
+
+
+def piece_frame(index, begin, block):
+    return struct.pack("!IBII", 9 + len(block), PIECE, index, begin) + block
+
+
+def test_view_survives_non_compacting_write():
+    frames = FrameBuffer(capacity=1024)
+    frames.feed(piece_frame(0, 0, b"A" * 64))
+    [(msg_id, payload)] = frames.messages()
+    assert msg_id == PIECE
+    held = bytes(payload)
+
+    more = piece_frame(0, 64, b"B" * 64)
+    space = frames.writable(len(more), compact=False)
+    space[:len(more)] = more
+    frames.commit(len(more))
+
+    assert bytes(payload) == held
+    [(_, second)] = frames.messages()
+    assert bytes(second[8:]) == b"B" * 64
+
+
+def test_view_survives_growth():
+    frames = FrameBuffer(capacity=128)
+    frames.feed(piece_frame(0, 0, b"A" * 64))
+    [(_, payload)] = frames.messages()
+    held = bytes(payload)
+    space = frames.writable(4096, compact=False)
+    space[:4096] = b"B" * 4096
+    frames.commit(4096)
+    assert bytes(payload) == held
+
+
+def test_compacting_write_rewinds():
+    frames = FrameBuffer(capacity=1024)
+    frames.feed(piece_frame(0, 0, b"A" * 64))
+    frames.messages()
+    frames.writable(16)
+    assert len(frames) == 0 and frames._start == frames._end == 0
+
+
+class _Transport:
+    def __init__(self):
+        self.paused = False
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+
+def _deliver(protocol, data):
+    buf = protocol.get_buffer(len(data))
+    buf[:len(data)] = data
+    protocol.buffer_updated(len(data))
+
+
+def test_wire_held_view_unchanged_by_next_read():
+    async def run():
+        protocol = WireProtocol(expect_handshake=False)
+        protocol.connection_made(_Transport())
+        _deliver(protocol, piece_frame(1, 0, b"A" * 16384))
+        [(msg_id, payload)] = await protocol.recv()
+        assert msg_id == PIECE
+        held = bytes(payload)
+        # The socket keeps delivering while the caller still holds the view (e.g. across an await).
+        _deliver(protocol, piece_frame(1, 16384, b"B" * 16384))
+        assert bytes(payload) == held
+        [(_, second)] = await protocol.recv()
+        assert bytes(second[8:]) == b"B" * 16384
+
+    asyncio.run(run())
+
+
+def test_capacity_bounded_while_views_held():
+    # A view of the last frame is always held when the next read arrives, so every write is
+    # non-compacting; the buffer must still not grow with the total bytes received.
+    frames = FrameBuffer(capacity=64 * 1024)
+    frame = piece_frame(0, 0, b"A" * 16384)
+    held = []
+    for _ in range(2000):
+        space = frames.writable(len(frame), compact=False)
+        space[:len(frame)] = frame
+        frames.commit(len(frame))
+        [(_, payload)] = frames.messages()
+        held = [payload]
+    assert bytes(held[0][8:]) == b"A" * 16384
+    assert len(frames._buf) <= 2 * 64 * 1024
+
+
+def test_wire_capacity_bounded_while_views_held():
+    async def run():
+        protocol = WireProtocol(expect_handshake=False)
+        protocol.connection_made(_Transport())
+        for i in range(2000):
+            _deliver(protocol, piece_frame(1, i, b"A" * 16384))
+            [(_, payload)] = await protocol.recv()  # held until the next recv()
+        return len(protocol.frames._buf)
+
+    assert asyncio.run(run()) <= 2 * 256 * 1024
+
+
+def test_frame_split_across_feeds():
+    frames = FrameBuffer(capacity=64)
+    data = struct.pack("!IB", 1, 2) + piece_frame(5, 0, b"X" * 200) + struct.pack("!I", 0)
+    received = []
+    for i in range(0, len(data), 7):  # partial length prefixes and payloads
+        frames.feed(data[i:i + 7])
+        received += [(msg_id, payload and bytes(payload)) for msg_id, payload in frames.messages()]
+    (first, second, keepalive) = received
+    assert first == (2, b"")
+    assert second[0] == PIECE and second[1] == struct.pack("!II", 5, 0) + b"X" * 200
+    assert keepalive == (None, None)
+    assert len(frames) == 0
+
+
+def test_only_zero_copy_ids_are_views():
+    frames = FrameBuffer()
+    frames.feed(struct.pack("!IB", 3, 5) + b"\xff\x80" + piece_frame(0, 0, b"A" * 4))
+    (bitfield, piece) = frames.messages()
+    assert bitfield == (5, b"\xff\x80") and type(bitfield[1]) is bytes
+    assert isinstance(piece[1], memoryview)
+
+
+def test_handshake_taken_before_frames():
+    frames = FrameBuffer()
+    frames.feed(b"H" * 60)
+    assert frames.take(68) is None
+    frames.feed(b"H" * 8 + struct.pack("!IB", 1, 1))
+    assert frames.take(68) == b"H" * 68
+    assert frames.messages() == [(1, b"")]
+
+
+def test_oversized_frame_rejected():
+    frames = FrameBuffer()
+    frames.feed(struct.pack("!I", MAX_FRAME + 1))
+    with pytest.raises(ConnectionError):
+        frames.messages()
@@ -0,0 +1,70 @@
+"""HashPool: verification on hash threads with a bounded number of pending jobs."""
+import asyncio
+import hashlib
+import threading
+
+from core.piece import BLOCK_SIZE, Piece
+from engine.hasher import HashPool
+
+
+def _piece(data, corrupt=False):
+    piece = Piece(0, len(data), hashlib.sha1(b"other" if corrupt else data).digest())
+    for offset in range(0, len(data), BLOCK_SIZE):
+        piece.add_block(offset, data[offset:offset + BLOCK_SIZE])
+    return piece
+
+
+def test_verify_counts_failures():
+    data = b"z" * (4 * BLOCK_SIZE)
+
+    async def run():
+        pool = HashPool(threads=2)
+        try:
+            return await asyncio.gather(pool.verify(_piece(data)), pool.verify(_piece(data, corrupt=True))), pool
+        finally:
+            pool.close()
+
+    results, pool = asyncio.run(run())
+    assert results == [True, False]
+    stats = pool.stats()
+    assert stats["jobs"] == 2 and stats["failures"] == 1 and stats["pending"] == 0
+
+
+def test_runs_off_the_event_loop():
+    async def run():
+        pool = HashPool(threads=1)
+        try:
+            return await pool.run(threading.get_ident), threading.get_ident()
+        finally:
+            pool.close()
+
+    worker, loop_thread = asyncio.run(run())
+    assert worker != loop_thread
+
+
+def test_pending_jobs_bounded():
+    release = threading.Event()
+    running = []
+    lock = threading.Lock()
+
+    def job():
+        with lock:
+            running.append(1)
+        release.wait(5)
+
+    async def run():
+        pool = HashPool(threads=4, max_pending=2)
+        try:
+            jobs = [asyncio.ensure_future(pool.run(job)) for _ in range(5)]
+            await asyncio.sleep(0.1)
+            started = len(running)  # the other jobs wait for a slot on the loop
+            waiting = pool.pending
+            release.set()
+            await asyncio.gather(*jobs)
+            return started, waiting, pool.stats()
+        finally:
+            pool.close()
+
+    started, waiting, stats = asyncio.run(run())
+    assert started == 2 and waiting == 5
+    assert stats["jobs"] == 5 and stats["max_wait"] > 0.05
@@ -0,0 +1,86 @@
+"""Keep-alive HTTP client against a local stand-in tracker."""
+import asyncio
+
+from trackers.http_client import HTTPClient
+from trackers.http_tracker import HTTPTracker
+
+from .standins import HTTPTrackerStandIn
+
+INFO_HASH = b"i" * 20
+PEER_ID = b"-PC0001-" + b"p" * 12
+PEERS = [("10.0.0.1", 6881), ("10.0.0.2", 51413)]
+
+
+async def _announce_twice(tracker_standin):
+    client = HTTPClient()
+    try:
+        tracker = HTTPTracker(tracker_standin.url, client)
+        first = await tracker.announce(INFO_HASH, PEER_ID, 6881, event="started")
+        second = await tracker.announce(INFO_HASH, PEER_ID, 6881)
+        return client.stats(), first, second
+    finally:
+        client.close()
+
+
+def _run(body, close_after=None):
+    async def run():
+        standin = await HTTPTrackerStandIn(PEERS, body=body, close_after=close_after).start()
+        try:
+            return (*await _announce_twice(standin), standin)
+        finally:
+            standin.close()
+
+    return asyncio.run(run())
+
+
+def test_content_length_connection_reused():
+    stats, first, second, standin = _run("length")
+    assert first["peers"] == PEERS and second["peers"] == PEERS
+    assert first["interval"] == 1800
+    assert stats["connections_opened"] == 1 and stats["reused"] == 1
+    assert [number for number, _ in standin.log] == [1, 1]
+    assert standin.log[0][1]["event"] == "started" and "event" not in standin.log[1][1]
+
+
+def test_chunked_body_connection_reused():
+    stats, first, second, standin = _run("chunked")
+    assert first["peers"] == PEERS and second["peers"] == PEERS
+    assert stats["connections_opened"] == 1 and stats["reused"] == 1
+
+
+def test_body_until_eof_not_reused():
+    stats, first, second, standin = _run("eof")
+    assert first["peers"] == PEERS and second["peers"] == PEERS
+    assert stats["connections_opened"] == 2 and stats["reused"] == 0
+    assert [number for number, _ in standin.log] == [1, 2]
+
+
+def test_reconnect_after_server_closed_idle_connection():
+    stats, first, second, standin = _run("length", close_after=1)
+    assert first["peers"] == PEERS and second["peers"] == PEERS
+    # The pooled connection was closed by the server: the reuse fails and a new one is opened.
+    assert stats["connections_opened"] == 2
+    assert [number for number, _ in standin.log] == [1, 2]
+
+
+def test_no_content_response_does_not_wait_for_eof():
+    async def run():
+        standin = await HTTPTrackerStandIn(PEERS, body="none").start()
+        client = HTTPClient()
+        try:
+            first = await client.get(standin.url, timeout=2)
+            second = await client.get(standin.url, timeout=2)
+            return first, second, client.stats()
+        finally:
+            client.close()
+            standin.close()
+
+    first, second, stats = asyncio.run(run())
+    assert first[0] == second[0] == 204 and first[2] == second[2] == b""
+    assert stats["connections_opened"] == 1 and stats["reused"] == 1
+
+
+def test_interim_response_skipped():
+    stats, first, second, standin = _run("continue")
+    assert first["peers"] == PEERS and second["peers"] == PEERS
+    assert stats["connections_opened"] == 1 and stats["reused"] == 1
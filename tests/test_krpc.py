@@ -0,0 +1,68 @@
+"""KRPC receive path: malformed datagrams from the network must not raise."""
+import asyncio
+import socket
+
+from core.bencode import decode, encode
+from dht.krpc import ERROR_PROTOCOL, KRPC
+
+ADDR = ("127.0.0.1", 6881)
+
+
+def _krpc():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.bind(("127.0.0.1", 0))
+    krpc = KRPC(sock, b"n" * 20)
+    krpc.sent_to = []
+    krpc.send = lambda data, addr: krpc.sent_to.append((decode(data), addr))
+    krpc.register(b"ping", lambda args, addr: {})
+    return krpc
+
+
+def test_unhashable_transaction_id_in_reply_is_stray():
+    krpc = _krpc()
+    krpc._received(encode({b"t": [b"x"], b"y": b"r", b"r": {b"id": b"m" * 20}}), ADDR)
+    krpc._received(encode({b"t": {b"a": 1}, b"y": b"e", b"e": [201, b"x"]}), ADDR)
+    assert krpc.stray == 2
+    krpc.sock.close()
+
+
+def test_unhashable_method_is_answered_with_protocol_error():
+    krpc = _krpc()
+    krpc._received(encode({b"t": b"aa", b"y": b"q", b"q": [b"ping"], b"a": {b"id": b"m" * 20}}), ADDR)
+    krpc._received(encode({b"t": b"ab", b"y": b"q", b"q": {b"ping": 1}, b"a": {b"id": b"m" * 20}}), ADDR)
+    assert [msg[b"e"][0] for msg, _ in krpc.sent_to] == [ERROR_PROTOCOL, ERROR_PROTOCOL]
+    assert [msg[b"t"] for msg, _ in krpc.sent_to] == [b"aa", b"ab"]
+    assert krpc.queries_dropped == 2
+    krpc.sock.close()
+
+
+def test_unhashable_transaction_id_in_query_is_dropped():
+    krpc = _krpc()
+    krpc._received(encode({b"t": [b"aa"], b"y": b"q", b"q": b"ping", b"a": {b"id": b"m" * 20}}), ADDR)
+    assert krpc.sent_to == [] and krpc.queries_dropped == 1
+    # A well-formed query is still answered.
+    krpc._received(encode({b"t": b"ac", b"y": b"q", b"q": b"ping", b"a": {b"id": b"m" * 20}}), ADDR)
+    assert krpc.sent_to[0][0][b"y"] == b"r"
+    krpc.sock.close()
+
+
+def test_malformed_datagrams_over_the_socket():
+    async def run():
+        server, client = _krpc(), _krpc()
+        del server.send  # use the real socket
+        await server.start()
+        target = server.sock.getsockname()
+        junk = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        junk.sendto(encode({b"t": [1], b"y": b"q", b"q": [b"x"], b"a": {}}), target)
+        junk.sendto(encode({b"t": [1], b"y": b"r", b"r": {}}), target)
+        await asyncio.sleep(0.05)
+        junk.close()
+        del client.send
+        r = await client.query(target, b"ping", {})
+        assert r[b"id"] == b"n" * 20
+        assert server.stray == 1 and server.queries_dropped == 1
+        server.close()
+        client.close()
+
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+"""FileLayout: stream ranges split across files, including zero-length files and boundaries."""
+import asyncio
+import hashlib
+import os
+
+from core.torrent import Torrent
+from engine.hasher import HashPool
+from storage.fdpool import FilePool
+from storage.layout import FileLayout
+from storage.resume import recheck
+
+PIECE = 16
+
+
+def _torrent(lengths, data=None):
+    files = [{b"length": n, b"path": [b"d", b"f%d" % i]} for i, n in enumerate(lengths)]
+    total = sum(lengths)
+    data = data if data is not None else bytes(total)
+    pieces = b"".join(hashlib.sha1(data[i:i + PIECE]).digest() for i in range(0, total, PIECE))
+    info = {b"name": b"multi", b"piece length": PIECE, b"pieces": pieces, b"files": files}
+    return Torrent(meta={b"info": info}, info=info, info_hash=b"m" * 20)
+
+
+def _names(spans):
+    return [(os.path.basename(path), offset, n) for path, offset, n in spans]
+
+
+def test_spans_cross_file_boundaries(tmp_path):
+    layout = FileLayout(_torrent([10, 20, 5]), str(tmp_path))
+    assert _names(layout.spans(0, 35)) == [("f0", 0, 10), ("f1", 0, 20), ("f2", 0, 5)]
+    assert _names(layout.spans(8, 4)) == [("f0", 8, 2), ("f1", 0, 2)]
+    assert _names(layout.spans(10, 3)) == [("f1", 0, 3)]  # exactly on a boundary
+    assert _names(layout.spans(29, 6)) == [("f1", 19, 1), ("f2", 0, 5)]
+    assert _names(layout.spans(33, 10)) == [("f2", 3, 2)]  # clipped at the end of the stream
+
+
+def test_zero_length_files_are_skipped(tmp_path):
+    layout = FileLayout(_torrent([0, 10, 0, 0, 6, 0]), str(tmp_path))
+    assert _names(layout.spans(0, 16)) == [("f1", 0, 10), ("f4", 0, 6)]
+    assert _names(layout.spans(10, 2)) == [("f4", 0, 2)]
+    assert _names(layout.spans(9, 2)) == [("f1", 9, 1), ("f4", 0, 1)]
+
+
+def test_piece_spans(tmp_path):
+    layout = FileLayout(_torrent([10, 20, 5]), str(tmp_path))  # pieces of 16: 0-15, 16-31, 32-34
+    assert _names(layout.piece_spans(0)) == [("f0", 0, 10), ("f1", 0, 6)]
+    assert _names(layout.piece_spans(2)) == [("f2", 2, 3)]  # the short last piece
+    assert _names(layout.piece_spans(1, begin=10, length=4)) == [("f1", 16, 4)]
+
+
+def test_paths_stay_inside_download_dir(tmp_path):
+    info = {
+        b"name": b"x", b"piece length": PIECE, b"pieces": b"\0" * 20,
+        b"files": [{b"length": 1, b"path": [b"..", b"sub", b".", b"a"]}],
+    }
+    layout = FileLayout(Torrent(meta={b"info": info}, info=info, info_hash=b"m" * 20), str(tmp_path))
+    assert layout.paths() == [os.path.join(str(tmp_path), "sub", "a")]
+
+
+def test_write_read_and_recheck_across_files(tmp_path):
+    lengths = [7, 0, 30, 0, 11]
+    data = os.urandom(sum(lengths))
+    torrent = _torrent(lengths, data)
+    layout = FileLayout(torrent, str(tmp_path))
+    layout.create()
+    assert [os.path.getsize(path) for path in layout.paths()] == lengths
+    pool = FilePool()
+    try:
+        # Buffers whose edges do not line up with the files.
+        layout.write(pool, [data[:5], data[5:25], data[25:]], 0)
+        assert layout.read(pool, 0, len(data)) == data
+        assert layout.read(pool, 6, 3) == data[6:9]
+    finally:
+        pool.close()
+    with open(layout.paths()[2], "rb") as f:
+        assert f.read() == data[7:37]
+
+    async def run():
+        hash_pool = HashPool(threads=2)
+        try:
+            return await recheck(torrent, layout, hash_pool)
+        finally:
+            hash_pool.close()
+
+    assert asyncio.run(run()) == set(range(torrent.num_pieces))
@@ -0,0 +1,98 @@
+"""Iterative DHT lookup: at most alpha queries in flight, convergence on the k closest nodes."""
+import asyncio
+import random
+import socket
+import struct
+
+from dht.lookup import Lookup, encode_nodes
+from dht.routing import K, RoutingTable, to_int
+
+
+class _Network:
+    """Nodes that answer with the closest nodes they know; unreachable ones time out."""
+
+    def __init__(self, num_nodes, seed=1, dead=()):
+        rng = random.Random(seed)
+        self.ids = [rng.getrandbits(160).to_bytes(20, "big") for _ in range(num_nodes)]
+        self.addrs = [(socket.inet_ntoa(struct.pack("!I", 0x0A000001 + i)), 6881) for i in range(num_nodes)]
+        self.by_addr = dict(zip(self.addrs, range(num_nodes)))
+        self.dead = set(dead)
+        self.peers = {}  # node index -> [(ip, port)] stored for get_peers
+        self.tables = [RoutingTable(node_id) for node_id in self.ids]
+        order = sorted(range(num_nodes), key=lambda i: to_int(self.ids[i]))
+        for pos, i in enumerate(order):
+            for j in order[max(0, pos - K):pos + K + 1] + rng.sample(range(num_nodes), 20):
+                if j != i:
+                    self.tables[i].add(self.ids[j], self.addrs[j])
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.asked = []
+
+    def closest(self, target, count=K):
+        value = to_int(target)
+        return sorted(range(len(self.ids)), key=lambda i: to_int(self.ids[i]) ^ value)[:count]
+
+    async def query(self, addr, method, args):
+        i = self.by_addr[addr]
+        self.asked.append(i)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001 * (1 + i % 5))
+            if i in self.dead:
+                raise asyncio.TimeoutError
+        finally:
+            self.in_flight -= 1
+        target = args.get(b"info_hash") or args[b"target"]
+        r = {b"id": self.ids[i], b"token": b"t%d" % i}
+        r[b"nodes"] = encode_nodes((n.id, n.addr) for n in self.tables[i].closest(target))
+        if i in self.peers:
+            r[b"values"] = [socket.inet_aton(ip) + struct.pack("!H", port) for ip, port in self.peers[i]]
+        return r
+
+    def seeds(self, indices):
+        return [(None, self.addrs[i]) for i in indices]  # bootstrap routers: ID not known yet
+
+
+def test_concurrency_limited_to_alpha():
+    net = _Network(300)
+    target = bytes(20)
+    lookup = Lookup(target, net.query, net.seeds(range(10)), method=b"find_node", alpha=3)
+    asyncio.run(lookup.run())
+    assert net.max_in_flight == 3
+    assert lookup.queries == len(net.asked) == len(set(net.asked))  # nobody asked twice
+
+
+def test_converges_on_k_closest():
+    net = _Network(300, dead=range(0, 300, 7))
+    target = bytes.fromhex("f" * 40)
+    lookup = Lookup(target, net.query, net.seeds([1, 2, 3]))
+    asyncio.run(lookup.run())
+    live = [i for i in net.closest(target, 3 * K) if i not in net.dead][:K]
+    assert [node_id for node_id, _, _ in lookup.closest()] == [net.ids[i] for i in live]
+    assert [token for _, _, token in lookup.closest()] == [b"t%d" % i for i in live]
+    assert lookup.failures >= 1 and lookup.queries < 100
+
+
+def test_peers_streamed_without_duplicates():
+    net = _Network(200)
+    target = net.ids[50]
+    for i in net.closest(target, 3):
+        net.peers[i] = [("1.2.3.4", 1000), ("1.2.3.%d" % (i % 250 + 1), 2000)]
+
+    async def run():
+        lookup = Lookup(target, net.query, net.seeds([0]))
+        batches = [batch async for batch in lookup.results()]
+        return lookup, batches
+
+    lookup, batches = asyncio.run(run())
+    found = [peer for batch in batches for peer in batch]
+    assert len(found) == len(set(found)) and set(found) == lookup.peers
+    assert ("1.2.3.4", 1000) in lookup.peers and len(lookup.peers) == 4
+
+
+def test_max_queries_bounds_the_lookup():
+    net = _Network(300)
+    lookup = Lookup(bytes(20), net.query, net.seeds(range(10)), alpha=4, max_queries=6)
+    asyncio.run(lookup.run())
+    assert lookup.queries == len(net.asked) == 6
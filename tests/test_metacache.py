@@ -0,0 +1,43 @@
+"""MetadataCache: round trip, and torrents the packed format cannot hold are simply not cached."""
+import os
+
+from core.bencode import encode
+from core.metacache import MetadataCache
+from core.torrent import Torrent
+
+from .standins import make_torrent
+
+
+def _write(directory, meta):
+    path = os.path.join(str(directory), "odd.torrent")
+    with open(path, "wb") as f:
+        f.write(encode(meta))
+    return path
+
+
+def test_round_trip(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache"))
+    _, path, _ = make_torrent(tmp_path, 100000, 32768)
+    first = Torrent.load(path, cache)
+    cached = cache.get(path)
+    assert cached is not None and cached.info_hash == first.info_hash
+    assert (cached.name, cached.length, cached.pieces, cached.announce_list) == (
+        first.name, first.length, first.pieces, first.announce_list,
+    )
+
+
+def test_unpackable_torrents_still_load(tmp_path):
+    cache = MetadataCache(str(tmp_path / "cache"))
+    info = {b"name": b"odd.bin", b"length": 1000, b"piece length": 16384, b"pieces": b"\0" * 20}
+    odd = [
+        # announce-list entries that are not byte strings (Torrent skips them)
+        {b"announce": b"http://t/a", b"announce-list": [[b"http://t/a", 7]], b"info": info},
+        # a piece length no 64-bit field holds
+        {b"announce": b"http://t/a", b"info": {**info, b"piece length": 1 << 70}},
+    ]
+    for meta in odd:
+        path = _write(tmp_path, meta)
+        torrent = Torrent.load(path, cache)
+        assert torrent.length == 1000
+        assert cache.get(path) is None
+    assert [name for name in os.listdir(str(tmp_path / "cache")) if name.endswith(".meta")] == []
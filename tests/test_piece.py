@@ -0,0 +1,72 @@
+"""Piece: blocks assembled in place with SHA-1 fed as the contiguous prefix grows."""
+import hashlib
+
+from core.piece import BLOCK_SIZE, Piece
+
+
+def _piece(data):
+    return Piece(0, len(data), hashlib.sha1(data).digest())
+
+
+def _blocks(data):
+    return [(offset, data[offset:offset + BLOCK_SIZE]) for offset in range(0, len(data), BLOCK_SIZE)]
+
+
+def test_in_order_blocks_hashed_on_arrival():
+    data = bytes(range(256)) * 200  # 3 full blocks and a short one
+    piece = _piece(data)
+    for offset, block in _blocks(data):
+        assert piece.add_block(offset, memoryview(block))
+        assert piece.unhashed_bytes() == len(data) - offset - len(block)
+    assert piece.verify() and bytes(piece.data()) == data
+
+
+def test_out_of_order_blocks_hashed_once_the_gap_fills():
+    data = bytes(range(256)) * 200
+    piece = _piece(data)
+    blocks = _blocks(data)
+    for offset, block in blocks[1:]:
+        piece.add_block(offset, block)
+    assert piece.unhashed_bytes() == len(data) and not piece.complete()
+    assert not piece.verify()
+    piece.add_block(*blocks[0])
+    assert piece.unhashed_bytes() == 0
+    assert piece.verify()
+
+
+def test_bad_blocks_rejected():
+    data = b"x" * (2 * BLOCK_SIZE + 100)
+    piece = _piece(data)
+    assert not piece.add_block(1, b"x" * BLOCK_SIZE)  # misaligned
+    assert not piece.add_block(0, b"x" * 100)  # short
+    assert not piece.add_block(2 * BLOCK_SIZE, b"x" * BLOCK_SIZE)  # last block is 100 bytes
+    assert piece.add_block(0, b"x" * BLOCK_SIZE)
+    assert not piece.add_block(0, b"x" * BLOCK_SIZE)  # duplicate
+    assert piece.received == BLOCK_SIZE
+
+
+def test_corrupt_piece_fails_and_resets():
+    data = b"y" * (2 * BLOCK_SIZE)
+    piece = _piece(data)
+    piece.mark_requested(0, "peer")
+    piece.add_block(0, data[:BLOCK_SIZE])
+    piece.add_block(BLOCK_SIZE, b"z" * BLOCK_SIZE)
+    assert piece.complete() and not piece.verify()
+    piece.reset()
+    assert piece.received == 0 and not piece.requested and piece.unhashed_bytes() == len(data)
+    assert list(piece.missing_blocks()) == [(0, BLOCK_SIZE), (BLOCK_SIZE, BLOCK_SIZE)]
+    for offset, block in _blocks(data):
+        piece.add_block(offset, block)
+    assert piece.verify()
+
+
+def test_request_tracking():
+    piece = _piece(b"q" * (3 * BLOCK_SIZE))
+    piece.mark_requested(0, "a")
+    piece.mark_requested(0, "b")
+    assert piece.open_blocks() == 2
+    assert [offset for offset, _ in piece.unrequested_blocks()] == [BLOCK_SIZE, 2 * BLOCK_SIZE]
+    piece.release(0, "a")
+    assert piece.open_blocks() == 2
+    piece.release(0, "b")
+    assert piece.open_blocks() == 3
@@ -0,0 +1,132 @@
+"""Block scheduler: availability buckets, rarest-first among a peer's pieces, endgame duplicates and CANCEL."""
+from core.piece import BLOCK_SIZE
+from core.piece_manager import Bitfield, PieceManager, make_bitfield
+
+
+class _Torrent:
+    def __init__(self, num_pieces, piece_length=2 * BLOCK_SIZE):
+        self.num_pieces = num_pieces
+        self.piece_length = piece_length
+        self.length = num_pieces * piece_length
+        self.pieces = bytes(20 * num_pieces)
+
+
+class _Peer:
+    def __init__(self, num_pieces, indices, rate=0.0):
+        self.rate = rate
+        self.pieces = Bitfield(num_pieces)
+        self.pieces.update(make_bitfield(indices, num_pieces))
+        self.cancelled = []
+
+    def cancel(self, index, offset, length):
+        self.cancelled.append((index, offset, length))
+
+
+def _manager(num_pieces, availability):
+    """PieceManager where piece i was announced by availability[i] peers."""
+    manager = PieceManager(_Torrent(num_pieces))
+    for index, count in enumerate(availability):
+        for _ in range(count):
+            manager.add_have(index)
+    return manager
+
+
+def test_rarest_first_among_peer_pieces():
+    manager = _manager(8, [1, 5, 2, 4, 1, 3, 2, 6])
+    peer = _Peer(8, [1, 3, 5, 6])
+    picked = [manager.next_piece(peer.pieces).index for _ in range(4)]
+    assert picked == [6, 5, 3, 1]
+    assert manager.next_piece(peer.pieces) is None
+    # The pieces the peer lacks are still there for others, rarest first.
+    assert manager.next_piece().index in (0, 4)
+
+
+def test_availability_changes_reorder_picks():
+    manager = _manager(4, [2, 2, 2, 2])
+    peer = _Peer(4, [0, 1, 2, 3])
+    manager.remove_availability(make_bitfield([2], 4))
+    manager.add_have(0)
+    assert manager.next_piece(peer.pieces).index == 2
+    manager.mark_completed(1)
+    assert [manager.next_piece(peer.pieces).index for _ in range(2)] == [3, 0]
+
+
+def test_pick_blocks_only_from_peer_pieces():
+    manager = _manager(6, [1] * 6)
+    peer = _Peer(6, [2, 4])
+    picked = manager.pick_blocks(peer, 10)
+    assert sorted({piece.index for piece, _, _ in picked}) == [2, 4]
+    assert len(picked) == 4 and manager.in_progress == {2, 4}
+
+
+def test_endgame_once_every_block_is_requested():
+    manager = _manager(3, [2, 2, 0])  # nobody has piece 2: it must not hold endgame off
+    a = _Peer(3, [0, 1])
+    assert not manager.endgame()
+    assert len(manager.pick_blocks(a, 3)) == 3
+    assert not manager.endgame()  # one block of piece 1 is still unrequested
+    assert len(manager.pick_blocks(a, 1)) == 1
+    assert manager.endgame()
+
+
+def test_endgame_duplicates_and_cancel_on_completion():
+    manager = _manager(2, [2, 2])
+    a = _Peer(2, [0, 1], rate=100.0)
+    b = _Peer(2, [0, 1], rate=1.0)
+    blocks = manager.pick_blocks(a, 10)
+    assert len(blocks) == 4 and manager.endgame()
+
+    duplicates = manager.pick_blocks(b, 2)
+    assert len(duplicates) == 2 and manager.endgame_requests == 2
+    assert manager.pick_blocks(a, 10) == []  # no second copy to the same peer
+    (piece, offset, length), _ = duplicates
+    assert piece.requested[offset] == {a, b}
+
+    # a delivers first: b's duplicate request is cancelled.
+    assert manager.add_block(piece, offset, b"x" * length, a) is None
+    assert b.cancelled == [(piece.index, offset, length)] and manager.cancels == 1
+    other = BLOCK_SIZE - offset
+    assert manager.add_block(piece, other, b"y" * BLOCK_SIZE, a) is piece
+    assert piece.index not in manager.active and piece.index in manager.in_progress
+    assert a.cancelled == []
+
+
+def test_bitfield_wire_order():
+    bits = Bitfield(10)
+    assert bits.update(b"\xa0\x40\xff") == [0, 2, 9]  # spare bits past piece 9 ignored
+    assert bits.add(3) and not bits.add(3) and not bits.add(10)
+    assert bytes(bits.bits) == make_bitfield([0, 2, 3, 9], 10)
+    assert len(bits) == 4 and 9 in bits and 1 not in bits and -1 not in bits
+    assert bits.to_int() == int.from_bytes(make_bitfield([0, 2, 3, 9], 10), "big")
+    bits.add(1)
+    assert bits.to_int() == int.from_bytes(make_bitfield([0, 1, 2, 3, 9], 10), "big")
+    assert list(bits.indices()) == [0, 1, 2, 3, 9]
+
+
+def test_buckets_follow_availability():
+    manager = _manager(4, [0, 0, 0, 0])
+    manager.update_availability(make_bitfield([0, 1, 2], 4))
+    manager.update_availability([True, True, False, False])
+    manager.add_have(0)
+    assert manager.availability == [3, 2, 1, 0]
+    assert [set(bucket) for bucket in manager._buckets] == [{3}, {2}, {1}, {0}]
+    manager.remove_availability(make_bitfield([0, 1, 2], 4))
+    assert manager.availability == [2, 1, 0, 0]
+    assert [set(bucket) for bucket in manager._buckets[:3]] == [{2, 3}, {1}, {0}]
+
+
+def test_selection_state_leaves_and_rejoins_buckets():
+    manager = _manager(3, [1, 1, 1])
+    everyone = _Peer(3, [0, 1, 2])
+    first = manager.next_piece(everyone.pieces).index
+    manager.add_have(first)  # availability of a piece in progress still counts
+    manager.mark_in_progress_free(first)  # failed hash: back in its (new) bucket
+    assert first in manager._buckets[2]
+    second = manager.next_piece(everyone.pieces).index
+    assert second != first
+    manager.mark_completed(second)
+    manager.add_have(second)
+    assert all(second not in bucket for bucket in manager._buckets)
+    assert manager.wants(everyone.pieces) and not manager.wants(_Peer(3, [second]).pieces)
+    assert {manager.next_piece().index for _ in range(2)} == {0, 1, 2} - {second}
+    assert manager.next_piece() is None
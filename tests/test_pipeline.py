@@ -0,0 +1,94 @@
+"""Request pipelining: queue depth follows the bandwidth-delay product of the connection."""
+import asyncio
+import struct
+import types
+
+from core import peer_connection
+from core.messages import REQUEST
+from core.peer_connection import DEFAULT_PIPELINE_DEPTH, MIN_PIPELINE_DEPTH, RATE_WINDOW, PeerConnection
+from core.piece import BLOCK_SIZE
+
+
+class _Writer:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(bytes(data))
+
+    async def drain(self):
+        pass
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def _conn(monkeypatch, **kwargs):
+    clock = _Clock()
+    monkeypatch.setattr(peer_connection, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return PeerConnection(None, _Writer(), **kwargs), clock
+
+
+def _receive(conn, clock, rtt, rate, seconds):
+    """Blocks arriving rtt after their request, at rate bytes/s, for seconds."""
+    interval = BLOCK_SIZE / rate
+    for _ in range(int(seconds / interval)):
+        clock.now += interval
+        conn._on_block_received(BLOCK_SIZE, clock.now - rtt)
+
+
+def test_depth_follows_bandwidth_delay_product(monkeypatch):
+    conn, clock = _conn(monkeypatch)
+    assert conn.pipeline_depth == DEFAULT_PIPELINE_DEPTH
+    _receive(conn, clock, rtt=0.1, rate=4 * 1024 * 1024, seconds=5 * RATE_WINDOW)
+    assert abs(conn.rtt - 0.1) < 1e-6
+    bdp_blocks = 4 * 1024 * 1024 * 0.1 / BLOCK_SIZE  # 25.6 blocks in flight fill the link
+    assert abs(conn.pipeline_depth - (int(bdp_blocks * 1.5) + MIN_PIPELINE_DEPTH)) <= 2
+
+
+def test_depth_capped_and_floored(monkeypatch):
+    conn, clock = _conn(monkeypatch, max_pipeline_depth=40)
+    _receive(conn, clock, rtt=0.5, rate=20 * 1024 * 1024, seconds=5 * RATE_WINDOW)
+    assert conn.pipeline_depth == 40
+    slow, clock = _conn(monkeypatch)
+    _receive(slow, clock, rtt=0.01, rate=20 * 1024, seconds=10 * RATE_WINDOW)
+    assert slow.pipeline_depth == MIN_PIPELINE_DEPTH
+
+
+class _Piece:
+    def __init__(self, index):
+        self.index = index
+
+
+class _Scheduler:
+    """pick_blocks() stand-in handing out consecutive blocks of one piece."""
+
+    def __init__(self):
+        self.next_offset = 0
+        self.asked = []
+
+    def pick_blocks(self, peer, count):
+        self.asked.append(count)
+        blocks = [(_Piece(3), self.next_offset + i * BLOCK_SIZE, BLOCK_SIZE) for i in range(count)]
+        self.next_offset += count * BLOCK_SIZE
+        return blocks
+
+
+def test_fill_pipeline_tops_up_to_depth(monkeypatch):
+    conn, _ = _conn(monkeypatch, pipeline_depth=8)
+    scheduler = _Scheduler()
+    asyncio.run(conn._fill_pipeline(scheduler))
+    assert len(conn.inflight) == 8 and len(conn.writer.writes) == 1  # one write for the batch
+    requests = conn.writer.writes[0]
+    assert [struct.unpack_from("!IBIII", requests, i * 17)[1:3] for i in range(8)] == [(REQUEST, 3)] * 8
+
+    conn.inflight.pop((3, 0))
+    conn.inflight.pop((3, BLOCK_SIZE))
+    asyncio.run(conn._fill_pipeline(scheduler))
+    asyncio.run(conn._fill_pipeline(scheduler))  # full: nothing asked
+    assert scheduler.asked == [8, 2] and len(conn.inflight) == 8
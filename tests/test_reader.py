@@ -0,0 +1,61 @@
+"""UploadReader sendfile path: which failures turn zero-copy off for every peer."""
+import asyncio
+import struct
+
+import pytest
+
+from core.messages import PIECE
+from storage.layout import FileLayout
+from storage.reader import UploadReader
+
+from .standins import make_torrent
+
+
+class _Writer:
+    transport = None
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+
+def _reader(tmp_path):
+    data, _, torrent = make_torrent(tmp_path, 100000, 32768)
+    path = str(tmp_path / "payload.bin")
+    with open(path, "wb") as f:
+        f.write(data)
+    reader = UploadReader(FileLayout(torrent, path), zero_copy=True)
+    reader.zero_copy = True  # also where os.sendfile is missing: loop.sendfile is replaced below
+    return data, reader
+
+
+def _send_block(reader, writer, error):
+    async def run():
+        async def sendfile(*args, **kwargs):
+            raise error
+        asyncio.get_running_loop().sendfile = sendfile
+        return await reader.send_block(writer, 1, 0, 16384)
+
+    return asyncio.run(run())
+
+
+def test_closing_transport_keeps_zero_copy(tmp_path):
+    _, reader = _reader(tmp_path)
+    with pytest.raises(ConnectionError):
+        _send_block(reader, _Writer(), RuntimeError("transport is closing"))
+    assert reader.zero_copy
+    reader.close()
+
+
+def test_sendfile_unavailable_falls_back_to_reads(tmp_path):
+    data, reader = _reader(tmp_path)
+    writer = _Writer()
+    assert _send_block(reader, writer, asyncio.SendfileNotAvailableError())
+    assert not reader.zero_copy
+    assert bytes(writer.data) == struct.pack("!IBII", 9 + 16384, PIECE, 1, 0) + data[32768:32768 + 16384]
+    reader.close()
@@ -0,0 +1,97 @@
+"""Fast resume: a matching resume file skips hashing; anything stale falls back to a full recheck."""
+import asyncio
+import os
+
+from engine.downloader import _prepare_storage
+from engine.hasher import HashPool
+from storage.layout import FileLayout
+from storage.resume import load_resume, recheck, resume_path, save_resume
+
+from .standins import make_torrent
+
+PIECE = 16384
+
+
+def _setup(tmp_path, corrupt=()):
+    data, _, torrent = make_torrent(tmp_path, 10 * PIECE + 123, PIECE)
+    path = str(tmp_path / "payload.bin")
+    payload = bytearray(data)
+    for index in corrupt:
+        payload[index * PIECE] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(payload)
+    return torrent, path, FileLayout(torrent, path)
+
+
+def _prepare(torrent, path, layout, calls=None):
+    on_progress = (lambda done, total: calls.append(done)) if calls is not None else None
+
+    async def run():
+        pool = HashPool(threads=2)
+        try:
+            return await _prepare_storage(torrent, layout, path, pool, True, on_progress)
+        finally:
+            pool.close()
+
+    return asyncio.run(run())
+
+
+def test_round_trip(tmp_path):
+    torrent, path, layout = _setup(tmp_path)
+    save_resume(resume_path(path), torrent, {0, 3, 10}, layout.paths())
+    assert load_resume(resume_path(path), torrent, layout.paths()) == {0, 3, 10}
+
+
+def test_matching_resume_skips_recheck(tmp_path):
+    torrent, path, layout = _setup(tmp_path, corrupt=[2])
+    # The resume file is trusted as long as sizes and mtimes match: nothing is hashed.
+    save_resume(resume_path(path), torrent, {1, 2}, layout.paths())
+    calls = []
+    assert _prepare(torrent, path, layout, calls) == {1, 2}
+    assert calls == []
+
+
+def test_stale_mtime_rechecks(tmp_path):
+    torrent, path, layout = _setup(tmp_path, corrupt=[4, 7])
+    save_resume(resume_path(path), torrent, set(range(11)), layout.paths())
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))  # modified since
+    assert load_resume(resume_path(path), torrent, layout.paths()) is None
+    calls = []
+    assert _prepare(torrent, path, layout, calls) == set(range(11)) - {4, 7}
+    assert sorted(calls) == list(range(1, 12))
+
+
+def test_stale_size_rechecks(tmp_path):
+    torrent, path, layout = _setup(tmp_path)
+    save_resume(resume_path(path), torrent, set(range(11)), layout.paths())
+    with open(path, "r+b") as f:
+        f.truncate(5 * PIECE)
+    assert load_resume(resume_path(path), torrent, layout.paths()) is None
+    # The file is sized back to the torrent's length; only the pieces still there are good.
+    assert _prepare(torrent, path, layout) == set(range(5))
+    assert os.path.getsize(path) == torrent.length
+
+
+def test_other_torrent_or_garbage_ignored(tmp_path):
+    torrent, path, layout = _setup(tmp_path)
+    save_resume(resume_path(path), torrent, {1}, layout.paths())
+    other = type(torrent)(meta=torrent.meta, info=torrent.info, info_hash=b"x" * 20)
+    assert load_resume(resume_path(path), other, layout.paths()) is None
+    with open(resume_path(path), "wb") as f:
+        f.write(b"d7:versioni1e")  # truncated
+    assert load_resume(resume_path(path), torrent, layout.paths()) is None
+    assert load_resume(str(tmp_path / "missing.resume"), torrent, layout.paths()) is None
+
+
+def test_recheck_finds_good_pieces(tmp_path):
+    torrent, path, layout = _setup(tmp_path, corrupt=[0, 10])
+
+    async def run():
+        pool = HashPool(threads=2)
+        try:
+            return await recheck(torrent, layout, pool)
+        finally:
+            pool.close()
+
+    assert asyncio.run(run()) == set(range(1, 10))
@@ -0,0 +1,40 @@
+"""One-shot get_peers: the tiers still announcing are stopped before the clients are closed."""
+import asyncio
+
+from core.torrent import Torrent
+from trackers.router import get_peers
+
+from .standins import HTTPTrackerStandIn, server_port
+
+PEER_ID = b"-PC0001-" + b"r" * 12
+PEERS = [("10.0.0.1", 6881)]
+
+
+def test_get_peers_leaves_no_announce_running():
+    async def run():
+        fast = await HTTPTrackerStandIn(PEERS).start()
+        hung = asyncio.Event()
+
+        async def never_answer(reader, writer):
+            await hung.wait()
+            writer.close()
+
+        slow = await asyncio.start_server(never_answer, "127.0.0.1", 0)
+        slow_url = f"http://127.0.0.1:{server_port(slow)}/announce".encode()
+        info = {b"name": b"x", b"length": 1, b"piece length": 16384, b"pieces": b"\0" * 20}
+        meta = {b"announce-list": [[slow_url], [fast.url.encode()]], b"info": info}
+        torrent = Torrent(meta=meta, info=info, info_hash=b"h" * 20)
+        try:
+            peers = await asyncio.wait_for(get_peers(torrent, PEER_ID), 5)
+            running = [
+                task for task in asyncio.all_tasks()
+                if "_announce_tier" in task.get_coro().__qualname__ and not task.done()
+            ]
+            return peers, running
+        finally:
+            hung.set()
+            fast.close()
+            slow.close()
+
+    peers, running = asyncio.run(run())
+    assert peers == PEERS and running == []
@@ -0,0 +1,89 @@
+"""Session: one connection per peer, recognised by peer ID whichever side dialled."""
+import asyncio
+import socket
+
+from engine.session import STATE_DOWNLOADING, STATE_SEEDING, Session
+from extensions.handshake import build_handshake
+
+from .standins import make_torrent, server_port
+
+OTHER_ID = b"-XX0001-" + b"o" * 12
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _dial(port, info_hash, peer_id):
+    """Connect and handshake as peer_id; True if the session answered with its handshake."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(build_handshake(info_hash, peer_id))
+    await writer.drain()
+    try:
+        await asyncio.wait_for(reader.readexactly(68), 5)
+        return True, writer
+    except asyncio.IncompleteReadError:
+        writer.close()
+        return False, None
+
+
+async def _wait_for(predicate):
+    for _ in range(200):
+        if predicate():
+            return
+        await asyncio.sleep(0.025)
+    raise AssertionError("condition not reached")
+
+
+def _session():
+    return Session(port=_free_port(), use_dht=False)
+
+
+def test_inbound_duplicate_peer_id_rejected(tmp_path):
+    async def run():
+        data, _, torrent = make_torrent(tmp_path, 64 * 1024, 16384)
+        path = str(tmp_path / "payload.bin")
+        with open(path, "wb") as f:
+            f.write(data)
+        async with _session() as session:
+            handle = session.add_torrent(torrent, path)
+            await _wait_for(lambda: handle.state == STATE_SEEDING)
+            first, writer = await _dial(session.port, torrent.info_hash, OTHER_ID)
+            # Same peer again from another source port.
+            second, _ = await _dial(session.port, torrent.info_hash, OTHER_ID)
+            third, other = await _dial(session.port, torrent.info_hash, b"-XX0001-" + b"t" * 12)
+            writer.close()
+            other.close()
+            return first, second, third, session.inbound_rejected
+
+    assert asyncio.run(run()) == (True, False, True, 1)
+
+
+def test_inbound_from_peer_already_connected_outbound(tmp_path):
+    async def run():
+        _, _, torrent = make_torrent(tmp_path, 64 * 1024, 16384)
+
+        async def peer(reader, writer):
+            # Handshakes, then neither has pieces nor unchokes: the connection just stays up.
+            await reader.readexactly(68)
+            writer.write(build_handshake(torrent.info_hash, OTHER_ID))
+            await writer.drain()
+            while await reader.read(65536):
+                pass
+
+        server = await asyncio.start_server(peer, "127.0.0.1", 0)
+        try:
+            async with _session() as session:
+                handle = session.add_torrent(
+                    torrent, str(tmp_path / "out.bin"), peers=[("127.0.0.1", server_port(server))],
+                )
+                await _wait_for(lambda: OTHER_ID in handle.peer_ids)
+                assert handle.state == STATE_DOWNLOADING
+                accepted, _ = await _dial(session.port, torrent.info_hash, OTHER_ID)
+                return accepted, session.inbound_rejected, handle.connections
+        finally:
+            server.close()
+
+    assert asyncio.run(run()) == (False, 1, 1)
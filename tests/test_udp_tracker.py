@@ -0,0 +1,154 @@
+"""UDP tracker client (BEP 15) against a local stand-in tracker that can lose datagrams."""
+import asyncio
+import os
+import socket
+import time
+
+import pytest
+
+from trackers import udp_tracker
+from trackers.udp_tracker import MAX_SCRAPE, UDPTrackerClient, UDPTrackerError
+
+from .standins import UDPTrackerStandIn
+
+INFO_HASH = b"i" * 20
+PEER_ID = b"-PC0001-" + b"p" * 12
+PEERS = [("10.0.0.1", 6881)]
+
+
+def _run(coro_fn, **standin_args):
+    async def run():
+        standin = await UDPTrackerStandIn(PEERS, **standin_args).start()
+        client = UDPTrackerClient(retransmit_base=0.05)
+        try:
+            return await coro_fn(client, standin)
+        finally:
+            client.close()
+            standin.close()
+
+    return asyncio.run(run())
+
+
+def _expected(info_hash):
+    return {"seeders": info_hash[0], "completed": info_hash[1], "leechers": info_hash[2]}
+
+
+def test_retransmits_lost_datagrams():
+    async def announce(client, standin):
+        return await client.announce(standin.url, INFO_HASH, PEER_ID, 6881), client.stats()
+
+    # The first connect and its retransmission are lost; the third datagram gets through.
+    result, stats = _run(announce, drop=2)
+    assert result["peers"] == PEERS
+    assert result["interval"] == 1800 and result["seeders"] == 1 and result["leechers"] == 2
+    assert stats["retransmits"] == 2
+
+
+def test_gives_up_after_max_retransmits():
+    async def announce(client, standin):
+        client.max_retransmits = 2
+        with pytest.raises(asyncio.TimeoutError):
+            await client.announce(standin.url, INFO_HASH, PEER_ID, 6881)
+        return client.stats(), standin.received
+
+    stats, received = _run(announce, drop=100)
+    assert stats["retransmits"] == 2
+    assert received == 3
+
+
+def test_connection_id_cached_until_expiry(monkeypatch):
+    monkeypatch.setattr(udp_tracker, "CONNECTION_ID_LIFETIME", 0.3)
+
+    async def announce(client, standin):
+        for _ in range(3):
+            await client.announce(standin.url, INFO_HASH, PEER_ID, 6881)
+        cached = client.stats()
+        await asyncio.sleep(0.4)
+        await client.announce(standin.url, INFO_HASH, PEER_ID, 6881)
+        return cached, client.stats(), [action for action, _ in standin.log]
+
+    cached, expired, actions = _run(announce)
+    assert cached["connects"] == 1 and cached["connection_id_hits"] == 2
+    assert expired["connects"] == 2
+    assert actions == [0, 1, 1, 1, 0, 1]
+
+
+def test_concurrent_requests_share_one_connect():
+    async def announce(client, standin):
+        await asyncio.gather(*(client.announce(standin.url, INFO_HASH, PEER_ID, 6881) for _ in range(5)))
+        return client.stats()
+
+    assert _run(announce)["connects"] == 1
+
+
+def test_rejected_connection_id_reconnects():
+    async def announce(client, standin):
+        await client.announce(standin.url, INFO_HASH, PEER_ID, 6881)
+        standin.expire()
+        with pytest.raises(UDPTrackerError):
+            await client.announce(standin.url, INFO_HASH, PEER_ID, 6881)
+        result = await client.announce(standin.url, INFO_HASH, PEER_ID, 6881)
+        return result, client.stats()
+
+    result, stats = _run(announce)
+    assert result["peers"] == PEERS
+    assert stats["connects"] == 2 and stats["errors"] == 1
+
+
+def test_scrape_batches_74_hashes_per_packet():
+    hashes = [os.urandom(20) for _ in range(200)]
+
+    async def scrape(client, standin):
+        return await client.scrape(standin.url, hashes + hashes[:10]), standin.log, client.scrapes
+
+    results, log, kept = _run(scrape)
+    assert sorted(n for action, n in log if action == 2) == [52, MAX_SCRAPE, MAX_SCRAPE]
+    assert [action for action, _ in log].count(0) == 1
+    assert set(results) == set(hashes)
+    for info_hash, result in results.items():
+        assert {k: result[k] for k in ("seeders", "completed", "leechers")} == _expected(info_hash)
+    assert set(kept) == set(hashes)
+
+
+def test_scrape_keeps_answered_batches():
+    hashes = [os.urandom(20) for _ in range(200)]
+
+    async def scrape(client, standin):
+        started = time.monotonic()
+        results = await client.scrape(standin.url, hashes, timeout=0.5)
+        return results, time.monotonic() - started
+
+    # The second packet (hashes 74..147) is never answered.
+    results, elapsed = _run(scrape, silent_hashes=[hashes[100]])
+    assert set(results) == set(hashes[:74] + hashes[148:])
+    for info_hash, result in results.items():
+        assert {k: result[k] for k in ("seeders", "completed", "leechers")} == _expected(info_hash)
+    assert elapsed < 2
+
+
+def test_scrape_raises_when_no_batch_answered():
+    async def scrape(client, standin):
+        return await client.scrape(standin.url, [INFO_HASH], timeout=0.3)
+
+    with pytest.raises(asyncio.TimeoutError):
+        _run(scrape, silent_hashes=[INFO_HASH])
+
+
+def test_silent_tracker_gives_up_at_caller_timeout():
+    async def run():
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(("127.0.0.1", 0))
+        client = UDPTrackerClient()  # default 15 s retransmission schedule
+        url = "udp://127.0.0.1:%d/announce" % silent.getsockname()[1]
+        started = time.monotonic()
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await client.announce(url, INFO_HASH, PEER_ID, 6881, timeout=0.3)
+            with pytest.raises(asyncio.TimeoutError):
+                await client.scrape(url, [INFO_HASH], timeout=0.3)
+        finally:
+            client.close()
+            silent.close()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 2
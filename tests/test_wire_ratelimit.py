@@ -0,0 +1,81 @@
+"""Download rate limits on the BufferedProtocol wire transport."""
+import asyncio
+import struct
+
+from core.messages import PIECE
+from core.peer_connection import PeerConnection
+from core.wire import WireProtocol
+from engine.downloader import _run_download
+from engine.ratelimit import RateLimits
+
+from .standins import make_torrent, serve_seed, server_port
+
+
+class _Transport:
+    def __init__(self):
+        self.paused = False
+
+    def pause_reading(self):
+        self.paused = True
+
+    def resume_reading(self):
+        self.paused = False
+
+    def get_extra_info(self, name, default=None):
+        return default
+
+
+def _deliver(protocol, data):
+    buf = protocol.get_buffer(len(data))
+    buf[:len(data)] = data
+    protocol.buffer_updated(len(data))
+
+
+def _piece(begin, fill):
+    block = fill * 16384
+    return struct.pack("!IBII", 9 + len(block), PIECE, 0, begin) + block
+
+
+def test_throttled_recv_pauses_reading_and_keeps_payloads():
+    async def run():
+        transport = _Transport()
+        wire = WireProtocol(expect_handshake=False)
+        wire.connection_made(transport)
+        conn = PeerConnection(wire, wire)
+        conn.limits = RateLimits(download=64 * 1024).peer()
+        conn.limits.download.consume(256 * 1024)  # deep in debt: the next charge has to wait
+
+        _deliver(wire, _piece(0, b"A"))
+        task = asyncio.ensure_future(conn.recv())
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        assert transport.paused
+        # Bytes already on their way still land in the buffer while the charge waits.
+        _deliver(wire, _piece(16384, b"B"))
+
+        messages = await asyncio.wait_for(task, 10)
+        assert [msg_id for msg_id, _ in messages] == [PIECE, PIECE]
+        assert bytes(messages[0][1][8:]) == b"A" * 16384
+        assert bytes(messages[1][1][8:]) == b"B" * 16384
+
+    asyncio.run(run())
+
+
+def test_wire_download_with_limit_completes(tmp_path):
+    async def run():
+        data, _, torrent = make_torrent(tmp_path, 3 * 1024 * 1024 + 4321, 32768)
+        seeds = [await serve_seed(data, torrent) for _ in range(4)]
+        out = str(tmp_path / "out.bin")
+        try:
+            result = await asyncio.wait_for(_run_download(
+                torrent, [("127.0.0.1", server_port(s)) for s in seeds], b"-PC0001-" + b"t" * 12, out, 4,
+                wire_protocol=True, rate_limits=RateLimits(download=2 * 1024 * 1024), resume=False,
+            ), 30)
+        finally:
+            for seed in seeds:
+                seed.close()
+        assert result == out
+        with open(out, "rb") as f:
+            assert f.read() == data
+
+    asyncio.run(run())
@@ -0,0 +1,46 @@
+"""Peer worker: completed pieces that never reach the disk writer go back to the schedule."""
+import asyncio
+
+from core.piece_manager import PieceManager
+from engine.worker import run_worker
+
+from .standins import make_torrent, serve_seed, server_port
+
+PEER_ID = b"-PC0001-" + b"w" * 12
+
+
+class _BrokenHashPool:
+    async def verify(self, piece):
+        raise RuntimeError("hash thread died")
+
+    def close(self):
+        pass
+
+
+def test_unwritten_pieces_return_to_schedule(tmp_path):
+    async def run():
+        data, _, torrent = make_torrent(tmp_path, 256 * 1024 + 100, 32768)
+        seed = await serve_seed(data, torrent)
+        out = str(tmp_path / "out.bin")
+        manager = PieceManager(torrent, out)
+        try:
+            try:
+                await run_worker(
+                    "127.0.0.1", server_port(seed), torrent, PEER_ID, manager,
+                    download_path=out, hash_pool=_BrokenHashPool(),
+                )
+            except RuntimeError:
+                pass
+            # Only started pieces stay in progress (their blocks wait for the next peer).
+            assert manager.in_progress == set(manager.active) and not manager.completed
+            # Another worker can take every piece again and finish the download.
+            await asyncio.wait_for(
+                run_worker("127.0.0.1", server_port(seed), torrent, PEER_ID, manager, download_path=out), 30,
+            )
+        finally:
+            seed.close()
+        assert manager.is_done()
+        with open(out, "rb") as f:
+            assert f.read() == data
+
+    asyncio.run(run())
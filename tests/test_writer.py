@@ -0,0 +1,117 @@
+"""DiskWriter: adjacent pieces coalesced into one write, fsync per policy, errors reach the caller."""
+import asyncio
+import threading
+
+import pytest
+
+from storage.writer import FSYNC_ALWAYS, FSYNC_CLOSE, FSYNC_INTERVAL, FSYNC_NEVER, DiskWriter
+
+
+class _Layout:
+    def __init__(self, fail_at=None):
+        self.writes = []  # (offset, [buffer lengths])
+        self.fail_at = fail_at
+
+    def paths(self):
+        return ["a.bin", "b.bin"]
+
+    def write(self, pool, buffers, offset):
+        if offset == self.fail_at:
+            raise OSError(28, "No space left on device")
+        self.writes.append((offset, [len(b) for b in buffers]))
+
+
+class _Pool:
+    def __init__(self):
+        self.synced = []
+        self.closed = []
+
+    def fsync(self, path=None):
+        self.synced.append(path)
+
+    def close(self, path=None):
+        self.closed.append(path)
+
+
+def _run(items, **kwargs):
+    """Queue (offset, length) writes back to back, close the writer; returns layout, pool, writer."""
+    layout = kwargs.pop("layout", None) or _Layout()
+    pool = _Pool()
+
+    async def run():
+        writer = DiskWriter(layout, pool=pool, **kwargs)
+        done = [await writer.write(offset, b"x" * length) for offset, length in items]
+        await writer.flush()
+        results = await asyncio.gather(*done, return_exceptions=True)
+        await writer.close()
+        return writer, results
+
+    writer, results = asyncio.run(run())
+    return layout, pool, writer, results
+
+
+def test_adjacent_pieces_coalesced():
+    layout, _, writer, _ = _run([(20, 10), (0, 10), (50, 10), (10, 10), (60, 5)])
+    assert sorted(layout.writes) == [(0, [10, 10, 10]), (50, [10, 5])]
+    assert writer.writes == 5 and writer.batches == 2 and writer.bytes_written == 45
+
+
+def test_coalescing_limit():
+    layout, _, _, _ = _run([(i * 10, 10) for i in range(5)], coalesce_limit=25)
+    assert sorted(layout.writes) == [(0, [10, 10]), (20, [10, 10]), (40, [10])]
+
+
+@pytest.mark.parametrize("policy, during_writes", [
+    (FSYNC_NEVER, 0), (FSYNC_CLOSE, 0), (FSYNC_ALWAYS, 2), (FSYNC_INTERVAL, 0),
+])
+def test_fsync_policy(policy, during_writes):
+    layout, pool, _, _ = _run([(0, 10), (100, 10)], fsync=policy, fsync_interval=3600)
+    at_close = 0 if policy == FSYNC_NEVER else 1
+    # A shared pool: only this torrent's files are synced and closed.
+    assert pool.synced == ["a.bin", "b.bin"] * (during_writes + at_close)
+    assert pool.closed == ["a.bin", "b.bin"]
+
+
+def test_fsync_interval_elapsed():
+    _, pool, _, _ = _run([(0, 10)], fsync=FSYNC_INTERVAL, fsync_interval=0.0)
+    assert pool.synced == ["a.bin", "b.bin"] * 2  # after the batch, then at close
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        DiskWriter(_Layout(), pool=_Pool(), fsync="sometimes")
+
+
+def test_write_error_reaches_every_piece_of_the_batch():
+    _, _, writer, results = _run([(0, 10), (10, 10), (50, 10)], layout=_Layout(fail_at=0))
+    assert [type(r) for r in results] == [OSError, OSError, type(None)]
+    assert writer.errors == 1 and writer.writes == 1
+
+
+class _SlowLayout(_Layout):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def write(self, pool, buffers, offset):
+        self.release.wait(5)
+        super().write(pool, buffers, offset)
+
+
+def test_full_queue_applies_backpressure():
+    async def run():
+        layout = _SlowLayout()
+        writer = DiskWriter(layout, pool=_Pool(), max_queue=1, threads=1)
+        await writer.write(0, b"x")
+        await asyncio.sleep(0.05)  # the only thread is stuck on the first batch
+        await writer.write(10, b"x")
+        assert writer.full()
+        blocked = asyncio.ensure_future(writer.write(20, b"x"))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        layout.release.set()
+        await asyncio.wait_for(blocked, 5)
+        await writer.close()
+        return layout.writes
+
+    assert asyncio.run(run()) == [(0, [1]), (10, [1]), (20, [1])]
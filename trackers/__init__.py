@@ -1,6 +1,16 @@
 """
-Tracker layer: HTTP and UDP announce, single router.
+Tracker layer: HTTP and UDP announce, announce-list tiers and re-announce scheduling, router.
 """
-from .router import get_peers
+from .announcer import Announcer, EVENT_COMPLETED, EVENT_STARTED, EVENT_STOPPED
+from .http_client import HTTPClient
+from .router import TrackerClient, get_peers
 
-__all__ = ["get_peers"]
+__all__ = [
+    "Announcer",
+    "EVENT_COMPLETED",
+    "EVENT_STARTED",
+    "EVENT_STOPPED",
+    "HTTPClient",
+    "TrackerClient",
+    "get_peers",
+]
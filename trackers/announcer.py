@@ -0,0 +1,273 @@
+"""
+Per-torrent announcer over the BEP 12 announce-list: every tier is announced in parallel and
+the first answer is returned right away (later tiers' peers go to on_peers). Within a tier the
+URLs are tried in order and the one that answers moves to the front.
+
+Each tier then re-announces on its own schedule: after the tracker's interval, never earlier
+than its min interval when asked for peers early (reannounce()), and with exponential backoff
+after failures. A tier's first announce carries event=started; completed() and stop() send the
+completed and stopped events. Transfer counters come from the counters callable.
+"""
+import asyncio
+import random
+import time
+from urllib.parse import urlparse
+
+from .http_client import HTTPClient
+from .http_tracker import HTTPTracker
+from .udp_tracker import UDPTracker, UDPTrackerClient
+
+EVENT_STARTED = "started"
+EVENT_COMPLETED = "completed"
+EVENT_STOPPED = "stopped"
+
+DEFAULT_INTERVAL = 1800.0
+MIN_INTERVAL = 30.0  # floor for whatever interval a tracker asks for
+RETRY_BASE = 60.0  # seconds after a tier's first failure, doubled per further failure
+RETRY_MAX = 1800.0
+ANNOUNCE_TIMEOUT = 15
+UDP_ANNOUNCE_TIMEOUT = 60  # leaves room for BEP 15 retransmissions (sent at 15 s and 45 s)
+STOP_TIMEOUT = 5
+
+
+class TrackerTier:
+    def __init__(self, urls):
+        self.urls = list(urls)
+        random.shuffle(self.urls)  # BEP 12: shuffle each tier once
+        self.interval = DEFAULT_INTERVAL
+        self.min_interval = None
+        self.next_announce = 0.0
+        self.last_announce = None
+        self.started = False  # a started event was accepted by this tier
+        self.event = None  # event still to be sent with the next announce (completed)
+        self.busy = False
+        self.announces = 0
+        self.failures = 0  # consecutive
+        self.error = None
+        self.seeders = None
+        self.leechers = None
+
+    def succeeded(self, result, event, now):
+        self.announces += 1
+        self.failures = 0
+        self.error = None
+        self.last_announce = now
+        if event == EVENT_STARTED:
+            self.started = True
+        if event == self.event:
+            self.event = None
+        self.min_interval = result.get("min_interval")
+        self.interval = max(result.get("interval") or DEFAULT_INTERVAL, self.min_interval or 0, MIN_INTERVAL)
+        self.next_announce = now + self.interval
+        self.seeders = result.get("seeders")
+        self.leechers = result.get("leechers")
+
+    def failed(self, now):
+        self.failures += 1
+        self.next_announce = now + min(RETRY_MAX, RETRY_BASE * 2 ** (self.failures - 1))
+
+    def earliest(self):
+        """Earliest time a regular announce may go out without violating min interval."""
+        if self.last_announce is None:
+            return 0.0
+        return self.last_announce + (self.min_interval or MIN_INTERVAL)
+
+    def stats(self, now):
+        return {
+            "urls": list(self.urls),
+            "started": self.started,
+            "interval": self.interval,
+            "min_interval": self.min_interval,
+            "next_announce": max(0.0, self.next_announce - now),
+            "announces": self.announces,
+            "failures": self.failures,
+            "error": self.error,
+            "seeders": self.seeders,
+            "leechers": self.leechers,
+        }
+
+
+class Announcer:
+    def __init__(self, torrent, peer_id, port=6881, client=None, counters=None, on_peers=None):
+        """
+        client: the session's trackers.TrackerClient (shared HTTP pool, UDP socket and announce
+        limit); without one the announcer uses a private HTTPClient and UDPTrackerClient.
+        counters(): dict with uploaded, downloaded and left byte counts for the announces.
+        on_peers(peers): receives the peers of every successful announce.
+        """
+        self.torrent = torrent
+        self.peer_id = peer_id
+        self.port = port
+        self.client = client
+        self.http = client.http if client is not None else HTTPClient()
+        self.udp = client.udp if client is not None else UDPTrackerClient()
+        self.counters = counters
+        self.on_peers = on_peers
+        self.tiers = [TrackerTier(urls) for urls in torrent.announce_list]
+        self._trackers = {}  # url -> HTTPTracker / UDPTracker (keeps tracker ids)
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+
+    def _tracker(self, url):
+        tracker = self._trackers.get(url)
+        if tracker is None:
+            scheme = urlparse(url).scheme
+            if scheme == "udp":
+                tracker = UDPTracker(url, self.udp)
+            elif scheme in ("http", "https"):
+                tracker = HTTPTracker(url, self.http)
+            else:
+                raise RuntimeError(f"Unsupported tracker protocol: {scheme}")
+            self._trackers[url] = tracker
+        return tracker
+
+    def _counters(self):
+        if self.counters is not None:
+            return self.counters()
+        return {"uploaded": 0, "downloaded": 0, "left": self.torrent.length}
+
+    async def _send(self, url, event, counters):
+        tracker = self._tracker(url)
+        coro = tracker.announce(self.torrent.info_hash, self.peer_id, self.port, event=event, **counters)
+        timeout = UDP_ANNOUNCE_TIMEOUT if isinstance(tracker, UDPTracker) else ANNOUNCE_TIMEOUT
+        if self.client is None:
+            return await asyncio.wait_for(coro, timeout=timeout)
+        async with self.client.slots():
+            self.client.announces += 1
+            try:
+                return await asyncio.wait_for(coro, timeout=timeout)
+            except Exception:
+                self.client.failures += 1
+                raise
+
+    async def _announce_tier(self, tier, event):
+        if not tier.started and event != EVENT_STOPPED:
+            event = EVENT_STARTED
+        elif event is None:
+            event = tier.event
+        counters = self._counters()
+        for url in list(tier.urls):
+            try:
+                result = await self._send(url, event, counters)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                tier.error = f"{url}: {e}"
+                continue
+            tier.urls.remove(url)
+            tier.urls.insert(0, url)  # BEP 12: a tracker that answers moves to the front
+            tier.succeeded(result, event, time.monotonic())
+            return result
+        tier.failed(time.monotonic())
+        raise RuntimeError(tier.error or "No tracker in tier")
+
+    def _start(self, tiers, event=None):
+        tasks = []
+        for tier in tiers:
+            tier.busy = True
+            task = asyncio.create_task(self._announce_tier(tier, event))
+            task.add_done_callback(lambda t, tier=tier: self._finished(tier, t))
+            self._tasks.add(task)
+            tasks.append(task)
+        return tasks
+
+    def _finished(self, tier, task):
+        self._tasks.discard(task)
+        tier.busy = False
+        self._wakeup.set()
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.on_peers is not None:
+            self.on_peers(task.result()["peers"])
+
+    async def announce(self, event=None):
+        """
+        Announce to every tier now (tiers with an announce in flight are skipped) and return the
+        peers of the first tier that answers; the others keep going in the background.
+        """
+        tasks = self._start([tier for tier in self.tiers if not tier.busy], event)
+        if not tasks:
+            raise RuntimeError("No trackers")
+        error = None
+        for fut in asyncio.as_completed(tasks):
+            try:
+                return (await fut)["peers"]
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+        raise RuntimeError(f"All trackers failed: {error}")
+
+    async def run(self):
+        """Re-announce each tier when it is due until cancelled (the first round sends started)."""
+        while True:
+            now = time.monotonic()
+            self._start([tier for tier in self.tiers if not tier.busy and tier.next_announce <= now])
+            waits = [tier.next_announce for tier in self.tiers if not tier.busy]
+            self._wakeup.clear()
+            timeout = max(0.0, min(waits) - now) if waits else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def reannounce(self):
+        """
+        Ask for peers early: each tier announces as soon as its min interval allows (tiers that
+        are failing keep their retry backoff).
+        """
+        now = time.monotonic()
+        for tier in self.tiers:
+            if not tier.failures:
+                tier.next_announce = min(tier.next_announce, max(now, tier.earliest()))
+        self._wakeup.set()
+
+    def busy(self):
+        """True while an announce is in flight or due (run() is about to send it)."""
+        now = time.monotonic()
+        return any(tier.busy or tier.next_announce <= now for tier in self.tiers)
+
+    def completed(self):
+        """The download finished: tiers that got started send completed with their next announce, now."""
+        for tier in self.tiers:
+            if tier.started:
+                tier.event = EVENT_COMPLETED
+                tier.next_announce = 0.0
+        self._wakeup.set()
+
+    async def _settle(self, tasks):
+        if tasks:
+            await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def cancel(self):
+        """Cancel the announces in flight and wait for them to end."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stop(self):
+        """
+        Shut down (cancel run() first): let announces in flight finish, deliver a pending
+        completed event, then send stopped to every started tier; each step waits STOP_TIMEOUT
+        at most.
+        """
+        await self._settle(list(self._tasks))
+        await self._settle(self._start(
+            [tier for tier in self.tiers if tier.started and tier.event == EVENT_COMPLETED],
+        ))
+        await self._settle(self._start([tier for tier in self.tiers if tier.started], EVENT_STOPPED))
+        self.close()
+
+    def close(self):
+        """Close the private HTTP and UDP clients (nothing when running on a TrackerClient)."""
+        if self.client is None:
+            self.http.close()
+            self.udp.close()
+
+    def stats(self):
+        now = time.monotonic()
+        return {"tiers": [tier.stats(now) for tier in self.tiers]}
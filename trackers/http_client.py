@@ -0,0 +1,206 @@
+"""
+Minimal asyncio HTTP/1.1 client for tracker announces: GET only, with keep-alive connections
+pooled per (scheme, host, port), so periodic re-announces to the same tracker reuse one TCP (and
+TLS) connection instead of opening a new one each time. Bodies are read by Content-Length,
+chunked transfer encoding, or until EOF when the server closes the connection after the response
+(such a connection is not reused). 1xx, 204 and 304 responses, and responses without framing on
+a connection kept alive, have no body (RFC 9112, 6.3): reading one to EOF would hang.
+"""
+import asyncio
+import ssl
+import time
+from urllib.parse import urlsplit
+
+USER_AGENT = "PythonTorrent/1.0"
+MAX_IDLE_PER_HOST = 2
+IDLE_TIMEOUT = 60.0  # seconds a pooled connection may sit unused
+MAX_BODY = 4 * 1024 * 1024
+
+
+class HTTPError(Exception):
+    pass
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+    def usable(self):
+        return not self.writer.is_closing() and time.monotonic() - self.last_used < IDLE_TIMEOUT
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class HTTPClient:
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST, user_agent=USER_AGENT):
+        self.max_idle_per_host = max_idle_per_host
+        self.user_agent = user_agent
+        self._idle = {}  # (scheme, host, port) -> [_Connection]
+        self._ssl = None
+        self.requests = 0
+        self.connections_opened = 0
+        self.reused = 0
+
+    def _ssl_context(self):
+        if self._ssl is None:
+            self._ssl = ssl.create_default_context()
+        return self._ssl
+
+    async def _connect(self, scheme, host, port):
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self._ssl_context() if scheme == "https" else None,
+        )
+        self.connections_opened += 1
+        return _Connection(reader, writer)
+
+    def _take_idle(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            conn = idle.pop()
+            if conn.usable():
+                return conn
+            conn.close()
+        return None
+
+    def _put_idle(self, key, conn):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) >= self.max_idle_per_host:
+            conn.close()
+            return
+        conn.last_used = time.monotonic()
+        idle.append(conn)
+
+    async def get(self, url, timeout=15):
+        """GET url; returns (status, headers with lower-case names, body bytes)."""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise HTTPError(f"Unsupported scheme: {scheme}")
+        host = parts.hostname
+        port = parts.port or (443 if scheme == "https" else 80)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        host_header = host if parts.port is None else f"{host}:{port}"
+        request = (
+            f"GET {target} HTTP/1.1\r\nHost: {host_header}\r\nUser-Agent: {self.user_agent}\r\n"
+            "Accept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n"
+        ).encode()
+        key = (scheme, host, port)
+        self.requests += 1
+        return await asyncio.wait_for(self._request(key, request), timeout=timeout)
+
+    async def _request(self, key, request):
+        conn = self._take_idle(key)
+        if conn is not None:
+            self.reused += 1
+            try:
+                return await self._exchange(key, conn, request)
+            except (ConnectionError, asyncio.IncompleteReadError, HTTPError):
+                # The server may have closed the idle connection just before we reused it.
+                pass
+        return await self._exchange(key, await self._connect(*key), request)
+
+    async def _exchange(self, key, conn, request):
+        try:
+            conn.writer.write(request)
+            await conn.writer.drain()
+            status, headers, body, keep_alive = await self._read_response(conn.reader)
+        except BaseException:
+            conn.close()
+            raise
+        conn.requests += 1
+        if keep_alive:
+            self._put_idle(key, conn)
+        else:
+            conn.close()
+        return status, headers, body
+
+    async def _read_response(self, reader):
+        status, headers, keep_alive = await self._read_head(reader)
+        while 100 <= status < 200:
+            # Interim response (100 Continue, 103 Early Hints): the real one follows.
+            status, headers, keep_alive = await self._read_head(reader)
+        if status in (204, 304):
+            body = b""
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if length > MAX_BODY:
+                raise HTTPError("Response too large")
+            body = await reader.readexactly(length)
+        elif keep_alive:
+            body = b""  # no framing and the server keeps the connection: nothing to read
+        else:
+            body = await self._read_to_eof(reader)
+        return status, headers, body, keep_alive
+
+    async def _read_head(self, reader):
+        """Status line and headers: (status, headers, whether the connection stays open)."""
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed")
+        parts = status_line.decode("latin-1").split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise HTTPError(f"Bad status line: {status_line[:80]!r}")
+        version, status = parts[0], int(parts[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if not line:
+                raise ConnectionError("Connection closed in headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return status, headers, keep_alive
+
+    async def _read_to_eof(self, reader):
+        body = bytearray()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return bytes(body)
+            if len(body) + len(data) > MAX_BODY:
+                raise HTTPError("Response too large")
+            body += data
+
+    async def _read_chunked(self, reader):
+        body = bytearray()
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                raise ConnectionError("Connection closed in chunked body")
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Trailers, then the blank line ending the message.
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return bytes(body)
+            if len(body) + size > MAX_BODY:
+                raise HTTPError("Response too large")
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+
+    def close(self):
+        """Close every pooled connection."""
+        for idle in self._idle.values():
+            for conn in idle:
+                conn.close()
+        self._idle.clear()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "reused": self.reused,
+            "idle": sum(len(idle) for idle in self._idle.values()),
+        }
@@ -1,35 +1,86 @@
-import asyncio
+"""
+HTTP(S) tracker announce (BEP 3, compact peers from BEP 23) over a shared keep-alive HTTPClient.
+"""
+import socket
+import struct
 from urllib.parse import quote
-from urllib.request import Request, urlopen
 
 from core.bencode import decode
+from .http_client import HTTPClient
+
+NUMWANT = 50
+
+
+def parse_compact_peers(data):
+    """(ip, port) list from compact IPv4 peers: 4-byte address + 2-byte port each."""
+    return [
+        (socket.inet_ntoa(data[i:i + 4]), struct.unpack("!H", data[i + 4:i + 6])[0])
+        for i in range(0, len(data) - 5, 6)
+    ]
+
+
+def parse_compact_peers6(data):
+    return [
+        (socket.inet_ntop(socket.AF_INET6, data[i:i + 16]), struct.unpack("!H", data[i + 16:i + 18])[0])
+        for i in range(0, len(data) - 17, 18)
+    ]
+
+
+def parse_announce_response(data):
+    """
+    Decode a bencoded announce response into a dict: peers, interval, min_interval, seeders,
+    leechers, tracker_id, warning. Raises RuntimeError with the tracker's failure reason.
+    """
+    response = decode(data)
+    if b"failure reason" in response:
+        raise RuntimeError(response[b"failure reason"].decode("utf-8", "replace"))
+    peers_field = response.get(b"peers", b"")
+    if isinstance(peers_field, bytes):
+        peers = parse_compact_peers(peers_field)
+    else:
+        peers = [(p[b"ip"].decode(), p[b"port"]) for p in peers_field if b"ip" in p and b"port" in p]
+    peers += parse_compact_peers6(response.get(b"peers6", b""))
+    warning = response.get(b"warning message")
+    tracker_id = response.get(b"tracker id")
+    return {
+        "peers": peers,
+        "interval": response.get(b"interval"),
+        "min_interval": response.get(b"min interval"),
+        "seeders": response.get(b"complete"),
+        "leechers": response.get(b"incomplete"),
+        "tracker_id": tracker_id,
+        "warning": warning.decode("utf-8", "replace") if warning else None,
+    }
 
 
 class HTTPTracker:
-    def __init__(self, torrent, peer_id, port=6881):
-        self.torrent = torrent
-        self.peer_id = peer_id
-        self.port = port
-
-    def _get_peers_sync(self):
-        q = (
-            f"info_hash={quote(self.torrent.info_hash, safe='')}"
-            f"&peer_id={quote(self.peer_id, safe='')}"
-            f"&port={self.port}&uploaded=0&downloaded=0&left={self.torrent.length}&compact=1"
+    """One HTTP(S) tracker URL; keeps the tracker id it hands out for later announces."""
+
+    def __init__(self, url, client=None):
+        self.url = url
+        self.client = client or HTTPClient()
+        self.tracker_id = None
+
+    async def announce(
+        self, info_hash, peer_id, port, uploaded=0, downloaded=0, left=0, event=None,
+        numwant=NUMWANT, timeout=15,
+    ):
+        """Announce and return the parsed response (see parse_announce_response)."""
+        query = (
+            f"info_hash={quote(info_hash, safe='')}"
+            f"&peer_id={quote(peer_id, safe='')}"
+            f"&port={port}&uploaded={uploaded}&downloaded={downloaded}&left={left}"
+            f"&compact=1&no_peer_id=1&numwant={numwant}"
         )
-        url = self.torrent.announce + ('&' if '?' in self.torrent.announce else '?') + q
-        req = Request(url, headers={"User-Agent": "PythonTorrent/1.0"})
-        with urlopen(req, timeout=15) as resp:
-            data = resp.read()
-        response = decode(data)
-        peers_bin = response[b'peers']
-        peers = []
-        for i in range(0, len(peers_bin), 6):
-            ip = '.'.join(map(str, peers_bin[i:i+4]))
-            port = int.from_bytes(peers_bin[i+4:i+6], 'big')
-            peers.append((ip, port))
-        return peers
-
-    async def get_peers(self):
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self._get_peers_sync)
+        if event:
+            query += f"&event={event}"
+        if self.tracker_id:
+            query += f"&trackerid={quote(self.tracker_id, safe='')}"
+        url = self.url + ("&" if "?" in self.url else "?") + query
+        status, _, body = await self.client.get(url, timeout=timeout)
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}")
+        result = parse_announce_response(body)
+        if result["tracker_id"]:
+            self.tracker_id = result["tracker_id"]
+        return result
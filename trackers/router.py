@@ -1,15 +1,82 @@
+import asyncio
 from urllib.parse import urlparse
 
-from .http_tracker import HTTPTracker
-from .udp_tracker import UDPTracker
+from .announcer import Announcer
+from .http_client import HTTPClient
+from .udp_tracker import UDPTrackerClient
 
 
 async def get_peers(torrent, peer_id, port=6881):
-    scheme = urlparse(torrent.announce).scheme
-    if scheme == "udp":
-        tracker = UDPTracker(torrent.announce, torrent.info_hash, peer_id, port)
-        return await tracker.get_peers()
-    if scheme in ("http", "https"):
-        tracker = HTTPTracker(torrent, peer_id, port)
-        return await tracker.get_peers()
-    raise RuntimeError("Unsupported tracker protocol")
+    """One announce over the torrent's announce-list; the peers of the first tier that answers."""
+    announcer = Announcer(torrent, peer_id, port)
+    try:
+        return await announcer.announce()
+    finally:
+        await announcer.cancel()  # the other tiers would keep using the clients close() shuts
+        announcer.close()
+
+
+class TrackerClient:
+    """
+    Announcer shared by every torrent of a session: one peer id and port, one pool of keep-alive
+    HTTP connections, one UDP socket (with cached connection IDs), and a bound on concurrent
+    announces so adding hundreds of torrents does not flood the trackers.
+    """
+
+    def __init__(self, peer_id, port=6881, max_concurrent=8):
+        self.peer_id = peer_id
+        self.port = port
+        self.max_concurrent = max_concurrent
+        self.http = HTTPClient()
+        self.udp = UDPTrackerClient()
+        self._slots = None  # asyncio.Semaphore, created on first use inside the loop
+        self.announces = 0
+        self.failures = 0
+
+    def slots(self):
+        """Semaphore bounding concurrent announces."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        return self._slots
+
+    def stats(self):
+        return {
+            "announces": self.announces,
+            "failures": self.failures,
+            "http": self.http.stats(),
+            "udp": self.udp.stats(),
+        }
+
+    def announcer(self, torrent, counters=None, on_peers=None):
+        """A trackers.announcer.Announcer for torrent that uses this client's pool and limit."""
+        return Announcer(torrent, self.peer_id, self.port, client=self, counters=counters, on_peers=on_peers)
+
+    async def get_peers(self, torrent):
+        return await self.announcer(torrent).announce()
+
+    async def scrape(self, torrents):
+        """
+        Scrape every UDP tracker in the torrents' announce-lists, batching all info hashes that
+        share a tracker. Returns {info_hash: {tracker url: result}}; unreachable trackers are left out.
+        """
+        by_url = {}
+        for torrent in torrents:
+            for tier in torrent.announce_list:
+                for url in tier:
+                    if urlparse(url).scheme == "udp":
+                        by_url.setdefault(url, []).append(torrent.info_hash)
+        urls = list(by_url)
+        answers = await asyncio.gather(
+            *(self.udp.scrape(url, by_url[url]) for url in urls), return_exceptions=True,
+        )
+        results = {}
+        for url, answer in zip(urls, answers):
+            if isinstance(answer, BaseException):
+                continue
+            for info_hash, result in answer.items():
+                results.setdefault(info_hash, {})[url] = result
+        return results
+
+    def close(self):
+        self.http.close()
+        self.udp.close()
@@ -1,59 +1,294 @@
+"""
+UDP tracker protocol (BEP 15) over one shared socket.
+
+UDPTrackerClient owns a single datagram endpoint for every UDP tracker of a session; replies
+are matched to their request by transaction ID. Connection IDs are cached per tracker for
+their 60 s lifetime and concurrent connects to the same tracker are merged. Lost datagrams are
+retransmitted after 15 * 2 ** n seconds (n = 0..8), unless the caller's timeout ends the
+request first; scrapes batch up to 74 info hashes per packet. UDPTracker is the per-URL view the
+announcer uses.
+"""
 import asyncio
 import os
-import struct
 import socket
+import struct
+import time
 from urllib.parse import urlparse
 
+from .http_tracker import NUMWANT, parse_compact_peers
 
-class UDPTracker:
-    def __init__(self, announce_url, info_hash, peer_id, port=6881):
-        self.url = urlparse(announce_url)
-        self.info_hash = info_hash
-        self.peer_id = peer_id
-        self.port = port
-        self.transaction_id = os.urandom(4)
-
-    async def get_peers(self):
+PROTOCOL_ID = 0x41727101980
+ACTION_CONNECT = 0
+ACTION_ANNOUNCE = 1
+ACTION_SCRAPE = 2
+ACTION_ERROR = 3
+
+# BEP 15 announce event codes
+EVENTS = {None: 0, "completed": 1, "started": 2, "stopped": 3}
+
+CONNECTION_ID_LIFETIME = 60.0
+RETRANSMIT_BASE = 15.0  # seconds before the first retransmission, doubled after each one
+MAX_RETRANSMITS = 8
+MAX_SCRAPE = 74  # info hashes per scrape packet
+SCRAPE_TIMEOUT = 60.0  # a scrape gives up after the retransmissions at 15 s and 45 s
+
+
+class UDPTrackerError(RuntimeError):
+    """The tracker answered with an error action."""
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._received(data, addr)
+
+    def error_received(self, exc):
+        pass
+
+
+class UDPTrackerClient:
+    def __init__(self, retransmit_base=RETRANSMIT_BASE, max_retransmits=MAX_RETRANSMITS):
+        self.retransmit_base = retransmit_base
+        self.max_retransmits = max_retransmits
+        self.key = int.from_bytes(os.urandom(4), "big")
+        self._transport = None
+        self._opening = None  # asyncio.Lock, created on first use inside the loop
+        self._pending = {}  # transaction id -> (tracker addr, future)
+        self._connection_ids = {}  # tracker addr -> (connection id, expiry)
+        self._connecting = {}  # tracker addr -> task running a connect
+        self._addresses = {}  # (host, port) -> resolved tracker addr
+        self.scrapes = {}  # info_hash -> last scrape result (seeders, completed, leechers, time)
+
+        self.requests = 0
+        self.retransmits = 0
+        self.connects = 0
+        self.connection_id_hits = 0
+        self.errors = 0
+        self.stray = 0  # datagrams matching no pending transaction
+
+    async def _endpoint(self):
+        if self._transport is None:
+            if self._opening is None:
+                self._opening = asyncio.Lock()
+            async with self._opening:
+                if self._transport is None:
+                    loop = asyncio.get_running_loop()
+                    self._transport, _ = await loop.create_datagram_endpoint(
+                        lambda: _Protocol(self), local_addr=("0.0.0.0", 0), family=socket.AF_INET,
+                    )
+        return self._transport
+
+    async def resolve(self, url):
+        """(ip, port) of a udp:// tracker URL."""
+        parsed = urlparse(url)
+        host, port = parsed.hostname, parsed.port or 80
+        addr = self._addresses.get((host, port))
+        if addr is None:
+            loop = asyncio.get_running_loop()
+            infos = await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            if not infos:
+                raise RuntimeError(f"Cannot resolve {host}")
+            addr = self._addresses[(host, port)] = infos[0][4][:2]
+        return addr
+
+    def _received(self, data, addr):
+        if len(data) < 8:
+            self.stray += 1
+            return
+        transaction_id = struct.unpack_from("!I", data, 4)[0]
+        pending = self._pending.get(transaction_id)
+        if pending is None or pending[0] != addr[:2] or pending[1].done():
+            self.stray += 1
+            return
+        pending[1].set_result(data)
+
+    def _transaction_id(self):
+        while True:
+            transaction_id = int.from_bytes(os.urandom(4), "big")
+            if transaction_id not in self._pending:
+                return transaction_id
+
+    async def _exchange(self, addr, connection_id, action, body, timeout):
+        """Send one request and wait up to timeout for its reply; returns the reply datagram."""
+        transport = await self._endpoint()
+        transaction_id = self._transaction_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[transaction_id] = (addr, future)
+        try:
+            transport.sendto(struct.pack("!QII", connection_id, action, transaction_id) + body, addr)
+            data = await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(transaction_id, None)
+        reply_action = struct.unpack_from("!I", data)[0]
+        if reply_action == ACTION_ERROR:
+            self.errors += 1
+            raise UDPTrackerError(data[8:].decode("utf-8", "replace") or "Tracker error")
+        if reply_action != action:
+            raise RuntimeError(f"Unexpected UDP tracker action {reply_action}")
+        return data
+
+    async def _connect(self, addr, timeout):
+        self.connects += 1
+        data = await self._exchange(addr, PROTOCOL_ID, ACTION_CONNECT, b"", timeout)
+        if len(data) < 16:
+            raise RuntimeError("Short connect response")
+        connection_id = struct.unpack_from("!Q", data, 8)[0]
+        self._connection_ids[addr] = (connection_id, time.monotonic() + CONNECTION_ID_LIFETIME)
+        return connection_id
+
+    async def _connection_id(self, addr, timeout):
+        cached = self._connection_ids.get(addr)
+        if cached is not None and cached[1] > time.monotonic():
+            self.connection_id_hits += 1
+            return cached[0]
+        task = self._connecting.get(addr)
+        if task is None:
+            # Announces of many torrents to one tracker share a single connect.
+            task = asyncio.create_task(self._connect(addr, timeout))
+            self._connecting[addr] = task
+            task.add_done_callback(lambda t: self._connect_done(addr, t))
+        return await asyncio.shield(task)
+
+    def _connect_done(self, addr, task):
+        if self._connecting.get(addr) is task:
+            del self._connecting[addr]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter was cancelled
+
+    async def request(self, addr, action, body, timeout=None):
+        """
+        Connect (or reuse the cached connection ID) and send one request, retransmitting after
+        retransmit_base * 2 ** n seconds; raises asyncio.TimeoutError after max_retransmits, or
+        once timeout seconds (the whole request, connect included) have passed.
+        """
+        self.requests += 1
         loop = asyncio.get_running_loop()
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setblocking(False)
+        deadline = loop.time() + timeout if timeout is not None else None
+        n = 0
+        while True:
+            timeout = self.retransmit_base * 2 ** n
+            if deadline is not None:
+                timeout = min(timeout, deadline - loop.time())
+                if timeout <= 0:
+                    raise asyncio.TimeoutError
+            try:
+                connection_id = await self._connection_id(addr, timeout)
+                return await self._exchange(addr, connection_id, action, body, timeout)
+            except UDPTrackerError:
+                # Possibly a connection ID the tracker no longer accepts: connect afresh next time.
+                self._connection_ids.pop(addr, None)
+                raise
+            except asyncio.TimeoutError:
+                if n >= self.max_retransmits or (deadline is not None and loop.time() >= deadline):
+                    raise
+                n += 1
+                self.retransmits += 1
+
+    async def announce(
+        self, url, info_hash, peer_id, port, uploaded=0, downloaded=0, left=0, event=None,
+        numwant=NUMWANT, timeout=None,
+    ):
+        """
+        Announce; returns a dict like trackers.http_tracker.parse_announce_response. timeout:
+        seconds before giving up (None: the whole retransmission schedule).
+        """
+        addr = await self.resolve(url)
+        body = struct.pack(
+            "!20s20sQQQIIIiH",
+            info_hash, peer_id, downloaded, left, uploaded, EVENTS.get(event, 0), 0, self.key,
+            numwant, port,
+        )
+        data = await self.request(addr, ACTION_ANNOUNCE, body, timeout=timeout)
+        if len(data) < 20:
+            raise RuntimeError("Short announce response")
+        interval, leechers, seeders = struct.unpack_from("!III", data, 8)
+        return {
+            "peers": parse_compact_peers(data[20:]),
+            "interval": interval,
+            "min_interval": None,
+            "seeders": seeders,
+            "leechers": leechers,
+            "tracker_id": None,
+            "warning": None,
+        }
 
-        port = self.url.port or (80 if self.url.scheme == "udp" else 6969)
-        tracker_addr = (self.url.hostname, port)
+    async def _scrape_batch(self, addr, info_hashes, timeout):
+        data = await self.request(addr, ACTION_SCRAPE, b"".join(info_hashes), timeout=timeout)
+        now = time.time()
+        results = {}
+        for i, info_hash in enumerate(info_hashes):
+            offset = 8 + 12 * i
+            if offset + 12 > len(data):
+                break
+            seeders, completed, leechers = struct.unpack_from("!III", data, offset)
+            results[info_hash] = {"seeders": seeders, "completed": completed, "leechers": leechers, "time": now}
+        return results
 
-        connect_req = struct.pack(
-            "!Q I I",
-            0x41727101980,
-            0,
-            int.from_bytes(self.transaction_id, "big")
+    async def scrape(self, url, info_hashes, timeout=SCRAPE_TIMEOUT):
+        """
+        Scrape info_hashes in packets of up to MAX_SCRAPE, sent in parallel, each given up after
+        timeout seconds. Returns {info_hash: {"seeders", "completed", "leechers", "time"}} for
+        the packets that were answered (also kept in self.scrapes); raises the first error only
+        when none was.
+        """
+        addr = await self.resolve(url)
+        info_hashes = list(dict.fromkeys(info_hashes))
+        batches = [info_hashes[i:i + MAX_SCRAPE] for i in range(0, len(info_hashes), MAX_SCRAPE)]
+        answers = await asyncio.gather(
+            *(self._scrape_batch(addr, b, timeout) for b in batches), return_exceptions=True,
         )
-        await loop.sock_sendto(sock, connect_req, tracker_addr)
-        data, _ = await loop.sock_recvfrom(sock, 2048)
-
-        action, txn_id, conn_id = struct.unpack("!I I Q", data)
-        if action != 0 or txn_id != int.from_bytes(self.transaction_id, "big"):
-            sock.close()
-            raise RuntimeError("Invalid connect response")
-
-        transaction_id = int.from_bytes(os.urandom(4), "big")
-        announce_req = struct.pack(
-            "!Q I I 20s 20s Q Q Q I I I I H",
-            conn_id, 1, transaction_id,
-            self.info_hash, self.peer_id,
-            0, 0, 0, 0, 0, 0, -1 & 0xFFFFFFFF, self.port
+        results = {}
+        errors = []
+        for answer in answers:
+            if isinstance(answer, BaseException):
+                errors.append(answer)
+            else:
+                results.update(answer)
+        if errors and not results:
+            raise errors[0]
+        self.scrapes.update(results)
+        return results
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        for _, future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("UDP tracker client closed"))
+        self._pending.clear()
+        self._connection_ids.clear()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "retransmits": self.retransmits,
+            "connects": self.connects,
+            "connection_id_hits": self.connection_id_hits,
+            "errors": self.errors,
+            "stray": self.stray,
+            "pending": len(self._pending),
+            "scraped": len(self.scrapes),
+        }
+
+
+class UDPTracker:
+    """One udp:// tracker URL on a shared UDPTrackerClient."""
+
+    def __init__(self, announce_url, client=None):
+        self.url = announce_url
+        self.client = client or UDPTrackerClient()
+
+    async def announce(
+        self, info_hash, peer_id, port, uploaded=0, downloaded=0, left=0, event=None, numwant=NUMWANT,
+        timeout=None,
+    ):
+        return await self.client.announce(
+            self.url, info_hash, peer_id, port, uploaded=uploaded, downloaded=downloaded, left=left,
+            event=event, numwant=numwant, timeout=timeout,
         )
-        await loop.sock_sendto(sock, announce_req, tracker_addr)
-        data, _ = await loop.sock_recvfrom(sock, 4096)
-        sock.close()
-
-        action, txn_id, interval, leechers, seeders = struct.unpack("!I I I I I", data[:20])
-        if action != 1 or txn_id != transaction_id:
-            raise RuntimeError("Invalid announce response")
-
-        peers_bin = data[20:]
-        peers = []
-        for i in range(0, len(peers_bin), 6):
-            ip = socket.inet_ntoa(peers_bin[i:i+4])
-            port = struct.unpack("!H", peers_bin[i+4:i+6])[0]
-            peers.append((ip, port))
-        return peers
+
+    async def scrape(self, info_hashes, timeout=SCRAPE_TIMEOUT):
+        return await self.client.scrape(self.url, info_hashes, timeout=timeout)